@@ -0,0 +1,95 @@
+"""
+Assignment of dedicated CPU sets to encode jobs
+"""
+
+import os
+import glob
+import re
+
+__NODE_PATH = r"/sys/devices/system/node/node*/cpulist"
+
+"""
+Return True if processes can be pinned to CPUs on this platform
+"""
+def affinity_supported():
+    return hasattr(os, "sched_setaffinity") and hasattr(os, "sched_getaffinity")
+
+"""
+Parse a Linux cpu list such as 0-3,8,10-11
+@return a list of CPU numbers
+"""
+def parse_cpulist(cpulist):
+    cpus = []
+    for part in cpulist.strip().split(","):
+        if not part:
+            continue
+        bounds = part.split("-")
+        cpus.extend(range(int(bounds[0]), int(bounds[-1]) + 1))
+    return cpus
+
+"""
+Return the CPUs of each NUMA node as a list of lists. All CPUs are on a single node if the topology can't be read
+@param cpus: CPUs the process is allowed to use
+"""
+def numa_nodes(cpus):
+    cpus = set(cpus)
+    nodes = []
+    for path in sorted(glob.glob(__NODE_PATH), key = lambda p: int(re.search(r"node(\d+)", p).group(1))):
+        try:
+            with open(path) as f:
+                node = [cpu for cpu in parse_cpulist(f.read()) if cpu in cpus]
+        except (OSError, ValueError):
+            return [sorted(cpus)]
+        if node:
+            nodes.append(node)
+    covered = set(cpu for node in nodes for cpu in node)
+    if not nodes or covered != cpus:
+        return [sorted(cpus)]
+    return nodes
+
+class CpuAllocator:
+    """Hand out disjoint CPU sets to jobs. A set is taken from a single NUMA node whenever one has enough free CPUs"""
+
+    """
+    @param cpus: CPUs that may be handed out. Defaults to the CPUs this process is allowed to run on
+    """
+    def __init__(self, cpus = None):
+        if cpus is None:
+            cpus = os.sched_getaffinity(0)
+        self._nodes = numa_nodes(cpus)
+        self._free = set(cpu for node in self._nodes for cpu in node)
+
+    """
+    Return the total number of CPUs managed by the allocator
+    """
+    def num_cpus(self):
+        return sum(len(node) for node in self._nodes)
+
+    """
+    Reserve CPUs for a job
+    @param n: Number of CPUs wanted. Limited to the number of CPUs managed by the allocator
+    @return a sorted tuple of CPUs or None if there aren't enough free CPUs
+    """
+    def allocate(self, n):
+        n = max(1, min(n, self.num_cpus()))
+        if len(self._free) < n:
+            return None
+        free_nodes = [[cpu for cpu in node if cpu in self._free] for node in self._nodes]
+        # Use the node with the least free CPUs that still fits the job so that large jobs can get a whole node later
+        fits = [node for node in free_nodes if len(node) >= n]
+        if fits:
+            cpus = min(fits, key = len)[:n]
+        else:
+            # Spread over as few nodes as possible
+            cpus = []
+            for node in sorted(free_nodes, key = len, reverse = True):
+                cpus.extend(node[:n - len(cpus)])
+        self._free.difference_update(cpus)
+        return tuple(sorted(cpus))
+
+    """
+    Return CPUs reserved with allocate
+    """
+    def release(self, cpus):
+        if cpus:
+            self._free.update(cpus)
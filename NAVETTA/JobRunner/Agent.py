@@ -0,0 +1,117 @@
+"""
+Worker agent that runs encoder commands for a coordinator. Start with:
+    python -m JobRunner.Agent <address> [cores]
+where address is the "host:port" or Unix socket path given in cfg.job_coordinator of the coordinator.
+The agent reconnects after the coordinator finishes so it can be left running between test runs
+"""
+
+import asyncio
+import re
+import socket
+import subprocess as sp
+import sys
+from os import cpu_count
+
+import cfg
+from .Engine import ProcessEngine, ProcessKilledError
+from .Remote import parse_address, send_message, read_message, encode_data, ProtocolError
+
+"""
+Remove lines matching the regex from process output
+@return (remaining output, number of removed lines)
+"""
+def _drop_lines(data, regex):
+    if data is None or not regex:
+        return (data, 0)
+    line_ex = re.compile(regex.encode())
+    lines = data.split(b"\n")
+    kept = [line for line in lines if not line_ex.search(line)]
+    return (b"\n".join(kept), len(lines) - len(kept))
+
+"""
+Run a single command requested by the coordinator and send back the reply
+"""
+async def _run_cmd(engine, writer, msg):
+    reply = {"type": "done", "id": msg["id"]}
+    try:
+        (ret, out, err, usage) = await engine.run(msg["cmd"], stdout = sp.PIPE if msg["stdout"] else sp.DEVNULL, stderr = sp.PIPE if msg["stderr"] else sp.DEVNULL)
+        drop = msg.get("drop") or {}
+        (out, out_dropped) = _drop_lines(out, drop.get("stdout"))
+        (err, err_dropped) = _drop_lines(err, drop.get("stderr"))
+        reply.update({"returncode": ret, "stdout": encode_data(out), "stderr": encode_data(err), "usage": usage,
+                      "dropped": {"stdout": out_dropped, "stderr": err_dropped}})
+    except ProcessKilledError as e:
+        reply["signal"] = e.signal
+    except Exception as e:
+        reply["error"] = repr(e)
+    await send_message(writer, reply)
+
+"""
+Serve a single coordinator connection until it is closed
+"""
+async def _serve(reader, writer, cores):
+    engine = ProcessEngine(memory_limit = cfg.job_memory_limit)
+    tasks = {}
+    await send_message(writer, {"type": "hello", "name": socket.gethostname(), "cores": cores})
+    try:
+        while True:
+            msg = await read_message(reader)
+            if msg is None:
+                break
+            if msg["type"] == "run":
+                task = asyncio.ensure_future(_run_cmd(engine, writer, msg))
+                tasks[msg["id"]] = task
+                task.add_done_callback(lambda _, cmd_id = msg["id"]: tasks.pop(cmd_id, None))
+            elif msg["type"] == "cancel" and msg["id"] in tasks:
+                tasks[msg["id"]].cancel() #Kills the process
+    finally:
+        # Don't leave processes of a lost coordinator running
+        for task in list(tasks.values()):
+            task.cancel()
+        if tasks:
+            await asyncio.wait(list(tasks.values()))
+        writer.close()
+
+"""
+Connect to a coordinator and run the commands it sends. Reconnects when the connection is closed
+@param address: Coordinator address. See Remote.parse_address
+@param cores: Number of cores offered to the coordinator. Defaults to the number of CPUs
+@param retry: Seconds to wait before connecting again
+"""
+async def run_agent(address, cores = None, retry = 5):
+    cores = cores if cores else cpu_count()
+    addr = parse_address(address)
+    connected = False
+    while True:
+        try:
+            if addr[0] == "tcp":
+                (reader, writer) = await asyncio.open_connection(addr[1], addr[2])
+            else:
+                (reader, writer) = await asyncio.open_unix_connection(addr[1])
+        except OSError:
+            if connected:
+                print("Waiting for coordinator at {}...".format(address))
+                connected = False
+            await asyncio.sleep(retry)
+            continue
+        connected = True
+        print("Connected to coordinator at {} with {} cores.".format(address, cores))
+        try:
+            await _serve(reader, writer, cores)
+        except ProtocolError as err:
+            print("Invalid message from coordinator at {}: {}".format(address, err))
+        except ConnectionError:
+            pass
+        print("Coordinator at {} disconnected.".format(address))
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python -m JobRunner.Agent <host:port|socket path> [cores]")
+        return
+    try:
+        asyncio.run(run_agent(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else None))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Estimate encode job run times for ordering jobs
+"""
+
+from pathlib import Path
+from statistics import median
+from ast import literal_eval
+import contextlib
+import json
+import os
+import re
+import time
+
+import cfg
+
+class CostModel:
+    """Estimate job run times from earlier encode times of the same binary, sequence and qp. Falls back to the amount of pixels to encode"""
+
+    __HISTORY_FILE = r"job_times.json"
+    __MAX_HISTORY = 10 # Number of times stored per job key
+    __LOCK_STALE = 60 # Seconds after which the history lock of another process is considered abandoned
+
+    __seq_regex = r"_(\d+)x(\d+)_(\d+)(?:_(\d+))?[_.]"
+    __DEF_SECONDS = 10 # Assumed sequence length if the frame count is not in the filename
+    __DEF_BYTES_PER_UNIT = 0.05 # Assumed bitstream and log bytes per pixel if there is no history of output sizes
+
+    def __init__(self):
+        self._history = {}
+        self._recorded = {} # History added since the file was read. Merged with the file on save so concurrent runs keep each other's times
+        self._load()
+
+    """
+    Path of the file holding encode time history
+    """
+    @classmethod
+    def _history_path(cls):
+        return Path(cfg.results + cls.__HISTORY_FILE)
+
+    def _load(self):
+        self._history = self._read()
+
+    def _read(self):
+        fpath = self._history_path()
+        if fpath.is_file():
+            with fpath.open(mode = 'r') as file:
+                return json.load(file)
+        return {}
+
+    """
+    Hold a lock file next to the history so only one process at a time merges its times into it
+    """
+    @contextlib.contextmanager
+    def _locked(self):
+        lock = self._history_path().with_name(self.__HISTORY_FILE + ".lock")
+        while True:
+            try:
+                os.close(os.open(str(lock), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - lock.stat().st_mtime > self.__LOCK_STALE:
+                        lock.unlink() #Left behind by a process that was killed while saving
+                except OSError:
+                    pass #Released meanwhile
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            lock.unlink()
+
+    """
+    Write encode time history to file. Times recorded by other processes since the file was read are kept
+    """
+    def save(self):
+        fpath = self._history_path()
+        if not fpath.parent.exists():
+            fpath.parent.mkdir(parents = True)
+        with self._locked():
+            history = self._read()
+            for (key, new) in self._recorded.items():
+                entry = history.setdefault(key, {"times": [], "units": 0})
+                entry["times"] = (entry["times"] + new["times"])[-self.__MAX_HISTORY:]
+                entry["units"] = new["units"]
+                if new.get("size") is not None:
+                    entry["size"] = new["size"]
+            tmp = fpath.with_name(fpath.name + ".tmp")
+            with tmp.open(mode = 'w') as file:
+                json.dump(history, file, indent = 2)
+            tmp.replace(fpath)
+        (self._history, self._recorded) = (history, {})
+
+    @staticmethod
+    def _key(job):
+        return "|".join((str(job.cmd[0]), str(job.seq), str(job.qp)))
+
+    """
+    Return the number of pixels encoded by the job based on the resolution and frame count in the input file names
+    @return pixel count or 0 if it cannot be determined
+    """
+    @classmethod
+    def job_units(cls, job):
+        units = 0
+        for inp in job.inputs:
+            match = re.search(cls.__seq_regex, str(inp)) if inp else None
+            if match:
+                (width, height, fps, frames) = match.group(1, 2, 3, 4)
+                frames = int(frames) if frames else int(fps) * cls.__DEF_SECONDS
+                units += int(width) * int(height) * frames
+        return units
+
+    """
+    Add the encode time of a finished job to the history
+    @param time: Encode time in seconds or None if not known
+    @param size: Bytes written by the job or None if not known
+    """
+    def record(self, job, time, size = None):
+        if time is None:
+            return
+        for history in (self._history, self._recorded):
+            entry = history.setdefault(self._key(job), {"times": [], "units": 0})
+            entry["times"] = (entry["times"] + [float(time)])[-self.__MAX_HISTORY:]
+            entry["units"] = self.job_units(job)
+            if size is not None:
+                entry["size"] = size
+
+    """
+    Add encode times of a test with existing results to the history
+    """
+    def record_test(self, test):
+        for job in test._get_jobs():
+            res = test._results.get(job.seq, {}).get(job.qp)
+            if res is not None:
+                self.record(job, test._get_result_time(res))
+
+    """
+    Return seconds per pixel based on history. Used to scale estimates of jobs without history
+    """
+    def _rate(self):
+        times = sum(median(entry["times"]) for entry in self._history.values() if entry["units"])
+        units = sum(entry["units"] for entry in self._history.values() if entry["units"])
+        return times / units if units else 1.0
+
+    """
+    Return the estimated run time of the job
+    @param rate: Seconds per pixel used for jobs without history. Calculated from the history if not given
+    """
+    def estimate(self, job, rate = None):
+        entry = self._history.get(self._key(job))
+        if entry and entry["times"]:
+            return median(entry["times"])
+        return self.job_units(job) * (rate if rate is not None else self._rate())
+
+    """
+    Return the estimated run times of the given jobs
+    @return a list with the estimate of each job or None for jobs that can't be estimated because there is no usable history
+    """
+    def estimate_jobs(self, jobs):
+        has_rate = any(entry["units"] for entry in self._history.values())
+        rate = self._rate() if has_rate else None
+        estimates = []
+        for job in jobs:
+            entry = self._history.get(self._key(job))
+            if entry and entry["times"]:
+                estimates.append(median(entry["times"]))
+            elif has_rate and self.job_units(job) > 0:
+                estimates.append(self.job_units(job) * rate)
+            else:
+                estimates.append(None)
+        return estimates
+
+    """
+    Return True if the estimate of the job is based on timing history and not a guess
+    """
+    def has_history(self, job):
+        if self._key(job) in self._history:
+            return True
+        return any(entry["units"] for entry in self._history.values()) and self.job_units(job) > 0
+
+    """
+    Return the estimated number of bytes the job writes to disk
+    """
+    def estimate_size(self, job):
+        entry = self._history.get(self._key(job))
+        if entry and entry.get("size") is not None:
+            return entry["size"]
+        sizes = [entry for entry in self._history.values() if entry["units"] and entry.get("size") is not None]
+        units = sum(entry["units"] for entry in sizes)
+        rate = sum(entry["size"] for entry in sizes) / units if units else self.__DEF_BYTES_PER_UNIT
+        return self.job_units(job) * rate
+
+    """
+    Sort jobs to longest job first order. Jobs with equal estimates are ordered by ascending qp
+    """
+    def sort_jobs(self, jobs):
+        rate = self._rate()
+        return sorted(jobs, key = lambda job: (-self.estimate(job, rate), literal_eval(job.qp)))
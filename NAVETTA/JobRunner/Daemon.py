@@ -0,0 +1,136 @@
+"""
+Machine wide job daemon shared by all NAVETTA processes on a host. Start with:
+    python -m JobRunner.Daemon <socket path> [cores]
+and set cfg.job_daemon to the same path. Schedulers lease cores from the daemon before running a job, so concurrent test scripts share one core budget.
+A job with the same result cache key as a job another process is running waits for that job and reads the result from the result cache
+"""
+
+import asyncio
+import os
+import sys
+
+import cfg
+from .Affinity import CpuAllocator, affinity_supported
+from .Remote import write_message, read_message
+
+class JobDaemon:
+    """Grant core leases first come first served within a global core budget and track which process runs each job key"""
+
+    """
+    @param path: Unix socket path to listen on
+    @param cores: Global core budget. Defaults to cfg.core_budget
+    """
+    def __init__(self, path, cores = None):
+        self._path = path
+        self._cores = max(1, cores if cores else cfg.core_budget)
+        self._free = self._cores
+        self._cpus = CpuAllocator() if cfg.job_affinity and affinity_supported() else None
+        self._queue = [] #Waiting (client, acquire message) pairs
+        self._owners = {} #Client running the job of each key
+        self._waiters = {} #(client, acquire message) pairs waiting for a job run by another client
+        self._leases = {} #(cores, cpus) of each granted (client, lease id)
+
+    """
+    Serve clients until interrupted
+    """
+    async def serve(self):
+        if os.path.exists(self._path):
+            os.unlink(self._path) #Socket left by an earlier daemon
+        server = await asyncio.start_unix_server(self._handle, self._path)
+        print("Job daemon listening on {} with {} cores.".format(self._path, self._cores))
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                msg = await read_message(reader)
+                if msg is None:
+                    break
+                if msg["type"] == "acquire":
+                    key = msg.get("key")
+                    if key and self._owners.get(key, writer) is not writer:
+                        self._waiters.setdefault(key, []).append((writer, msg))
+                    else:
+                        self._queue.append((writer, msg))
+                elif msg["type"] == "release":
+                    self._release(writer, msg["id"])
+                elif msg["type"] == "finish":
+                    self._finish(writer, msg["key"], msg["status"])
+                self._grant()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            # Free everything held by a client that has exited
+            self._queue = [(client, msg) for (client, msg) in self._queue if client is not writer]
+            for (key, waiters) in self._waiters.items():
+                waiters[:] = [(client, msg) for (client, msg) in waiters if client is not writer]
+            for (client, lease_id) in [lease for lease in self._leases if lease[0] is writer]:
+                self._release(client, lease_id)
+            for key in [key for (key, client) in self._owners.items() if client is writer]:
+                self._finish(writer, key, None)
+            self._grant()
+            writer.close()
+
+    """
+    Return the cores of a lease. Requests that have not been granted yet are dropped
+    """
+    def _release(self, client, lease_id):
+        self._queue = [(c, msg) for (c, msg) in self._queue if c is not client or msg["id"] != lease_id]
+        for waiters in self._waiters.values():
+            waiters[:] = [(c, msg) for (c, msg) in waiters if c is not client or msg["id"] != lease_id]
+        lease = self._leases.pop((client, lease_id), None)
+        if lease:
+            self._free += lease[0]
+            if self._cpus:
+                self._cpus.release(lease[1])
+
+    """
+    Mark the job of the key finished and hand its status to the clients waiting for it. Waiters of failed jobs ask for cores again
+    """
+    def _finish(self, client, key, status):
+        if self._owners.get(key) is not client:
+            return
+        del self._owners[key]
+        for (waiter, msg) in self._waiters.pop(key, []):
+            write_message(waiter, {"type": "shared", "id": msg["id"], "status": status})
+
+    """
+    Grant leases to waiting requests in order while cores are free
+    """
+    def _grant(self):
+        for (client, msg) in list(self._queue):
+            if self._free <= 0:
+                break
+            cores = max(1, min(msg["cores"], self._cores))
+            if cores > self._free:
+                continue
+            key = msg.get("key")
+            if key and self._owners.get(key, client) is not client:
+                # Another client started the same job while the request was waiting
+                self._queue.remove((client, msg))
+                self._waiters.setdefault(key, []).append((client, msg))
+                continue
+            cpus = None
+            if self._cpus:
+                cpus = self._cpus.allocate(cores)
+                if cpus is None:
+                    continue
+            self._queue.remove((client, msg))
+            self._free -= cores
+            self._leases[(client, msg["id"])] = (cores, cpus)
+            if key:
+                self._owners[key] = client
+            write_message(client, {"type": "granted", "id": msg["id"], "cpus": cpus})
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python -m JobRunner.Daemon <socket path> [cores]")
+        return
+    try:
+        asyncio.run(JobDaemon(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else None).serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Connection of a scheduler to the machine wide job daemon. See Daemon.py
+"""
+
+import asyncio
+
+from .Remote import write_message, read_message
+
+class DaemonClient:
+    """Connection of a scheduler to the job daemon"""
+
+    def __init__(self, path):
+        self._path = path
+        self._writer = None
+        self._replies = {}
+        self._next_id = 0
+        self._reader_task = None
+
+    """
+    Connect to the daemon
+    @raise OSError if the daemon is not running
+    """
+    async def connect(self):
+        (reader, self._writer) = await asyncio.open_unix_connection(self._path)
+        self._reader_task = asyncio.ensure_future(self._read(reader))
+        return self
+
+    async def _read(self, reader):
+        try:
+            while True:
+                msg = await read_message(reader)
+                if msg is None:
+                    break
+                reply = self._replies.pop(msg["id"], None)
+                if reply and not reply.done():
+                    reply.set_result(msg)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            for reply in self._replies.values():
+                if not reply.done():
+                    reply.set_exception(ConnectionError("Connection to job daemon at {} was lost".format(self._path)))
+            self._replies = {}
+
+    """
+    Wait for cores or for the result of the same job run by another process
+    @param cores: Number of cores the job uses
+    @param key: Result cache key of the job or None if it should not be shared
+    @return the daemon reply. {"type": "granted", "id": <lease id>, "cpus": <CPUs or None>} if the job should be run or
+            {"type": "shared", "status": <job status>} if another process ran it
+    """
+    async def acquire(self, cores, key = None):
+        if self._reader_task is None or self._reader_task.done():
+            raise ConnectionError("Not connected to job daemon at {}".format(self._path))
+        msg_id = self._next_id
+        self._next_id += 1
+        reply = asyncio.get_running_loop().create_future()
+        self._replies[msg_id] = reply
+        write_message(self._writer, {"type": "acquire", "id": msg_id, "cores": cores, "key": key})
+        try:
+            return await reply
+        except asyncio.CancelledError:
+            # A lease granted after cancellation is not used
+            self._replies.pop(msg_id, None)
+            self.release(msg_id)
+            raise
+
+    """
+    Return the cores of a granted lease
+    """
+    def release(self, lease_id):
+        if self._writer is not None and not self._writer.is_closing():
+            write_message(self._writer, {"type": "release", "id": lease_id})
+
+    """
+    Tell processes waiting for the job of the key that it is finished. The result needs to be in the result cache before a successful job is finished
+    """
+    def finish(self, key, status):
+        if self._writer is not None and not self._writer.is_closing():
+            write_message(self._writer, {"type": "finish", "key": key, "status": status})
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._reader_task is not None:
+            await self._reader_task
@@ -0,0 +1,333 @@
+"""
+Asyncio based engine for running and supervising encoder and decoder processes
+"""
+
+import asyncio
+import subprocess as sp
+import signal
+import os
+import time
+import tempfile
+import threading
+try:
+    import resource
+except ImportError:
+    resource = None # Memory limits are only supported on Unix
+
+class ProcessKilledError(RuntimeError):
+    """Raised when a child process is terminated by a signal"""
+
+    def __init__(self, cmd, sig):
+        self.cmd = cmd
+        self.signal = sig
+        super().__init__("Process {} was killed by signal {}".format(cmd[0], sig))
+
+# Resource usage keys
+WALL = r"wall" # Wall clock time in seconds
+UTIME = r"utime" # User CPU time in seconds
+STIME = r"stime" # System CPU time in seconds
+MAXRSS = r"maxrss" # Peak resident set size in KB
+CPUS = r"cpus" # CPUs the process was pinned to or None
+PID = r"pid" # Process id
+
+class ProcessEngine:
+    """Run child processes from a single event loop with an optional limit on the number of processes running at the same time"""
+
+    __CHUNK = 1 << 16 # Bytes read from output pipes at a time
+    __STREAM_WAIT = 1 # Seconds to wait for output after the process has exited. Children that inherited the pipe may keep it open
+
+    """
+    @param max_processes: Maximum number of processes running at the same time. None for no limit
+    @param memory_limit: Address space limit of each process in MB. None for no limit
+    """
+    def __init__(self, max_processes = None, memory_limit = None):
+        self._limit = asyncio.Semaphore(max_processes) if max_processes else None
+        self._memory_limit = memory_limit if resource else None
+
+    """
+    Run a process to completion. The process is killed if the timeout is reached or the calling task is cancelled
+    @param cmd: Command line of the process
+    @param stdout/stderr: subprocess.PIPE, subprocess.DEVNULL, an open file, None to inherit or a function that is called with each chunk of output while the process runs
+    @param timeout: Wall clock time limit in seconds or None
+    @param cpus: CPUs the process is pinned to or None to use any CPU. Ignored where os.sched_setaffinity is not available
+    @return (returncode, stdout data, stderr data, usage). Data is None for streams that are not piped.
+            usage is a dict with the WALL, UTIME, STIME, MAXRSS, CPUS and PID of the process. CPU times and MAXRSS are None where os.wait4 is not available
+    @raise asyncio.TimeoutError if the timeout is reached
+    @raise ProcessKilledError if the process is terminated by a signal
+    """
+    async def run(self, cmd, stdout = sp.DEVNULL, stderr = sp.DEVNULL, timeout = None, cpus = None):
+        if not hasattr(os, "sched_setaffinity"):
+            cpus = None
+        if self._limit:
+            async with self._limit:
+                return await self._run(cmd, stdout, stderr, timeout, cpus)
+        return await self._run(cmd, stdout, stderr, timeout, cpus)
+
+    async def _run(self, cmd, stdout, stderr, timeout, cpus):
+        if not hasattr(os, "wait4"):
+            return await self._run_no_usage(cmd, stdout, stderr, timeout)
+        # Piped output is collected in temporary files so the process can be reaped with os.wait4
+        out_file = tempfile.TemporaryFile() if stdout == sp.PIPE else None
+        err_file = tempfile.TemporaryFile() if stderr == sp.PIPE else None
+        (out_arg, out_stream) = self._stream_pipe(stdout)
+        (err_arg, err_stream) = self._stream_pipe(stderr)
+        try:
+            start = time.perf_counter()
+            try:
+                # Each process gets its own session so that the whole process group can be killed
+                proc = sp.Popen(cmd, stdin = sp.DEVNULL, stdout = out_file if out_file else out_arg, stderr = err_file if err_file else err_arg,
+                                start_new_session = True,
+                                preexec_fn = self._preexec(cpus))
+            except BaseException:
+                for stream in (out_stream, err_stream):
+                    if stream:
+                        stream.close()
+                raise
+            finally:
+                for (arg, stream) in ((out_arg, out_stream), (err_arg, err_stream)):
+                    if stream:
+                        os.close(arg) #The child has its own copy of the write end
+            streams = [stream.start() for stream in (out_stream, err_stream) if stream]
+            waiter = self._wait4(proc.pid)
+            try:
+                (status, rusage) = await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            except BaseException:
+                # Timeout or cancellation. Don't leave the process or its children running
+                self._kill(proc)
+                await waiter
+                raise
+            finally:
+                proc.returncode = os.waitstatus_to_exitcode(waiter.result()[0]) if waiter.done() else None
+                await self._finish_streams(streams)
+            usage = {WALL: time.perf_counter() - start,
+                     UTIME: rusage.ru_utime,
+                     STIME: rusage.ru_stime,
+                     MAXRSS: rusage.ru_maxrss,
+                     CPUS: list(cpus) if cpus else None,
+                     PID: proc.pid}
+            if proc.returncode < 0:
+                raise ProcessKilledError(cmd, -proc.returncode)
+            return (proc.returncode, self._read(out_file), self._read(err_file), usage)
+        finally:
+            for file in (out_file, err_file):
+                if file:
+                    file.close()
+
+    """
+    Run a process without collecting CPU times or memory usage
+    """
+    async def _run_no_usage(self, cmd, stdout, stderr, timeout):
+        start = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(*cmd, stdin = sp.DEVNULL, stdout = sp.PIPE if callable(stdout) else stdout, stderr = sp.PIPE if callable(stderr) else stderr)
+        async def collect(reader, callback):
+            if reader is None:
+                return None
+            chunks = []
+            while True:
+                data = await reader.read(self.__CHUNK)
+                if not data:
+                    break
+                if callback:
+                    callback(data)
+                else:
+                    chunks.append(data)
+            return None if callback else b"".join(chunks)
+        async def communicate():
+            (out, err, _) = await asyncio.gather(collect(proc.stdout, stdout if callable(stdout) else None),
+                                                 collect(proc.stderr, stderr if callable(stderr) else None),
+                                                 proc.wait())
+            return (out, err)
+        try:
+            (out, err) = await asyncio.wait_for(communicate(), timeout)
+        except BaseException:
+            if proc.returncode is None:
+                self._kill(proc)
+                await proc.wait()
+            raise
+        if proc.returncode < 0:
+            raise ProcessKilledError(cmd, -proc.returncode)
+        return (proc.returncode, out, err, {WALL: time.perf_counter() - start, UTIME: None, STIME: None, MAXRSS: None, CPUS: None, PID: proc.pid})
+
+    """
+    Return a future for the (status, rusage) of the given child process once it exits.
+    A pidfd is used for waking up the event loop when available. Otherwise the process is waited for in a thread
+    """
+    @staticmethod
+    def _wait4(pid):
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        def set_result(result):
+            if not waiter.done():
+                waiter.set_result(result)
+        def set_exception(err):
+            if not waiter.done():
+                waiter.set_exception(err)
+        try:
+            pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            pidfd = None
+        if pidfd is not None:
+            def on_exit():
+                loop.remove_reader(pidfd)
+                os.close(pidfd)
+                try:
+                    (_, status, rusage) = os.wait4(pid, 0)
+                    set_result((status, rusage))
+                except OSError as err:
+                    set_exception(err)
+            loop.add_reader(pidfd, on_exit)
+        else:
+            def wait_thread():
+                try:
+                    (_, status, rusage) = os.wait4(pid, 0)
+                    loop.call_soon_threadsafe(set_result, (status, rusage))
+                except OSError as err:
+                    loop.call_soon_threadsafe(set_exception, err)
+            threading.Thread(target = wait_thread, daemon = True).start()
+        return waiter
+
+    """
+    Create a pipe for output that is handled by a function
+    @return (write end for the child or the stream argument as is, _OutputStream or None)
+    """
+    def _stream_pipe(self, stream):
+        if not callable(stream):
+            return (stream, None)
+        (read_fd, write_fd) = os.pipe()
+        return (write_fd, _OutputStream(read_fd, stream, self.__CHUNK))
+
+    """
+    Wait for the output of an exited process to be handled
+    @raise the first exception raised by an output function
+    """
+    async def _finish_streams(self, streams):
+        if not streams:
+            return
+        await asyncio.wait([stream.done for stream in streams], timeout = self.__STREAM_WAIT)
+        for stream in streams:
+            stream.close()
+        for stream in streams:
+            if stream.error:
+                raise stream.error
+
+    """
+    Return the contents of a temporary output file or None
+    """
+    @staticmethod
+    def _read(file):
+        if file is None:
+            return None
+        file.seek(0)
+        return file.read()
+
+    """
+    Return the function that sets resource limits and CPU affinity in the child process before the command is executed or None if nothing needs to be set
+    """
+    def _preexec(self, cpus):
+        if not self._memory_limit and not cpus:
+            return None
+        def preexec():
+            if self._memory_limit:
+                limit = self._memory_limit * 1024 * 1024
+                resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+            if cpus:
+                os.sched_setaffinity(0, cpus)
+        return preexec
+
+    """
+    Kill the process group of the given process. The process is signalled directly so that it is not reaped before os.wait4
+    """
+    @staticmethod
+    def _kill(proc):
+        if not hasattr(os, "killpg"):
+            proc.kill()
+            return
+        for kill in (os.killpg, os.kill):
+            try:
+                kill(proc.pid, signal.SIGKILL)
+                return
+            except (ProcessLookupError, PermissionError):
+                pass
+
+class _OutputStream:
+    """Pass data read from a pipe to a function in the event loop"""
+
+    def __init__(self, fd, callback, chunk):
+        self._fd = fd
+        self._callback = callback
+        self._chunk = chunk
+        self.done = None # Future that is set when the pipe is closed by all writers
+        self.error = None # First exception raised by the callback
+        self._thread = None # Thread reading the pipe if the event loop can't watch it. The thread owns and closes the pipe
+        self._stop = threading.Event()
+
+    """
+    Start reading the pipe
+    @return self
+    """
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self.done = loop.create_future()
+        try:
+            loop.add_reader(self._fd, self._read)
+        except (NotImplementedError, ValueError, OSError):
+            # Event loop can't watch pipes. Read in a thread
+            fd = self._fd
+            def read_thread():
+                try:
+                    while not self._stop.is_set():
+                        try:
+                            data = os.read(fd, self._chunk)
+                        except OSError:
+                            data = b""
+                        loop.call_soon_threadsafe(self._handle, data)
+                        if not data:
+                            break
+                except RuntimeError:
+                    pass #Event loop closed
+                finally:
+                    os.close(fd)
+            self._thread = threading.Thread(target = read_thread, daemon = True)
+            self._thread.start()
+        return self
+
+    def _read(self):
+        try:
+            data = os.read(self._fd, self._chunk)
+        except OSError:
+            data = b""
+        self._handle(data)
+
+    def _handle(self, data):
+        if self._fd is None:
+            return
+        if not data:
+            self.close()
+            return
+        if self.error is None:
+            try:
+                self._callback(data)
+            except Exception as err:
+                self.error = err #Keep reading so the process does not block on a full pipe
+
+    """
+    Stop reading and close the pipe. A reading thread closes the pipe itself once its read returns, since a process that left
+    the pipe open in a child may keep the read blocked
+    """
+    def close(self):
+        if self._fd is None:
+            return
+        if self._thread:
+            self._stop.set()
+            self._fd = None
+            if not self.done.done():
+                self.done.set_result(None)
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(self._fd)
+        except (NotImplementedError, ValueError, OSError, RuntimeError):
+            pass
+        os.close(self._fd)
+        self._fd = None
+        if self.done is not None and not self.done.done():
+            self.done.set_result(None)
@@ -0,0 +1,221 @@
+"""
+Build a timeline and utilisation report from a job event log written by the scheduler (cfg.job_event_log). Run with:
+    python -m JobRunner.EventReport <event log> [output .xlsx] [--run <run id>]
+"""
+
+import sys
+
+import openpyxl as xl
+from openpyxl.chart import BarChart, LineChart, Reference
+
+from .Events import read_events, RUN_START, STARTED, EXITED, VALIDATE_START, VALIDATE_END, RETRY, CACHED, RESUMED
+from .Engine import UTIME, STIME
+
+# Interval phases
+ENCODE = r"encode"
+VALIDATE = r"validate"
+
+__MAX_STEPS = 500 # Number of time steps in the utilisation table
+__MAX_CHART_ROWS = 300 # Number of intervals drawn in the timeline chart
+
+"""
+Rebuild the encode and validation intervals of jobs from events
+@param events: Event dicts as returned by read_events
+@return a dict with
+        "intervals": list of interval dicts with test, seq, qp, phase, start and end times in seconds from the first event, cores, cpus, agent, cpu (CPU seconds or None) and status
+        "core_budget": Largest core budget of the runs
+        "runs": ids of the runs in the events
+        "retries", "cached", "resumed": number of such events
+"""
+def build_timeline(events):
+    start = min((event["time"] for event in events), default = 0.0)
+    open_intervals = {}
+    intervals = []
+    counts = {RETRY: 0, CACHED: 0, RESUMED: 0}
+    core_budget = 0
+    runs = []
+    for event in events:
+        kind = event.get("event")
+        if kind == RUN_START:
+            core_budget = max(core_budget, event.get("core_budget") or 0)
+            runs.append(event["run"])
+        elif kind in counts:
+            counts[kind] += 1
+        elif kind in (STARTED, VALIDATE_START):
+            phase = ENCODE if kind == STARTED else VALIDATE
+            open_intervals[(event["run"], event["test"], event["seq"], event["qp"], phase)] = {
+                "test": event["test"], "seq": event["seq"], "qp": event["qp"], "phase": phase,
+                "start": event["time"] - start, "end": None,
+                "cores": event.get("cores", 1) if phase == ENCODE else 1,
+                "cpus": event.get("cpus"), "agent": event.get("agent"), "cpu": None, "status": None}
+        elif kind in (EXITED, VALIDATE_END):
+            phase = ENCODE if kind == EXITED else VALIDATE
+            interval = open_intervals.pop((event["run"], event["test"], event["seq"], event["qp"], phase), None)
+            if interval is None:
+                continue
+            interval["end"] = event["time"] - start
+            usage = event.get("usage") or {}
+            if usage.get(UTIME) is not None and usage.get(STIME) is not None:
+                interval["cpu"] = usage[UTIME] + usage[STIME]
+            if event.get("error"):
+                interval["status"] = event["error"]
+            elif phase == VALIDATE:
+                interval["status"] = "valid" if event.get("valid") else "invalid"
+            else:
+                interval["status"] = "done"
+            intervals.append(interval)
+    # Jobs of interrupted runs have no end event
+    end = max((event["time"] for event in events), default = start) - start
+    for interval in open_intervals.values():
+        interval["end"] = end
+        interval["status"] = "unfinished"
+        intervals.append(interval)
+    intervals.sort(key = lambda interval: interval["start"])
+    return {"intervals": intervals, "core_budget": core_budget, "runs": runs,
+            "retries": counts[RETRY], "cached": counts[CACHED], "resumed": counts[RESUMED]}
+
+"""
+Calculate utilisation over time from intervals
+@param intervals: Intervals from build_timeline
+@param step: Length of a time step in seconds. Chosen from the length of the timeline if not given
+@return a list of (step start, running encodes, running validations, reserved cores, used cores) with time weighted averages over each step.
+        Used cores are the CPU time of the encodes spread evenly over their run time
+"""
+def utilisation(intervals, step = None):
+    if not intervals:
+        return []
+    span = max(interval["end"] for interval in intervals)
+    step = step if step else max(span / __MAX_STEPS, 1.0)
+    num_steps = int(span // step) + 1
+    rows = [[i * step, 0.0, 0.0, 0.0, 0.0] for i in range(num_steps)]
+    for interval in intervals:
+        (begin, end) = (interval["start"], interval["end"])
+        duration = end - begin
+        used = interval["cpu"] / duration if interval["cpu"] is not None and duration > 0 else None
+        for i in range(int(begin // step), min(int(end // step), num_steps - 1) + 1):
+            overlap = (min(end, (i + 1) * step) - max(begin, i * step)) / step
+            if overlap <= 0:
+                continue
+            rows[i][1 if interval["phase"] == ENCODE else 2] += overlap
+            rows[i][3] += overlap * interval["cores"]
+            rows[i][4] += overlap * (used if used is not None else 0.0)
+    return [tuple(row) for row in rows]
+
+"""
+Return the largest number of intervals of a phase running at the same time
+"""
+def peak_running(intervals, phase = ENCODE):
+    # Ends sort before starts at the same time so back to back jobs are not counted as overlapping
+    changes = sorted([(interval["start"], 1) for interval in intervals if interval["phase"] == phase] +
+                     [(interval["end"], -1) for interval in intervals if interval["phase"] == phase])
+    (running, peak) = (0, 0)
+    for (_, change) in changes:
+        running += change
+        peak = max(peak, running)
+    return peak
+
+"""
+Summarise a timeline
+@return a list of (name, value) pairs
+"""
+def summarize(timeline):
+    intervals = timeline["intervals"]
+    encodes = [interval for interval in intervals if interval["phase"] == ENCODE]
+    span = max((interval["end"] for interval in intervals), default = 0.0)
+    budget = timeline["core_budget"]
+    rows = utilisation(intervals)
+    step = rows[1][0] - rows[0][0] if len(rows) > 1 else span
+    busy = sum(step for row in rows if row[1] > 0)
+    reserved = sum(interval["cores"] * (interval["end"] - interval["start"]) for interval in encodes)
+    cpu = sum(interval["cpu"] for interval in encodes if interval["cpu"] is not None)
+    return [("Runs", len(timeline["runs"])),
+            ("Encodes", len(encodes)),
+            ("Validations", len(intervals) - len(encodes)),
+            ("Cached results", timeline["cached"]),
+            ("Resumed results", timeline["resumed"]),
+            ("Retries", timeline["retries"]),
+            ("Span (s)", span),
+            ("Core budget", budget),
+            ("Average running encodes", sum(row[1] for row in rows) * step / span if span else 0.0),
+            ("Peak running encodes", peak_running(intervals)),
+            ("Time without encodes (s)", max(0.0, span - busy)),
+            ("Reserved core utilisation", reserved / (span * budget) if span and budget else None),
+            ("CPU utilisation", cpu / (span * budget) if span and budget else None)]
+
+"""
+Write the report workbook
+@param path: Event log
+@param out_path: Output .xlsx file
+@param run: Only use events of this run id. None for all events
+@return summary as returned by summarize
+"""
+def write_report(path, out_path, run = None):
+    timeline = build_timeline(read_events(path, run))
+    summary = summarize(timeline)
+    wb = xl.Workbook()
+    sheet = wb.active
+    sheet.title = "Summary"
+    for row in summary:
+        sheet.append(row)
+    sheet.column_dimensions["A"].width = 30
+
+    # Gantt style timeline: an invisible bar up to the start of each interval followed by a bar for its duration
+    sheet = wb.create_sheet("Timeline")
+    sheet.append(("Job", "Phase", "Start (s)", "Duration (s)", "Cores", "CPUs", "Agent", "CPU time (s)", "Status"))
+    for interval in timeline["intervals"]:
+        sheet.append(("{} {} {}".format(interval["test"], interval["seq"], interval["qp"]), interval["phase"], interval["start"],
+                      interval["end"] - interval["start"], interval["cores"], str(interval["cpus"]) if interval["cpus"] else None,
+                      interval["agent"], interval["cpu"], interval["status"]))
+    sheet.column_dimensions["A"].width = 50
+    num_rows = min(len(timeline["intervals"]), __MAX_CHART_ROWS)
+    if num_rows:
+        chart = BarChart()
+        chart.type = "bar"
+        chart.grouping = "stacked"
+        chart.overlap = 100
+        chart.title = "Job timeline"
+        chart.y_axis.title = "Seconds"
+        chart.x_axis.scaling.orientation = "maxMin" #First job at the top
+        chart.add_data(Reference(sheet, min_col = 3, max_col = 4, min_row = 1, max_row = num_rows + 1), titles_from_data = True)
+        chart.set_categories(Reference(sheet, min_col = 1, min_row = 2, max_row = num_rows + 1))
+        chart.series[0].graphicalProperties.noFill = True
+        chart.series[0].graphicalProperties.line.noFill = True
+        chart.legend = None
+        chart.height = max(8, num_rows * 0.4)
+        chart.width = 30
+        sheet.add_chart(chart, "K2")
+
+    sheet = wb.create_sheet("Utilisation")
+    sheet.append(("Time (s)", "Running encodes", "Running validations", "Reserved cores", "Used cores", "Core budget"))
+    rows = utilisation(timeline["intervals"])
+    for row in rows:
+        sheet.append(row + (timeline["core_budget"],))
+    if rows:
+        chart = LineChart()
+        chart.title = "Utilisation"
+        chart.y_axis.title = "Cores"
+        chart.x_axis.title = "Seconds"
+        chart.add_data(Reference(sheet, min_col = 2, max_col = 6, min_row = 1, max_row = len(rows) + 1), titles_from_data = True)
+        chart.set_categories(Reference(sheet, min_col = 1, min_row = 2, max_row = len(rows) + 1))
+        chart.width = 30
+        sheet.add_chart(chart, "H2")
+    wb.save(out_path)
+    return summary
+
+def main():
+    args = sys.argv[1:]
+    run = None
+    if "--run" in args:
+        i = args.index("--run")
+        run = args[i + 1] if i + 1 < len(args) else None
+        del args[i:i + 2]
+    if not args:
+        print("Usage: python -m JobRunner.EventReport <event log> [output .xlsx] [--run <run id>]")
+        return
+    out_path = args[1] if len(args) > 1 else args[0] + ".xlsx"
+    for (name, value) in write_report(args[0], out_path, run):
+        print("{}: {}".format(name, "{:.3g}".format(value) if isinstance(value, float) else value))
+    print("Report written to {}".format(out_path))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Append only log of job lifecycle events for analysing how well a run used the machine. Use python -m JobRunner.EventReport to build a timeline from the log
+"""
+
+import json
+import os
+import socket
+import time
+import uuid
+
+# Event types
+RUN_START = r"run start"
+RUN_END = r"run end"
+QUEUED = r"queued"
+STARTED = r"started" # Encoder process is about to start
+EXITED = r"exited" # Encoder run finished, including repeated timing runs
+VALIDATE_START = r"validate start"
+VALIDATE_END = r"validate end"
+RETRY = r"retry" # Job is queued again
+CACHED = r"cached" # Result reused from the result cache or another process
+RESUMED = r"resumed" # Result saved by an earlier interrupted run
+SAVED = r"saved" # Final result or failure of the job was stored
+
+class EventLog:
+    """Write job events as lines of JSON. Every line is written with a single call so several processes can append to the same file"""
+
+    """
+    @param path: Log file or None to drop all events
+    """
+    def __init__(self, path):
+        self._path = path
+        self._file = None
+        self.run_id = uuid.uuid4().hex[:12] # Identifies the events of this run in a shared log
+
+    """
+    Open the log for appending
+    @return self
+    """
+    def open(self):
+        if self._path:
+            parent = os.path.dirname(str(self._path))
+            if parent and not os.path.isdir(parent):
+                os.makedirs(parent)
+            self._file = open(self._path, mode = 'ab', buffering = 0)
+        return self
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    """
+    Write an event
+    @param event: Event type
+    @param job: EncodeJob the event is about or None for run events
+    @param fields: Other values of the event
+    """
+    def write(self, event, job = None, **fields):
+        if not self._file:
+            return
+        item = {"time": time.time(), "run": self.run_id, "event": event}
+        if job is not None:
+            item.update({"test": job.test._test_name, "seq": job.seq, "qp": job.qp, "key": job.key, "threads": job.threads})
+        item.update(fields)
+        try:
+            self._file.write((json.dumps(item, default = str) + "\n").encode())
+        except OSError:
+            pass #Analysis data is not worth failing the run for
+
+    """
+    Write the event that starts a run
+    """
+    def run_start(self, **fields):
+        self.write(RUN_START, host = socket.gethostname(), pid = os.getpid(), **fields)
+
+"""
+Read the events of a log
+@param run: Only return events of the run with this id. None for all events
+@return a list of event dicts in file order
+"""
+def read_events(path, run = None):
+    events = []
+    with open(path, mode = 'r') as file:
+        for line in file:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue #Partially written line
+            if run is None or item.get("run") == run:
+                events.append(item)
+    return events
@@ -0,0 +1,65 @@
+"""
+Content fingerprints for encoder and decoder binaries
+"""
+
+from pathlib import Path
+import threading
+import hashlib
+import json
+import os
+
+import cfg
+
+__FINGERPRINT_FILE = r"bin_fingerprints.json"
+__lock = threading.Lock()
+__digests = None # {<path>: {"mtime": <mtime_ns>, "size": <size>, "digest": <sha256>}}
+__unsaved = False # Digests were calculated without writing them to the file
+
+def _fingerprint_path():
+    return Path(cfg.results + __FINGERPRINT_FILE)
+
+"""
+Return a SHA-256 digest of the file contents. Digests are stored per (path, mtime, size) so binaries are only hashed again if they change
+@param path: Path of the binary
+@param save: Write new digests to the fingerprint file in the results folder. False leaves the results folder untouched
+@return hex digest or None if the file does not exist
+"""
+def fingerprint(path, save = True):
+    global __digests, __unsaved
+    if not os.path.isfile(path):
+        return None
+    stats = os.stat(path)
+    with __lock:
+        if __digests is None:
+            fpath = _fingerprint_path()
+            __digests = {}
+            if fpath.is_file():
+                with fpath.open(mode = 'r') as file:
+                    __digests = json.load(file)
+        entry = __digests.get(str(path))
+        if entry and entry["mtime"] == stats.st_mtime_ns and entry["size"] == stats.st_size:
+            if save and __unsaved:
+                _save()
+            return entry["digest"]
+
+        hasher = hashlib.sha256()
+        with open(path, mode = 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                hasher.update(chunk)
+        __digests[str(path)] = {"mtime": stats.st_mtime_ns, "size": stats.st_size, "digest": hasher.hexdigest()}
+        if save:
+            _save()
+        else:
+            __unsaved = True
+        return hasher.hexdigest()
+
+def _save():
+    global __unsaved
+    fpath = _fingerprint_path()
+    if not fpath.parent.exists():
+        fpath.parent.mkdir(parents = True)
+    tmp = fpath.with_name(fpath.name + ".tmp")
+    with tmp.open(mode = 'w') as file:
+        json.dump(__digests, file, indent = 2)
+    tmp.replace(fpath)
+    __unsaved = False
@@ -0,0 +1,45 @@
+"""
+Definition of a single encode job
+"""
+
+class EncodeJob:
+    """A single (test, sequence, qp) encoder run"""
+
+    # Job status values
+    DONE = r"done"
+    TIMEOUT = r"timeout" # Wall clock limit reached
+    KILLED = r"killed" # Process was killed by a signal, e.g. after exceeding the memory limit
+    ERROR = r"error"
+    INVALID = r"invalid" # Output failed validation. The result is kept by the test but not shared with other tests
+
+    """
+    Create an encode job
+    @param test: TestInstance the job belongs to. The test is responsible for running the job and storing the results
+    @param seq: Sequence name used as the first key in the test results
+    @param qp: Qp string used as the second key in the test results
+    @param cmd: Encoder command line
+    @param outfile: Output bitstream file
+    @param outlog: Log file for the encoder output
+    @param threads: Number of threads the encoder uses. Used by the scheduler to keep the cores from being oversubscribed
+    @param inputs: Input sequence files of the job. Used for estimating the job run time and identifying the encode
+    @param configs: Configuration files used by the encoder. Their contents are used for identifying the encode
+    """
+    def __init__(self, test, seq, qp, cmd, outfile, outlog, threads = 1, inputs = (), configs = ()):
+        self.test = test
+        self.seq = seq
+        self.qp = qp
+        self.cmd = cmd
+        self.outfile = outfile
+        self.outlog = outlog
+        self.threads = threads
+        self.inputs = inputs
+        self.configs = configs
+        self.key = None # Result cache key set by the scheduler
+        self.status = None # Set by the scheduler when the job finishes
+        self.time_runs = 1 # Number of times the encode is timed. Set by the scheduler from the test
+        self.cpus = None # CPUs the job is pinned to while running. Set by the scheduler if cfg.job_affinity is enabled
+        self.keep_output = True # Write the bitstream to outfile. Set by the scheduler from cfg.job_keep_bitstreams
+        self.on_frame = None # Function called for each frame the encoder reports while running. Set by the scheduler for showing progress
+
+    def __repr__(self):
+        return "EncodeJob({}, {}, {})".format(self.test._test_name, self.seq, self.qp)
@@ -0,0 +1,110 @@
+"""
+Handle encoder logs while the encoder is running instead of writing them to a file and reading them back
+"""
+
+import collections
+import gzip
+import re
+
+COMPRESSED_END = r".gz" # Appended to the log file name for compressed copies of the log
+
+class LogStream:
+    """Collect the lines of an encoder log as they are written. Lines matching the frame regex (e.g. per frame statistics) are not kept,
+    so only the header and summary lines the results are parsed from stay in memory. Can be given as stdout or stderr to ProcessEngine.run"""
+
+    __TAIL = 20 # Number of last lines kept for error messages
+
+    """
+    @param frame_regex: Regex matching lines that are not kept or None to keep every line
+    @param gz_path: Write a gzip compressed copy of the whole log to this file. None for no copy
+    @param on_line: Function called with each complete line (str) as it arrives
+    @param on_frame: Function called for each line matching the frame regex as it arrives
+    """
+    def __init__(self, frame_regex = None, gz_path = None, on_line = None, on_frame = None):
+        self.frame_regex = frame_regex
+        self._frame_ex = re.compile(frame_regex) if frame_regex else None
+        self._gz = gzip.open(gz_path, mode = 'wb') if gz_path else None
+        self._on_line = on_line
+        self._on_frame = on_frame
+        self._partial = b""
+        self._lines = []
+        self._tail = collections.deque(maxlen = self.__TAIL)
+        self.num_bytes = 0 # Bytes written to the log
+        self.frames = 0 # Number of lines matching the frame regex
+
+    def __call__(self, data):
+        self.write(data)
+
+    """
+    Handle a chunk of the log
+    """
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.num_bytes += len(data)
+        if self._gz:
+            self._gz.write(data)
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._add_line(line)
+
+    def _add_line(self, line):
+        line = line.decode(errors = "replace").rstrip("\r")
+        self._tail.append(line)
+        if self._on_line:
+            self._on_line(line)
+        if self._frame_ex and self._frame_ex.search(line):
+            self.frames += 1
+            if self._on_frame:
+                self._on_frame()
+        else:
+            self._lines.append(line)
+
+    """
+    Count frame lines that were removed from the log before it was written, e.g. by a worker agent
+    @param count: Number of removed lines
+    """
+    def add_frames(self, count):
+        self.frames += count
+        if self._on_frame:
+            for _ in range(count):
+                self._on_frame()
+
+    """
+    Return the kept lines of the log as text
+    """
+    def text(self):
+        self.flush()
+        return "\n".join(self._lines) + "\n"
+
+    """
+    Return the last lines of the log as text
+    """
+    def tail(self):
+        self.flush()
+        return "\n".join(self._tail)
+
+    """
+    Handle a last line that did not end in a newline
+    """
+    def flush(self):
+        if self._partial:
+            (line, self._partial) = (self._partial, b"")
+            self._add_line(line)
+
+    """
+    Finish the log and close the compressed copy
+    """
+    def close(self):
+        self.flush()
+        if self._gz:
+            self._gz.close()
+            self._gz = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -0,0 +1,114 @@
+"""
+Estimate the work of a test run without running anything
+"""
+
+import collections
+import heapq
+
+import cfg
+from .CostModel import CostModel
+from .ResultCache import ResultCache
+
+# Job states in a plan
+RUN = r"run"
+DONE = r"done" # The test has results
+RESUMED = r"resumed" # Finished by an interrupted run
+CACHED = r"cached" # Found in the result cache
+DUPLICATE = r"duplicate" # Same encode as an earlier job in the plan
+
+"""
+Estimate the wall clock time of running jobs on the core budget the same way JobScheduler starts them
+@param jobs: (estimated seconds, cores) of each job in start order
+@return estimated seconds
+"""
+def simulate_wall_time(jobs, workers, core_budget):
+    jobs = list(jobs)
+    # The scheduler starts the first queued job that fits in the free cores until none fits, so it is enough
+    # to compare the first waiting job of each core count
+    pending = {} #Indices of the jobs that have not been started for each core count in start order
+    for (i, (_, cores)) in enumerate(jobs):
+        pending.setdefault(cores, collections.deque()).append(i)
+    running = [] #Heap of (end time, cores)
+    (now, free_cores) = (0.0, core_budget)
+    while pending or running:
+        while len(running) < workers and free_cores > 0:
+            fits = [queue[0] for (cores, queue) in pending.items() if cores <= free_cores]
+            if not fits:
+                break
+            (seconds, cores) = jobs[min(fits)]
+            pending[cores].popleft()
+            if not pending[cores]:
+                del pending[cores]
+            free_cores -= cores
+            heapq.heappush(running, (now + seconds, cores))
+        (now, cores) = heapq.heappop(running)
+        free_cores += cores
+    return now
+
+"""
+Plan the jobs of the given tests
+@param job_filter: Function that returns False for jobs that are not run, e.g. jobs of other shards
+@param workers: Maximum number of jobs running at the same time. Defaults to cfg.job_workers
+@param core_budget: Number of cores the running jobs may use. Defaults to cfg.core_budget
+@return a dict with
+        "jobs": list of (job, state, estimated seconds or None, estimated bytes) in the order they would be started
+        "cpu_hours": estimated core hours of the jobs that need to be run
+        "wall_hours": estimated wall clock hours of the run
+        "disk_bytes": estimated bytes of bitstreams and logs written
+        "unknown": number of jobs to run without a time estimate
+"""
+def plan_tests(tests, job_filter = None, workers = None, core_budget = None):
+    workers = max(1, workers if workers else cfg.job_workers)
+    core_budget = max(1, core_budget if core_budget else cfg.core_budget)
+    cost_model = CostModel()
+    cache = ResultCache() if cfg.job_cache else None
+    for test in tests:
+        if test._results_exist():
+            test._load_results()
+            cost_model.record_test(test)
+    planned = []
+    keys = set()
+    for test in tests:
+        has_results = test._results_exist()
+        done = {} if has_results else test._load_job_results()
+        for job in test._get_jobs():
+            if job_filter and not job_filter(job):
+                continue
+            job.time_runs = test._get_time_runs()
+            if has_results:
+                state = DONE
+            elif (job.seq, job.qp) in done:
+                state = RESUMED
+            else:
+                state = RUN
+                if cache:
+                    job.key = ResultCache.key(job, test._validates(), save = False) #A dry run must not write to the results folder
+                    if job.key in keys:
+                        state = DUPLICATE
+                    elif cache.exists(job.key):
+                        state = CACHED
+                    keys.add(job.key)
+            planned.append([job, state])
+    to_run = cost_model.sort_jobs([job for (job, state) in planned if state == RUN])
+    order = {job: i for (i, job) in enumerate(to_run)}
+    planned.sort(key = lambda item: order.get(item[0], len(order)))
+    jobs = []
+    (cpu_seconds, disk_bytes, unknown, sim) = (0.0, 0, 0, [])
+    for (job, state) in planned:
+        (seconds, size) = (None, 0)
+        if state == RUN:
+            cores = max(1, min(job.threads, core_budget))
+            if cost_model.has_history(job):
+                seconds = cost_model.estimate(job) * job.time_runs
+                cpu_seconds += seconds * cores
+            else:
+                unknown += 1
+            size = cost_model.estimate_size(job)
+            disk_bytes += size
+            sim.append((seconds if seconds else 0.0, cores))
+        jobs.append((job, state, seconds, size))
+    return {"jobs": jobs,
+            "cpu_hours": cpu_seconds / 3600,
+            "wall_hours": simulate_wall_time(sim, workers, core_budget) / 3600,
+            "disk_bytes": disk_bytes,
+            "unknown": unknown}
@@ -0,0 +1,228 @@
+"""
+Live progress of running encode jobs
+"""
+
+import asyncio
+import contextlib
+import os
+import sys
+import time
+
+import cfg
+from .Planner import simulate_wall_time
+
+class JobProgress:
+    """Show the progress of a scheduler run: frames per second of each running job, finished jobs per hour, core utilisation and the estimated time left.
+    Frame rates are counted from the per frame lines encoders write while running. On a terminal the display is redrawn in place and other output is printed above it.
+    When the output is redirected a plain text status line is printed every interval seconds"""
+
+    __REFRESH = 1 # Seconds between redraws on a terminal
+    __MAX_JOB_LINES = 8 # Number of running jobs listed on a terminal
+    __ETA_INTERVAL = 10 # Minimum seconds between estimating the time left. The last estimate counts down in between
+
+    """
+    @param total: Number of jobs in the run
+    @param queue: List of queued jobs. The list is read when the estimated time left is calculated, so it should be updated in place
+    @param cost_model: CostModel for estimating the run time of queued and running jobs
+    @param workers: Maximum number of jobs running at the same time
+    @param core_budget: Number of cores the running jobs may use
+    @param stream: Output stream. Defaults to sys.stdout
+    @param interval: Seconds between status lines when the output is not a terminal. Defaults to cfg.job_progress_interval
+    """
+    def __init__(self, total, queue, cost_model, workers, core_budget, stream = None, interval = None):
+        self.total = total
+        self.workers = workers
+        self.core_budget = core_budget
+        self._queue = queue
+        self._cost_model = cost_model
+        self._stream = stream if stream else sys.stdout
+        self._interval = interval if interval is not None else cfg.job_progress_interval
+        self._live = self._stream.isatty() and os.environ.get("TERM") != "dumb"
+        self._running = {} #[start time, frames, cores] of each running job
+        self._num_done = 0
+        self._start = time.perf_counter()
+        self._last = None #Time of the last redraw or status line
+        self._drawn = 0 #Number of lines of the display on the terminal
+        self._line_start = True #Other output ended with a newline so the display can be drawn
+        self._redirect = None
+        self._estimates = {} #Estimated seconds of each job or None, calculated when the job is first seen
+        self._eta_at = None #(time, estimated seconds left) of the last estimate
+        self._eta_stale = True #Jobs have started or finished since the last estimate
+
+    """
+    Start showing progress. On a terminal stdout and stderr are redirected so that other output does not mix with the display
+    """
+    def start(self):
+        self._start = time.perf_counter()
+        if self._live:
+            self._redirect = contextlib.ExitStack()
+            self._redirect.enter_context(contextlib.redirect_stdout(_ProgressOutput(self, sys.stdout)))
+            if sys.stderr.isatty():
+                self._redirect.enter_context(contextlib.redirect_stderr(_ProgressOutput(self, sys.stderr)))
+        self.refresh(force = True)
+        return self
+
+    """
+    Show the final state and stop redirecting output
+    """
+    def close(self):
+        if self._redirect:
+            self._redirect.close()
+            self._redirect = None
+        self._clear()
+        self._stream.write(self._status_line() + "\n")
+        self._stream.flush()
+
+    """
+    Mark a job as started
+    @param cores: Number of cores reserved for the job
+    """
+    def start_job(self, job, cores):
+        state = [time.perf_counter(), 0, cores]
+        self._running[job] = state
+        self._eta_stale = True
+        def on_frame():
+            state[1] += 1
+        job.on_frame = on_frame
+
+    """
+    Mark a job as no longer running. Timing runs and validation of the job may still follow
+    """
+    def stop_job(self, job):
+        self._running.pop(job, None)
+        job.on_frame = None
+        self._eta_stale = True
+
+    """
+    Count a job as finished
+    """
+    def job_done(self):
+        self._num_done += 1
+        self._eta_stale = True
+        self.refresh()
+
+    """
+    Redraw the display on a terminal or print a status line if the interval has passed
+    @param force: Update even if the refresh interval has not passed
+    """
+    def refresh(self, force = False):
+        now = time.perf_counter()
+        if self._live:
+            if not self._line_start or (not force and self._last is not None and now - self._last < self.__REFRESH):
+                return
+            self._clear()
+            lines = self._display_lines(now)
+            self._stream.write("\n".join(lines) + "\n")
+            self._drawn = len(lines)
+        else:
+            if not force and self._last is not None and now - self._last < self._interval:
+                return
+            self._stream.write(self._status_line() + "\n")
+        self._stream.flush()
+        self._last = now
+
+    """
+    Coroutine that keeps the display up to date until cancelled
+    """
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.__REFRESH)
+            self.refresh()
+
+    """
+    Remove the display from the terminal
+    """
+    def _clear(self):
+        if self._drawn:
+            self._stream.write("\x1b[{}F\x1b[J".format(self._drawn))
+            self._stream.flush()
+            self._drawn = 0
+
+    """
+    Return the estimated seconds left in the run or None if the cost model can't estimate the remaining jobs.
+    The remaining run is only simulated again after jobs have started or finished and the last estimate is old enough
+    """
+    def _eta(self, now):
+        if self._eta_at is None or (self._eta_stale and now - self._eta_at[0] >= self.__ETA_INTERVAL):
+            self._eta_at = (now, self._estimate_left(now))
+            self._eta_stale = False
+        (at, left) = self._eta_at
+        return max(0.0, left - (now - at)) if left is not None else None
+
+    """
+    Simulate the rest of the run with the estimated run times of the running and queued jobs
+    """
+    def _estimate_left(self, now):
+        running = list(self._running.items())
+        # Jobs without an estimate are estimated again since the cost model learns from finished jobs
+        new_jobs = [job for job in [job for (job, _) in running] + list(self._queue) if self._estimates.get(job) is None]
+        self._estimates.update(zip(new_jobs, self._cost_model.estimate_jobs(new_jobs)))
+        jobs = []
+        for (job, state) in running:
+            if self._estimates[job] is None:
+                return None
+            jobs.append((max(0.0, self._estimates[job] * job.time_runs - (now - state[0])), state[2]))
+        for job in self._queue:
+            if self._estimates[job] is None:
+                return None
+            jobs.append((self._estimates[job] * job.time_runs, max(1, min(job.threads, self.core_budget))))
+        return simulate_wall_time(jobs, self.workers, self.core_budget) if jobs else 0.0
+
+    @staticmethod
+    def _format_time(seconds):
+        if seconds is None:
+            return "?"
+        seconds = int(round(seconds))
+        return "{}:{:02}:{:02}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+    """
+    Return (jobs per hour, busy cores, fps of running jobs, eta) at the given time
+    """
+    def _stats(self, now):
+        elapsed = now - self._start
+        jobs_hour = self._num_done / elapsed * 3600 if elapsed > 0 else 0.0
+        busy = sum(state[2] for state in self._running.values())
+        fps = [state[1] / (now - state[0]) for state in self._running.values() if state[1] and now > state[0]]
+        return (jobs_hour, busy, fps, self._eta(now) if self._num_done < self.total else 0.0)
+
+    def _status_line(self):
+        now = time.perf_counter()
+        (jobs_hour, busy, fps, eta) = self._stats(now)
+        line = "    {} of {} jobs complete, {:.1f} jobs/h, {} of {} cores busy".format(self._num_done, self.total, jobs_hour, busy, self.core_budget)
+        if fps:
+            line += ", {} running at {:.1f} fps on average".format(len(self._running), sum(fps) / len(fps))
+        return line + ", {} elapsed, ETA {}".format(self._format_time(now - self._start), self._format_time(eta))
+
+    def _display_lines(self, now):
+        (jobs_hour, busy, _, eta) = self._stats(now)
+        lines = ["    {} of {} jobs complete | {:.1f} jobs/h | cores {}/{} ({:.0%}) | elapsed {} | ETA {}".format(
+            self._num_done, self.total, jobs_hour, busy, self.core_budget, busy / self.core_budget if self.core_budget else 0.0,
+            self._format_time(now - self._start), self._format_time(eta))]
+        running = sorted(self._running.items(), key = lambda item: item[1][0])
+        for (job, (start, frames, cores)) in running[:self.__MAX_JOB_LINES]:
+            fps = frames / (now - start) if now > start else 0.0
+            lines.append("      {} {} qp {}: {} frames, {:.1f} fps, {} cores, {}".format(job.test._test_name, job.seq, job.qp, frames, fps, cores, self._format_time(now - start)))
+        if len(running) > self.__MAX_JOB_LINES:
+            lines.append("      and {} more running".format(len(running) - self.__MAX_JOB_LINES))
+        return lines
+
+class _ProgressOutput:
+    """Stream that removes the progress display before writing so that the display stays below other output"""
+
+    def __init__(self, progress, stream):
+        self._progress = progress
+        self._stream = stream
+
+    def write(self, text):
+        if not text:
+            return 0
+        self._progress._clear()
+        written = self._stream.write(text)
+        self._progress._line_start = text.endswith("\n")
+        return written
+
+    def flush(self):
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
@@ -0,0 +1,285 @@
+"""
+Coordinator side of running jobs on worker agents connected over TCP or a Unix socket.
+Agents run the encoder commands they are given as is, so binaries, sequences and the results folder need to be found at the same paths on every agent,
+e.g. on a shared network drive. Agents execute any command sent by the coordinator; only connect them to coordinators on a trusted network
+"""
+
+import asyncio
+import base64
+import io
+import json
+import os
+import subprocess as sp
+
+from .Engine import ProcessKilledError
+
+class AgentLostError(ConnectionError):
+    """Raised for commands that were running on an agent when its connection was lost"""
+
+class ProtocolError(ValueError):
+    """Raised for messages that can't be read"""
+
+class AgentProtocolError(RuntimeError):
+    """Raised for commands that were running on an agent that sent an invalid message"""
+
+"""
+Parse an agent address
+@param address: "host:port" for TCP or a path for a Unix socket
+@return ("tcp", host, port) or ("unix", path)
+"""
+def parse_address(address):
+    (host, sep, port) = str(address).rpartition(":")
+    if sep and port.isdigit() and os.sep not in host:
+        return ("tcp", host if host else "localhost", int(port))
+    return ("unix", str(address))
+
+"""
+Write a message as JSON preceded by a line with its length without waiting for it to be sent.
+Messages can carry whole encoder logs, so they are not limited by the line length limit of asyncio streams
+"""
+def write_message(writer, msg):
+    data = json.dumps(msg).encode()
+    writer.write(str(len(data)).encode() + b"\n" + data)
+
+"""
+Write a message and wait until it can be sent
+"""
+async def send_message(writer, msg):
+    write_message(writer, msg)
+    await writer.drain()
+
+"""
+Read a message written with write_message or send_message
+@return the message or None if the connection was closed
+@raise ProtocolError if the message is not valid
+"""
+async def read_message(reader):
+    header = await reader.readline()
+    if not header:
+        return None
+    try:
+        size = int(header)
+    except ValueError:
+        raise ProtocolError("Invalid message header {!r}".format(header[:80])) from None
+    try:
+        data = await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        return None #Closed while sending
+    try:
+        return json.loads(data)
+    except ValueError as err:
+        raise ProtocolError("Invalid message: {}".format(err)) from None
+
+"""
+Encode process output data for a message
+"""
+def encode_data(data):
+    return base64.b64encode(data).decode() if data is not None else None
+
+"""
+Decode process output data of a message
+"""
+def decode_data(data):
+    return base64.b64decode(data) if data is not None else None
+
+class AgentEngine:
+    """Run processes on a single connected agent. Has the same run interface as ProcessEngine"""
+
+    def __init__(self, name, cores, writer):
+        self.name = name
+        self.cores = cores
+        self.free_cores = cores
+        self._writer = writer
+        self._pending = {} #Futures for the replies of commands sent to the agent
+        self._next_id = 0
+
+    """
+    Run a process on the agent. Output written to files is transferred from the agent and written to the given files
+    @param cpus: Ignored. Agents choose the CPUs of their processes
+    @raise AgentLostError if the connection to the agent is lost while the process runs
+    @raise AgentProtocolError if the agent sends an invalid message while the process runs
+    See ProcessEngine.run
+    """
+    async def run(self, cmd, stdout = sp.DEVNULL, stderr = sp.DEVNULL, timeout = None, cpus = None):
+        if self._writer is None:
+            raise AgentLostError("Agent {} is not connected".format(self.name))
+        cmd_id = self._next_id
+        self._next_id += 1
+        reply = asyncio.get_running_loop().create_future()
+        self._pending[cmd_id] = reply
+        try:
+            # Lines the output streams don't keep, e.g. per frame lines of encoder logs, are dropped by the agent and only counted
+            await send_message(self._writer, {"type": "run", "id": cmd_id, "cmd": [str(arg) for arg in cmd],
+                                              "stdout": stdout not in (sp.DEVNULL, None), "stderr": stderr not in (sp.DEVNULL, None),
+                                              "drop": {"stdout": getattr(stdout, "frame_regex", None), "stderr": getattr(stderr, "frame_regex", None)}})
+            msg = await asyncio.wait_for(asyncio.shield(reply), timeout)
+        except BaseException:
+            # Timeout or cancellation. Tell the agent to kill the process
+            if not reply.done() and self._writer is not None:
+                try:
+                    await send_message(self._writer, {"type": "cancel", "id": cmd_id})
+                except (ConnectionError, RuntimeError):
+                    pass
+            raise
+        finally:
+            self._pending.pop(cmd_id, None)
+        if msg.get("signal") is not None:
+            raise ProcessKilledError(cmd, msg["signal"])
+        if msg.get("error") is not None:
+            raise RuntimeError("Agent {} failed to run {}: {}".format(self.name, cmd[0], msg["error"]))
+        out = self._write(stdout, decode_data(msg.get("stdout")))
+        err = self._write(stderr, decode_data(msg.get("stderr")))
+        for (name, stream) in (("stdout", stdout), ("stderr", stderr)):
+            dropped = (msg.get("dropped") or {}).get(name)
+            if dropped:
+                stream.add_frames(dropped)
+        return (msg["returncode"], out, err, msg["usage"])
+
+    """
+    Write transferred output data to the given stream or pass it to the given output function
+    @return the data if the stream is subprocess.PIPE and None otherwise
+    """
+    @staticmethod
+    def _write(stream, data):
+        if stream == sp.PIPE:
+            return data
+        if data is not None and callable(stream):
+            stream(data)
+        elif data is not None and hasattr(stream, "write"):
+            stream.write(data.decode(errors = "replace") if isinstance(stream, io.TextIOBase) else data)
+            stream.flush()
+        return None
+
+    """
+    Handle a reply message from the agent
+    """
+    def _reply(self, msg):
+        reply = self._pending.get(msg.get("id"))
+        if reply is not None and not reply.done():
+            reply.set_result(msg)
+
+    """
+    Fail all running commands after the connection is lost
+    @param error: Exception given to the commands. Defaults to AgentLostError
+    """
+    def _lost(self, error = None):
+        self._writer = None
+        for reply in self._pending.values():
+            if not reply.done():
+                reply.set_exception(error if error else AgentLostError("Connection to agent {} was lost".format(self.name)))
+
+class AgentPool:
+    """Accept worker agent connections and hand out agents with free cores. Agents may connect and disconnect at any time"""
+
+    """
+    @param address: Address to listen on. See parse_address
+    """
+    def __init__(self, address):
+        self._address = address
+        self._agents = []
+        self._handlers = set() #Tasks serving agent connections
+        self._server = None
+        self._changed = asyncio.Event()
+
+    """
+    Start listening for agents
+    """
+    async def start(self):
+        addr = parse_address(self._address)
+        if addr[0] == "tcp":
+            self._server = await asyncio.start_server(self._handle, addr[1], addr[2])
+        else:
+            if os.path.exists(addr[1]):
+                os.unlink(addr[1]) #Socket left by an earlier run
+            self._server = await asyncio.start_unix_server(self._handle, addr[1])
+        print("Waiting for worker agents on {}".format(self._address))
+        return self
+
+    """
+    Stop listening and disconnect all agents
+    """
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for agent in list(self._agents):
+            if agent._writer is not None:
+                agent._writer.close()
+        if self._handlers:
+            await asyncio.wait(list(self._handlers))
+        self._server = None
+        addr = parse_address(self._address)
+        if addr[0] == "unix" and os.path.exists(addr[1]):
+            os.unlink(addr[1])
+
+    """
+    Return the number of connected agents
+    """
+    def num_agents(self):
+        return len(self._agents)
+
+    """
+    Return the total number of cores of the connected agents
+    """
+    def num_cores(self):
+        return sum(agent.cores for agent in self._agents)
+
+    """
+    Reserve cores for a job from the connected agent with the most free cores
+    @param cores: Number of cores the job uses. Limited to the size of the agent
+    @return (AgentEngine, reserved cores) or None if no agent has enough free cores
+    """
+    def reserve(self, cores):
+        for agent in sorted(self._agents, key = lambda agent: -agent.free_cores):
+            n = max(1, min(cores, agent.cores))
+            if agent.free_cores >= n:
+                agent.free_cores -= n
+                return (agent, n)
+        return None
+
+    """
+    Return cores reserved with reserve
+    """
+    def release(self, agent, cores):
+        agent.free_cores += cores
+        if agent in self._agents:
+            self._changed.set()
+
+    """
+    Wait until an agent connects, disconnects or gets free cores
+    """
+    async def wait_changed(self):
+        await self._changed.wait()
+        self._changed.clear()
+
+    async def _handle(self, reader, writer):
+        agent = None
+        self._handlers.add(asyncio.current_task())
+        try:
+            hello = await read_message(reader)
+            if not hello or hello.get("type") != "hello":
+                return
+            agent = AgentEngine(hello.get("name", str(writer.get_extra_info("peername"))), max(1, int(hello.get("cores", 1))), writer)
+            self._agents.append(agent)
+            self._changed.set()
+            print("Worker agent {} connected with {} cores.".format(agent.name, agent.cores))
+            while True:
+                msg = await read_message(reader)
+                if msg is None:
+                    break
+                agent._reply(msg)
+        except ProtocolError as err:
+            # The rest of the stream can't be read, so the agent is disconnected
+            print("Invalid message from worker agent {}: {}".format(agent.name if agent else writer.get_extra_info("peername"), err))
+            if agent is not None:
+                agent._lost(AgentProtocolError("Agent {} sent an invalid message: {}".format(agent.name, err)))
+        except ConnectionError:
+            pass
+        finally:
+            if agent is not None:
+                self._agents.remove(agent)
+                agent._lost()
+                self._changed.set()
+                print("Worker agent {} disconnected.".format(agent.name))
+            writer.close()
+            self._handlers.discard(asyncio.current_task())
@@ -0,0 +1,87 @@
+"""
+Cache for results of single encode jobs shared by all tests and test scripts
+"""
+
+from pathlib import Path
+import hashlib
+import json
+import os
+
+import cfg
+from .Fingerprint import fingerprint
+
+class ResultCache:
+    """Store job results under a hash of the encoder binary contents, command line and the input files, so identical encodes are only run once"""
+
+    __CACHE_FOLDER = r"job_cache\\"
+    __OUTFILE = r"<outfile>" # Placeholder for the output file in the command, since it is different for each test
+
+    """
+    Return the cache key for the given job
+    @param validated: The result is for a test that validates its outputs. Only results that passed validation are stored under such keys,
+                      so tests that validate never reuse outputs that were not decoded
+    @param save: Save the binary fingerprints calculated for the key. False leaves the results folder untouched
+    """
+    @classmethod
+    def key(cls, job, validated = False, save = True):
+        hasher = hashlib.sha256()
+        # Identify the encoder by content so a rebuilt binary invalidates its results
+        bin_print = fingerprint(job.cmd[0], save)
+        hasher.update((bin_print if bin_print else str(job.cmd[0])).encode())
+        hasher.update(b"\0")
+        for arg in job.cmd[1:]:
+            hasher.update((cls.__OUTFILE if arg == job.outfile else str(arg)).encode())
+            hasher.update(b"\0")
+        # Sequences are too large to hash, so use their size and modification time
+        for seq in job.inputs:
+            hasher.update(str(seq).encode())
+            if seq and os.path.isfile(cfg.sequence_path + seq):
+                stats = os.stat(cfg.sequence_path + seq)
+                hasher.update(str((stats.st_size, stats.st_mtime_ns)).encode())
+        for conf in job.configs:
+            hasher.update(str(conf).encode())
+            if os.path.isfile(conf):
+                with open(conf, mode = 'rb') as file:
+                    hasher.update(file.read())
+        # Results with repeated timing runs contain different timing statistics
+        if job.time_runs > 1:
+            hasher.update("time_runs={}".format(job.time_runs).encode())
+        if validated:
+            dec_print = fingerprint(cfg.decoder_bin, save)
+            hasher.update(b"validated\0" + (dec_print if dec_print else str(cfg.decoder_bin)).encode())
+        return hasher.hexdigest()
+
+    @classmethod
+    def _path(cls, key):
+        return Path(cfg.results + cls.__CACHE_FOLDER + key)
+
+    """
+    Return the cached result for the key or None if the encode has not been run
+    """
+    def load(self, key):
+        fpath = self._path(key)
+        if not fpath.is_file():
+            return None
+        try:
+            with fpath.open(mode = 'r') as file:
+                return json.load(file)
+        except ValueError:
+            return None #Partially written entry
+
+    """
+    Return True if the cache has a result for the key
+    """
+    def exists(self, key):
+        return self._path(key).is_file()
+
+    """
+    Store the result of an encode
+    """
+    def store(self, key, result):
+        fpath = self._path(key)
+        if not fpath.parent.exists():
+            fpath.parent.mkdir(parents = True)
+        tmp = fpath.with_name(fpath.name + ".tmp")
+        with tmp.open(mode = 'w') as file:
+            json.dump(result, file)
+        tmp.replace(fpath)
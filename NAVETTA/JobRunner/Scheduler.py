@@ -0,0 +1,447 @@
+"""
+Scheduler that runs encode jobs from several test instances on a shared set of workers
+"""
+
+import asyncio
+import traceback
+import time
+import os
+
+import cfg
+from .CostModel import CostModel
+from .ResultCache import ResultCache
+from .Engine import ProcessEngine, ProcessKilledError
+from .Job import EncodeJob
+from .Affinity import CpuAllocator, affinity_supported
+from .Remote import AgentPool, AgentLostError
+from .DaemonClient import DaemonClient
+from .LogStream import COMPRESSED_END
+from .Progress import JobProgress
+from .Events import EventLog, QUEUED, STARTED, EXITED, VALIDATE_START, VALIDATE_END, RETRY, CACHED, RESUMED, SAVED, RUN_END
+
+class JobScheduler:
+    """Break tests into encode jobs and run them so that all workers stay busy until every job is done"""
+
+    """
+    @param workers: Maximum number of jobs running at the same time. Defaults to cfg.job_workers
+    @param core_budget: Number of cores the threads of running jobs may use in total. Defaults to cfg.core_budget
+    @param timeout: Wall clock time limit in seconds for a single job. Defaults to cfg.job_timeout
+    """
+    def __init__(self, workers = None, core_budget = None, timeout = None):
+        self._workers = max(1, workers if workers else cfg.job_workers)
+        self._core_budget = max(1, core_budget if core_budget else cfg.core_budget)
+        self._timeout = timeout if timeout else cfg.job_timeout
+        self._jobs = []
+        self._tests = {} #Hold [<number of unfinished jobs>, [(<job>,<result>),...]] for each test
+        self._cost_model = CostModel()
+        self._cache = ResultCache() if cfg.job_cache else None
+        self._keys = {} #Jobs waiting for the result of the queued job with the same cache key
+        self._timeout_retries = cfg.job_timeout_retries
+        self._memory_limit = cfg.job_memory_limit
+        self._affinity = cfg.job_affinity and affinity_supported()
+        self._coordinator = cfg.job_coordinator
+        self._agent_retries = cfg.job_agent_retries
+        self._daemon_path = cfg.job_daemon
+        self._daemon = None #Connection to the job daemon while running
+        self.failed_jobs = [] #Jobs that failed in the last run. The reason is in job.status
+        self._groups = [] #Lists of tests whose jobs are interleaved
+        self._progress = None #JobProgress of the current run
+        self._event_path = cfg.results + cfg.job_event_log if cfg.job_event_log else None
+        self._events = None #EventLog of the current run
+        self._skipped = [] #(event, job) pairs of jobs whose results were found when they were added
+
+    """
+    Add all jobs of the given test to the scheduler. Jobs that have results saved by an earlier interrupted run or in the result cache are skipped
+    @param job_filter: Function that returns False for jobs that should not be run, e.g. jobs of other shards. None to run all jobs
+    @return self
+    """
+    def add_test(self, test, job_filter = None):
+        done = test._load_job_results()
+        state = [0, []]
+        num_cached = 0
+        for job in test._get_jobs():
+            if job_filter and not job_filter(job):
+                continue
+            job.time_runs = test._get_time_runs()
+            # Agents can't write to a pipe of the coordinator
+            job.keep_output = cfg.job_keep_bitstreams or test._validates() or bool(self._coordinator)
+            if (job.seq, job.qp) in done:
+                job.status = EncodeJob.DONE
+                state[1].append((job, done[(job.seq, job.qp)]))
+                self._skipped.append((RESUMED, job))
+                continue
+            if self._cache:
+                job.key = ResultCache.key(job, test._validates())
+                result = self._cache.load(job.key)
+                if result is not None:
+                    job.status = EncodeJob.DONE
+                    state[1].append((job, result))
+                    test._save_job_result(job, result)
+                    self._skipped.append((CACHED, job))
+                    num_cached += 1
+                    continue
+                if job.key in self._keys:
+                    #Identical encode is already queued
+                    self._keys[job.key].append(job)
+                    state[0] += 1
+                    continue
+                self._keys[job.key] = []
+            state[0] += 1
+            self._jobs.append(job)
+        if len(state[1]) > num_cached:
+            print("Resuming test {} with {} finished jobs.".format(test._test_name, len(state[1]) - num_cached))
+        if num_cached:
+            print("Reusing {} cached job results for test {}.".format(num_cached, test._test_name))
+        self._tests[test] = state
+        return self
+
+    """
+    Mark tests as a comparison group. Jobs of the group with the same sequence and qp are run back to back, alternating the order of the tests
+    between consecutive sequence and qp pairs, so that timing drift of the host affects all tests of the group equally
+    @param tests: Tests in the group. Tests that are not added to the scheduler are ignored
+    @return self
+    """
+    def add_group(self, tests):
+        self._groups.append(list(tests))
+        return self
+
+    """
+    Add encode times from a test with existing results to the history used for estimating job run times
+    @return self
+    """
+    def add_history(self, test):
+        self._cost_model.record_test(test)
+        return self
+
+    """
+    Return number of jobs added to the scheduler
+    """
+    def num_jobs(self):
+        return len(self._jobs)
+
+    """
+    Return number of tests added to the scheduler
+    """
+    def num_tests(self):
+        return len(self._tests)
+
+    """
+    Order jobs of comparison groups next to each other. Each block of same sequence and qp jobs takes the place of its longest job in the queue
+    @param queue: Jobs sorted in the order they should be started
+    @return the new job order
+    """
+    def _interleave(self, queue):
+        group_of = {test: gid for (gid, tests) in enumerate(self._groups) for test in tests}
+        blocks = []
+        block_of = {}
+        for job in queue:
+            gid = group_of.get(job.test)
+            if gid is None:
+                blocks.append([job])
+                continue
+            key = (gid, job.seq, job.qp)
+            if key not in block_of:
+                block_of[key] = []
+                blocks.append(block_of[key])
+            block_of[key].append(job)
+        # Alternate the order of the tests in consecutive blocks of the same group (ABBA...)
+        num_blocks = {}
+        for block in blocks:
+            gid = group_of.get(block[0].test)
+            if gid is None:
+                continue
+            block.sort(key = lambda job: self._groups[gid].index(job.test))
+            if num_blocks.get(gid, 0) % 2:
+                block.reverse()
+            num_blocks[gid] = num_blocks.get(gid, 0) + 1
+        return [job for block in blocks for job in block]
+
+    """
+    Return the number of bytes written to the output and log files of the job or None if the files are not found
+    """
+    @staticmethod
+    def _job_bytes(job):
+        sizes = [os.path.getsize(fname) for fname in (job.outfile, job.outlog, job.outlog + COMPRESSED_END) if os.path.isfile(fname)]
+        return sum(sizes) if sizes else None
+
+    """
+    Return the number of cores reserved for the given job. Jobs using more threads than the budget allows are run alone
+    """
+    def _job_cores(self, job):
+        return max(1, min(job.threads, self._core_budget))
+
+    """
+    Run a job and measure its wall clock time. Extra timing runs requested by the test are run after the encode
+    """
+    async def _run_job(self, job, engine):
+        self._progress.start_job(job, self._job_cores(job))
+        self._events.write(STARTED, job, cores = self._job_cores(job), cpus = job.cpus, agent = getattr(engine, "name", None))
+        try:
+            start = time.perf_counter()
+            result = await asyncio.wait_for(job.test._run_job(job, engine), self._timeout)
+            wall_time = time.perf_counter() - start
+            if job.time_runs > 1:
+                await job.test._run_timing(job, engine, result, self._timeout)
+        except BaseException as err:
+            self._events.write(EXITED, job, error = repr(err))
+            raise
+        finally:
+            self._progress.stop_job(job)
+        self._events.write(EXITED, job, wall = wall_time, usage = result.get(job.test._USAGE), timing = result.get(job.test._TIMING))
+        return (result, wall_time)
+
+    """
+    Run a job with cores leased from the job daemon. A job already run by another process is waited for and its result is read from the result cache
+    @return (result, wall time) where wall time is None if the result was run by another process
+    """
+    async def _run_daemon_job(self, job, engine):
+        key = job.key if self._cache else None
+        while True:
+            lease = await self._daemon.acquire(job.threads, key)
+            if lease["type"] == "granted":
+                break
+            if lease["status"] == EncodeJob.DONE:
+                result = self._cache.load(key)
+                if result is not None:
+                    self._events.write(CACHED, job, source = "daemon")
+                    return (result, None)
+                key = None
+        job.cpus = lease["cpus"]
+        try:
+            # The job may have been finished by another process after the test was added
+            result = self._cache.load(key) if key else None
+            if result is not None:
+                self._events.write(CACHED, job, source = "cache")
+                return (result, None)
+            return await self._run_job(job, engine)
+        finally:
+            self._daemon.release(lease["id"])
+
+    """
+    Connect to the job daemon given in cfg.job_daemon
+    @return a DaemonClient or None if the daemon is not used or can't be reached
+    """
+    async def _connect_daemon(self):
+        if not self._daemon_path or self._coordinator:
+            return None
+        try:
+            return await DaemonClient(self._daemon_path).connect()
+        except (OSError, AttributeError):
+            print("Job daemon not found at {}. Using the local core budget.".format(self._daemon_path))
+            return None
+
+    """
+    Validate the output of a job
+    """
+    async def _validate_job(self, job, engine, result):
+        self._events.write(VALIDATE_START, job)
+        try:
+            is_valid = await asyncio.wait_for(job.test._validate_job(job, engine, result), self._timeout)
+        except BaseException as err:
+            self._events.write(VALIDATE_END, job, error = repr(err))
+            raise
+        self._events.write(VALIDATE_END, job, valid = is_valid, usage = result.get(job.test._DEC_USAGE))
+        return is_valid
+
+    """
+    Store the result of a finished job and call test_done if it was the last job of the test
+    @param result: Job result or None if the job failed
+    @param status: Job status from EncodeJob. Results of INVALID jobs are kept by the test
+    """
+    def _finish_job(self, job, result, status, test_done, failed):
+        state = self._tests[job.test]
+        state[0] -= 1
+        job.status = status
+        job.test._save_job_result(job, result, status)
+        self._events.write(SAVED, job, status = status)
+        if status not in (EncodeJob.DONE, EncodeJob.INVALID):
+            self.failed_jobs.append(job)
+            if job.test not in failed:
+                failed.append(job.test)
+        else:
+            state[1].append((job, result))
+        if state[0] == 0 and job.test not in failed:
+            test_done(job.test, state[1])
+
+    """
+    Handle the final result of a job and the jobs waiting for the same encode.
+    Only results that passed validation or were not validated are shared with other tests through the result cache and the job daemon
+    @param result: Job result or None if the job failed
+    @param status: Job status from EncodeJob
+    @param valid: False if the output of the job failed validation
+    """
+    def _job_done(self, job, result, status, test_done, failed, valid = True):
+        if status == EncodeJob.DONE and not valid:
+            status = EncodeJob.INVALID
+        if self._cache and status == EncodeJob.DONE:
+            self._cache.store(job.key, result)
+        if self._daemon and job.key:
+            # Processes waiting for the job run it themselves if it did not succeed
+            self._daemon.finish(job.key, status)
+        self._finish_job(job, result, status, test_done, failed)
+        for dup_job in self._keys.get(job.key, []):
+            self._finish_job(dup_job, dict(result) if result is not None else None, status, test_done, failed)
+
+    """
+    Run all added jobs. Jobs are started longest estimated job first whenever a worker is free and the job's threads fit in the free cores.
+    Outputs are validated in a separate stage limited by cfg.validation_workers, so encoding continues while earlier outputs are decoded. Jobs that fail validation are queued for encoding again until their retries run out.
+    Jobs that time out are started again cfg.job_timeout_retries times. Failed jobs are listed in failed_jobs.
+    If cfg.job_affinity is set, each running job is pinned to its own set of CPUs and a job waits until enough CPUs are free.
+    If cfg.job_coordinator is set, jobs are run by worker agents connected to that address instead. Agents get jobs whenever they have enough free cores
+    and jobs of an agent that disconnects are queued again cfg.job_agent_retries times.
+    If cfg.job_daemon is set and the daemon is running, cores are leased from the daemon so that all NAVETTA processes on the host share its core budget
+    @param test_done: Function called with (test, [(job, result),...]) when all jobs of a test have finished
+    @return a list of tests that had failing jobs
+    """
+    def run(self, test_done = lambda test, job_results: None):
+        return asyncio.run(self._run(test_done))
+
+    async def _run(self, test_done):
+        engine = ProcessEngine(memory_limit = self._memory_limit)
+        validation_engine = ProcessEngine(cfg.validation_workers, self._memory_limit)
+        failed = []
+        self.failed_jobs = []
+        free_cores = self._core_budget
+        self._daemon = await self._connect_daemon()
+        cpu_allocator = CpuAllocator() if self._affinity and not self._daemon else None
+        pool = await AgentPool(self._coordinator).start() if self._coordinator else None
+        remote = {} #Agents and reserved cores of jobs running on worker agents
+        pool_changed = None
+        queue = self._interleave(self._cost_model.sort_jobs(self._jobs))
+        running = {} #Encoding jobs
+        validating = {} #Jobs being validated with their results
+        retries = {job: job.test._get_retries() for job in queue}
+        timeout_retries = {job: self._timeout_retries for job in queue}
+        agent_retries = {job: self._agent_retries for job in queue}
+        for (test, state) in self._tests.items():
+            if state[0] == 0:
+                test_done(test, state[1])
+        self._events = EventLog(self._event_path).open()
+        self._events.run_start(workers = self._workers, core_budget = self._core_budget, jobs = len(self._jobs),
+                               coordinator = self._coordinator, daemon = self._daemon_path if self._daemon else None)
+        for (event, job) in self._skipped:
+            self._events.write(event, job)
+        for job in queue:
+            self._events.write(QUEUED, job)
+        self._progress = JobProgress(len(self._jobs), queue, self._cost_model, self._workers, self._core_budget).start()
+        ticker = asyncio.ensure_future(self._progress.run())
+        try:
+            while queue or running or validating:
+                # Start every queued job that fits in the remaining cores
+                for job in list(queue):
+                    if pool:
+                        reserved = pool.reserve(job.threads)
+                        if reserved:
+                            queue.remove(job)
+                            remote[job] = reserved
+                            running[asyncio.ensure_future(self._run_job(job, reserved[0]))] = job
+                        continue
+                    if self._daemon:
+                        # The daemon grants cores in the order the jobs are queued
+                        queue.remove(job)
+                        running[asyncio.ensure_future(self._run_daemon_job(job, engine))] = job
+                        continue
+                    if len(running) >= self._workers or free_cores <= 0:
+                        break
+                    if self._job_cores(job) <= free_cores:
+                        if cpu_allocator:
+                            job.cpus = cpu_allocator.allocate(self._job_cores(job))
+                            if job.cpus is None:
+                                continue
+                        queue.remove(job)
+                        free_cores -= self._job_cores(job)
+                        running[asyncio.ensure_future(self._run_job(job, engine))] = job
+
+                if pool and (pool_changed is None or pool_changed.done()):
+                    pool_changed = asyncio.ensure_future(pool.wait_changed())
+                (done, _) = await asyncio.wait(list(running) + list(validating) + ([pool_changed] if pool else []), return_when = asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is pool_changed:
+                        # Jobs on agents are limited by the cores of the connected agents
+                        self._progress.workers = self._progress.core_budget = max(1, pool.num_cores())
+                        continue
+                    if task in running:
+                        job = running.pop(task)
+                        if job in remote:
+                            pool.release(*remote.pop(job))
+                        elif not self._daemon:
+                            free_cores += self._job_cores(job)
+                        if cpu_allocator:
+                            cpu_allocator.release(job.cpus)
+                        (result, status, is_valid) = (None, EncodeJob.DONE, True)
+                        try:
+                            (result, wall_time) = task.result()
+                            enc_time = job.test._get_result_time(result)
+                            self._cost_model.record(job, enc_time if enc_time is not None else wall_time, self._job_bytes(job))
+                        except AgentLostError:
+                            if agent_retries[job] > 0:
+                                print("Lost worker agent of job {}. Starting it again.".format(job))
+                                agent_retries[job] -= 1
+                                self._events.write(RETRY, job, reason = "agent lost")
+                                queue.insert(0, job)
+                                continue
+                            print("Lost worker agent of job {}.".format(job))
+                            status = EncodeJob.ERROR
+                        except asyncio.TimeoutError:
+                            if timeout_retries[job] > 0:
+                                print("Job {} timed out after {} s. Starting it again.".format(job, self._timeout))
+                                timeout_retries[job] -= 1
+                                self._events.write(RETRY, job, reason = "timeout")
+                                queue.insert(0, job)
+                                continue
+                            print("Job {} timed out after {} s.".format(job, self._timeout))
+                            status = EncodeJob.TIMEOUT
+                        except ProcessKilledError as err:
+                            print("Job {} failed: {}.".format(job, err))
+                            status = EncodeJob.KILLED
+                        except Exception:
+                            print("Error in job {}:".format(job))
+                            traceback.print_exc()
+                            status = EncodeJob.ERROR
+                        if status == EncodeJob.DONE and job.test._validates() and wall_time is not None:
+                            validating[asyncio.ensure_future(self._validate_job(job, validation_engine, result))] = (job, result)
+                            continue
+                    else:
+                        (job, result) = validating.pop(task)
+                        status = EncodeJob.DONE
+                        try:
+                            is_valid = task.result()
+                        except Exception:
+                            print("Error validating job {}:".format(job))
+                            traceback.print_exc()
+                            is_valid = False
+                        if not is_valid and retries[job] > 0:
+                            #Encode again before any other queued job
+                            retries[job] -= 1
+                            self._events.write(RETRY, job, reason = "validation")
+                            queue.insert(0, job)
+                            continue
+                        if not is_valid:
+                            print("Test {} failed to decode in sequence {} with qp {}.".format(job.test._test_name, job.seq, job.qp))
+                    self._job_done(job, result, status, test_done, failed, is_valid)
+                    self._progress.job_done()
+        finally:
+            # Cancel running jobs if interrupted. Cancelling a job kills its processes
+            for task in list(running) + list(validating):
+                task.cancel()
+            if running or validating:
+                await asyncio.wait(list(running) + list(validating))
+            ticker.cancel()
+            if pool_changed:
+                pool_changed.cancel()
+            if pool:
+                await pool.close()
+            if self._daemon:
+                await self._daemon.close()
+                self._daemon = None
+            self._progress.close()
+            self._progress = None
+            self._events.write(RUN_END, failed = len(self.failed_jobs))
+            self._events.close()
+            self._skipped = []
+            self._cost_model.save()
+            self._jobs = []
+            self._tests = {}
+            self._keys = {}
+            self._groups = []
+        return failed
@@ -0,0 +1,56 @@
+"""
+Static splitting of encode jobs between machines
+"""
+
+from .CostModel import CostModel
+
+"""
+Parse a shard definition
+@param shard: "i/N" string or (i, N) tuple where i is the one based index of the shard and N the number of shards
+@return (i, N)
+"""
+def parse_shard(shard):
+    if isinstance(shard, str):
+        try:
+            (index, count) = map(int, shard.split("/"))
+        except ValueError:
+            raise ValueError("Invalid shard {}. Give shard as i/N".format(shard))
+    else:
+        (index, count) = shard
+    if not 1 <= index <= count:
+        raise ValueError("Invalid shard {}/{}. Shard index must be between 1 and the number of shards".format(index, count))
+    return (index, count)
+
+"""
+Return a key that identifies the job on every machine running the same tests
+"""
+def shard_key(job):
+    return (job.test._get_fname_hash(), job.seq, job.qp)
+
+"""
+Split jobs into shards with about equal total cost. The split only depends on the jobs so every machine gets the same split.
+Encode time history is not used because it differs between machines. Cost is estimated from the amount of pixels to encode
+@param count: Number of shards
+@return a list of job lists, one for each shard
+"""
+def split_jobs(jobs, count):
+    costs = [(max(CostModel.job_units(job), 1), shard_key(job), job) for job in jobs]
+    # Longest job first to the shard with the least cost so far
+    costs.sort(key = lambda cost: (-cost[0], cost[1]))
+    shards = [[] for _ in range(count)]
+    loads = [0] * count
+    for (cost, _, job) in costs:
+        i = loads.index(min(loads))
+        shards[i].append(job)
+        loads[i] += cost
+    return shards
+
+"""
+Return the keys of the jobs that belong to the given shard
+@param tests: All tests of the run. Jobs of tests with existing results are included so the split does not depend on local results
+@param shard: Shard definition accepted by parse_shard
+"""
+def shard_jobs(tests, shard):
+    (index, count) = parse_shard(shard)
+    jobs = {shard_key(job): job for test in tests for job in test._get_jobs()}
+    return set(shard_key(job) for job in split_jobs(list(jobs.values()), count)[index - 1])
@@ -0,0 +1,105 @@
+"""
+Receive output files of processes without writing them to disk
+"""
+
+import asyncio
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+class OutputSink:
+    """Give a process a named pipe in place of an output file and count (and optionally hash) the bytes written to it.
+    Encoders need to write the file sequentially. Where named pipes are not supported the file is written to disk as usual"""
+
+    __BLOCK = 1 << 20
+
+    """
+    @param path: Output file of the process
+    @param stream: If True the output goes through a named pipe and nothing is written to disk. Otherwise the file is written normally
+    @param hash: Calculate the SHA-256 of the output
+    """
+    def __init__(self, path, stream = True, hash = False):
+        self._file = path
+        self._stream = stream and hasattr(os, "mkfifo")
+        self._hash = hash
+        self.path = path # Path to give to the process
+        self.size = None # Bytes written by the process
+        self.digest = None # SHA-256 of the output if hashing was requested
+        self._opened = False
+        self._unblocked = False # The pipe was opened by _unblock. The process may have written it just before, so this alone does not mean it was not written
+        self._dir = None
+
+    """
+    Return the command with the output file replaced by the path of the sink
+    """
+    def command(self, cmd):
+        return [self.path if arg == self._file else arg for arg in cmd]
+
+    async def __aenter__(self):
+        if self._stream:
+            self._dir = tempfile.mkdtemp()
+            # Keep the file name so encoders that look at the extension work the same way
+            self.path = os.path.join(self._dir, os.path.basename(self._file))
+            os.mkfifo(self.path)
+            loop = asyncio.get_running_loop()
+            self._done = loop.create_future()
+            def drain():
+                try:
+                    result = self._drain()
+                    loop.call_soon_threadsafe(lambda: self._done.done() or self._done.set_result(result))
+                except OSError as err:
+                    loop.call_soon_threadsafe(lambda err = err: self._done.done() or self._done.set_exception(err))
+            self._thread = threading.Thread(target = drain, daemon = True)
+            self._thread.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._stream:
+            try:
+                self._unblock()
+                (self.size, self.digest) = await self._done
+            finally:
+                shutil.rmtree(self._dir, ignore_errors = True)
+            # The reader may not have marked the pipe opened yet when the process already wrote it, so only a pipe that gave no data was not written
+            if exc_type is None and self._unblocked and not self.size:
+                raise FileNotFoundError(errno.ENOENT, "Output file was not written", self._file)
+        elif exc_type is None:
+            self.size = os.stat(self._file).st_size
+            if self._hash:
+                hasher = hashlib.sha256()
+                with open(self._file, mode = 'rb') as file:
+                    for block in iter(lambda: file.read(self.__BLOCK), b""):
+                        hasher.update(block)
+                self.digest = hasher.hexdigest()
+        return False
+
+    """
+    Read the pipe until the writer closes it
+    @return (size, digest)
+    """
+    def _drain(self):
+        hasher = hashlib.sha256() if self._hash else None
+        size = 0
+        with open(self.path, mode = 'rb', buffering = 0) as pipe:
+            self._opened = True
+            for block in iter(lambda: pipe.read(self.__BLOCK), b""):
+                size += len(block)
+                if hasher:
+                    hasher.update(block)
+        return (size, hasher.hexdigest() if hasher else None)
+
+    """
+    Let the reader finish if the process exited without opening the pipe
+    """
+    def _unblock(self):
+        while self._thread.is_alive() and not self._opened:
+            try:
+                os.close(os.open(self.path, os.O_WRONLY | os.O_NONBLOCK))
+                self._unblocked = True
+                return
+            except OSError:
+                time.sleep(0.01) #Reader has not opened the pipe yet
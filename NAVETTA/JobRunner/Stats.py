@@ -0,0 +1,43 @@
+"""
+Statistics for repeated encoding time measurements
+"""
+
+from statistics import median
+from math import comb
+
+# Timing statistics keys
+TIMES = r"times"
+MEDIAN = r"median"
+MIN = r"min"
+CI = r"ci"
+
+"""
+Return the zero based order statistic indices (lo, hi) that give a distribution free confidence interval for the median of n samples
+"""
+def median_ci_ranks(n, confidence):
+    alpha = 1 - confidence
+    # Largest k for which the probability of fewer than k samples being below the median is at most alpha/2
+    k = 0
+    tail = comb(n, 0) / 2**n
+    while k + 1 <= n // 2 and tail <= alpha / 2:
+        k += 1
+        tail += comb(n, k) / 2**n
+    lo = max(k - 1, 0)
+    return (lo, n - 1 - lo)
+
+"""
+Calculate robust statistics of repeated time measurements
+@param times: Measured times. None values are ignored
+@param confidence: Confidence level of the interval for the median
+@return a dict with the TIMES, MEDIAN, MIN and CI = [low, high] of the measurements or None if there are no times
+"""
+def timing_stats(times, confidence = 0.95):
+    times = [t for t in times if t is not None]
+    if not times:
+        return None
+    s_times = sorted(times)
+    (lo, hi) = median_ci_ranks(len(s_times), confidence)
+    return {TIMES: times,
+            MEDIAN: median(s_times),
+            MIN: s_times[0],
+            CI: [s_times[lo], s_times[hi]]}
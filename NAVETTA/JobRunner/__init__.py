@@ -0,0 +1,17 @@
+from .Job import EncodeJob
+from .Scheduler import JobScheduler
+from .Engine import ProcessEngine, ProcessKilledError
+from .CostModel import CostModel
+from .ResultCache import ResultCache
+from .Fingerprint import fingerprint
+from .Stats import timing_stats
+from .Affinity import CpuAllocator
+from .Shard import parse_shard, shard_key, shard_jobs
+from .Remote import AgentPool, AgentLostError
+from .Planner import plan_tests
+from .Sink import OutputSink
+from .LogStream import LogStream
+from .Progress import JobProgress
+from .Events import EventLog, read_events
+
+__all__ = ["EncodeJob", "JobScheduler", "ProcessEngine", "ProcessKilledError", "CostModel", "ResultCache", "fingerprint", "timing_stats", "CpuAllocator", "parse_shard", "shard_key", "shard_jobs", "AgentPool", "AgentLostError", "plan_tests", "OutputSink", "LogStream", "JobProgress", "EventLog", "read_events"]
@@ -0,0 +1,266 @@
+"""
+SQLite database of test results. Stores the results of each test with its jobs and the metrics of every layer in indexed tables,
+so results can be queried across tests without loading and parsing result files. Import result files of older runs with:
+    python -m TestInstances.ResultStore [results folder]
+"""
+
+from pathlib import Path
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+import cfg
+from JobRunner.Engine import WALL, UTIME, STIME, MAXRSS
+
+TOTAL_LAYER = -1 # Layer id of the summary values of all layers
+
+"""
+Return the key a results folder is stored under. Folders are given with a trailing separator that differs between platforms
+"""
+def folder_key(folder):
+    return str(folder).rstrip("\\/")
+
+def _float(val):
+    return float(str(val).replace(",", ".")) if val is not None else None
+
+class ResultStore:
+    """Results of tests in an SQLite database. Each test is identified by its results folder and hash like the result files of older runs"""
+
+    __TIMEOUT = 60 # Seconds to wait for another process writing to the database
+    __FINGERPRINT_END = r".bin" # Fingerprint files written next to result files
+    __HASH_REGEX = r"^(?P<folder>.*?)(?P<hash>[0-9a-f]{64})$"
+    __USAGE = r"usage" # Resource usage in results, see TestInstance._USAGE
+    __SCHEMA = r"""
+    CREATE TABLE IF NOT EXISTS tests (
+        id INTEGER PRIMARY KEY,
+        folder TEXT NOT NULL,
+        hash TEXT NOT NULL,
+        name TEXT,
+        version TEXT,
+        fingerprints TEXT,
+        saved REAL,
+        UNIQUE (folder, hash)
+    );
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY,
+        test_id INTEGER NOT NULL REFERENCES tests (id) ON DELETE CASCADE,
+        pos INTEGER NOT NULL,
+        seq TEXT NOT NULL,
+        qp TEXT NOT NULL,
+        base_qp INTEGER,
+        binary TEXT,
+        fingerprint TEXT,
+        args TEXT,
+        status TEXT,
+        wall REAL,
+        utime REAL,
+        stime REAL,
+        maxrss INTEGER,
+        result TEXT NOT NULL,
+        UNIQUE (test_id, seq, qp)
+    );
+    CREATE INDEX IF NOT EXISTS jobs_seq_qp ON jobs (seq, base_qp);
+    CREATE INDEX IF NOT EXISTS jobs_fingerprint ON jobs (fingerprint);
+    CREATE TABLE IF NOT EXISTS metrics (
+        job_id INTEGER NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+        layer INTEGER NOT NULL,
+        kb REAL,
+        kbs REAL,
+        time REAL,
+        psnr_y REAL,
+        psnr_u REAL,
+        psnr_v REAL,
+        PRIMARY KEY (job_id, layer)
+    );
+    CREATE VIEW IF NOT EXISTS results AS
+        SELECT tests.name AS test, tests.version, tests.folder, tests.hash, jobs.seq, jobs.qp, jobs.base_qp, jobs.fingerprint,
+               metrics.layer, metrics.kb, metrics.kbs, metrics.time, metrics.psnr_y, metrics.psnr_u, metrics.psnr_v,
+               jobs.wall, jobs.utime, jobs.stime, jobs.maxrss
+        FROM metrics JOIN jobs ON metrics.job_id = jobs.id JOIN tests ON jobs.test_id = tests.id;
+    """
+
+    """
+    @param path: Database file. Created with the tables if it does not exist
+    """
+    def __init__(self, path):
+        self._path = str(path)
+        parent = os.path.dirname(self._path)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+        self._db = sqlite3.connect(self._path, timeout = self.__TIMEOUT)
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.executescript(self.__SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _test_id(self, folder, hash):
+        row = self._db.execute("SELECT id FROM tests WHERE folder = ? AND hash = ?", (folder_key(folder), hash)).fetchone()
+        return row[0] if row else None
+
+    """
+    Return the binary fingerprints saved with the results of a test or None if the test has no results
+    """
+    def fingerprints(self, folder, hash):
+        row = self._db.execute("SELECT fingerprints FROM tests WHERE folder = ? AND hash = ?", (folder_key(folder), hash)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]) if row[0] else {}
+
+    """
+    Return the job statuses saved with the results of a test as a {(seq, qp): status} dict. Statuses that are not known are None
+    """
+    def statuses(self, folder, hash):
+        test_id = self._test_id(folder, hash)
+        if test_id is None:
+            return {}
+        return {(seq, qp): status for (seq, qp, status) in self._db.execute("SELECT seq, qp, status FROM jobs WHERE test_id = ?", (test_id,))}
+
+    """
+    Return the results of a test as a {seq: {qp: result}} dict in the order they were saved or None if the test has no results
+    """
+    def load(self, folder, hash):
+        test_id = self._test_id(folder, hash)
+        if test_id is None:
+            return None
+        results = {}
+        for (seq, qp, result) in self._db.execute("SELECT seq, qp, result FROM jobs WHERE test_id = ? ORDER BY pos", (test_id,)):
+            results.setdefault(seq, {})[qp] = json.loads(result)
+        return results
+
+    """
+    Save the results of a test replacing earlier results
+    @param results: {seq: {qp: result}} dict
+    @param name: Test name
+    @param version: Encoder version
+    @param fingerprints: {binary: digest} of the binaries used by the test
+    @param jobs: {(seq, qp): EncodeJob} of the jobs that produced the results. The status of each job is stored with its result.
+                 Results without a job are saved without binary, arguments and status
+    @param metrics_func: Function returning the metrics of a result in the form stored under TestInstance._METRICS or None if they can't be determined
+    """
+    def save(self, folder, hash, results, name = None, version = None, fingerprints = None, jobs = {}, metrics_func = None):
+        with self._db:
+            self._db.execute("DELETE FROM tests WHERE folder = ? AND hash = ?", (folder_key(folder), hash))
+            test_id = self._db.execute("INSERT INTO tests (folder, hash, name, version, fingerprints, saved) VALUES (?, ?, ?, ?, ?, ?)",
+                                       (folder_key(folder), hash, name, str(version) if version is not None else None,
+                                        json.dumps(fingerprints) if fingerprints is not None else None, time.time())).lastrowid
+            pos = 0
+            for (seq, qps) in results.items():
+                for (qp, res) in qps.items():
+                    self._insert_job(test_id, pos, str(seq), str(qp), res, fingerprints or {}, jobs.get((seq, qp)), metrics_func)
+                    pos += 1
+
+    def _insert_job(self, test_id, pos, seq, qp, res, fingerprints, job, metrics_func):
+        base_qp = re.search(r"-?\d+", qp)
+        binary = str(job.cmd[0]) if job is not None else next(iter(fingerprints), None) #The encoder is the first binary in fingerprint files
+        usage = res.get(self.__USAGE) or {}
+        metrics = metrics_func(res) if metrics_func else None #May store parsed metrics in the result
+        job_id = self._db.execute("INSERT INTO jobs (test_id, pos, seq, qp, base_qp, binary, fingerprint, args, status, wall, utime, stime, maxrss, result) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  (test_id, pos, seq, qp, int(base_qp.group()) if base_qp else None, binary,
+                                   fingerprints.get(binary) if binary else None, json.dumps([str(arg) for arg in job.cmd[1:]]) if job is not None else None,
+                                   job.status if job is not None else None, #Unknown for results of older runs
+                                   usage.get(WALL), usage.get(UTIME), usage.get(STIME), usage.get(MAXRSS), json.dumps(res))).lastrowid
+        if not metrics:
+            return
+        num_layers = len(metrics["kbs"])
+        for i in range(num_layers):
+            psnr = list(metrics["psnr"][i]) + [None] * 3
+            self._db.execute("INSERT INTO metrics (job_id, layer, kb, kbs, time, psnr_y, psnr_u, psnr_v) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (job_id, i if i < num_layers - 1 else TOTAL_LAYER, _float(metrics["kb"][i]), _float(metrics["kbs"][i]),
+                              _float(metrics["time"][i]), _float(psnr[0]), _float(psnr[1]), _float(psnr[2])))
+
+    """
+    Return rows of the results view as dicts
+    @param seq: Only return results of this sequence
+    @param qp: Only return results with this base layer qp (int) or qp tuple (str, e.g. "(32, 28)")
+    @param test: Only return results of tests with this name
+    @param layer: Only return metrics of this layer. TOTAL_LAYER for the summary of all layers, None for every layer
+    """
+    def query(self, seq = None, qp = None, test = None, layer = None):
+        (conds, params) = ([], [])
+        for (col, val) in (("seq", seq), ("base_qp" if isinstance(qp, int) else "qp", qp), ("test", test), ("layer", layer)):
+            if val is not None:
+                conds.append("{} = ?".format(col))
+                params.append(val)
+        cursor = self._db.execute("SELECT * FROM results" + (" WHERE " + " AND ".join(conds) if conds else "") + " ORDER BY test, seq, base_qp, layer", params)
+        cols = [desc[0] for desc in cursor.description]
+        return [dict(zip(cols, row)) for row in cursor]
+
+    """
+    Import result files of older runs
+    @param res_path: Results folder containing the result folders of the test classes
+    @param metrics_funcs: {folder: function} returning the metrics of a result like metrics_func of save. If given, only files in these folders are imported,
+                          so files of other tools in the results folder, e.g. the job result cache, are left out
+    @param replace: Replace results that are already in the database
+    @return number of imported result files
+    """
+    def import_files(self, res_path, metrics_funcs = {}, replace = False):
+        res_path = os.path.join(res_path, "")
+        funcs = {folder_key(folder): func for (folder, func) in metrics_funcs.items()}
+        num_imported = 0
+        for (root, _, files) in os.walk(res_path):
+            for fname in sorted(files):
+                rel = os.path.relpath(os.path.join(root, fname), res_path)
+                match = re.match(self.__HASH_REGEX, rel)
+                if not match:
+                    continue #Checkpoints, fingerprints and other files
+                (folder, hash) = (folder_key(match.group("folder")), match.group("hash"))
+                if funcs and folder not in funcs:
+                    continue
+                if not replace and self._test_id(folder, hash) is not None:
+                    continue
+                fpath = Path(root, fname)
+                try:
+                    with fpath.open(mode = 'r') as file:
+                        results = json.load(file)
+                except ValueError:
+                    results = None
+                if not isinstance(results, dict) or not all(isinstance(qps, dict) and all(isinstance(res, dict) for res in qps.values()) for qps in results.values()):
+                    print("Skipping {}: not a result file".format(fpath))
+                    continue
+                fingerprints = None
+                print_file = fpath.with_name(fpath.name + self.__FINGERPRINT_END)
+                if print_file.is_file():
+                    with print_file.open(mode = 'r') as file:
+                        fingerprints = json.load(file)
+                self.save(folder, hash, results, fingerprints = fingerprints, metrics_func = funcs.get(folder))
+                num_imported += 1
+        return num_imported
+
+"""
+Open the result database of the results folder
+@param res_path: Results folder. Defaults to cfg.results
+@param create: Create the database if it does not exist
+@return a ResultStore or None if cfg.result_db is not set or the database does not exist and create is False
+"""
+def open_store(res_path = None, create = True):
+    if not cfg.result_db:
+        return None
+    path = (res_path if res_path else cfg.results) + cfg.result_db
+    if not create and not os.path.isfile(path):
+        return None
+    return ResultStore(path)
+
+def main():
+    from .skvzTestInstance import skvzTestInstance
+    from .kvzTestInstance import kvzTestInstance
+    from .shmTestInstance import shmTestInstance
+    res_path = sys.argv[1] if len(sys.argv) > 1 else cfg.results
+    with ResultStore(os.path.join(res_path, "") + (cfg.result_db if cfg.result_db else r"results.sqlite")) as store:
+        funcs = {cls._get_res_folder(): cls._result_metrics for cls in (skvzTestInstance, kvzTestInstance, shmTestInstance)}
+        num_imported = store.import_files(res_path, funcs, replace = "--replace" in sys.argv[2:])
+    print("Imported {} result files into {}".format(num_imported, store._path))
+
+if __name__ == "__main__":
+    main()
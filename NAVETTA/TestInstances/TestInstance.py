@@ -1,11 +1,33 @@
 import abc
 import cfg
 import json
+import os
 from pathlib import Path
+import asyncio
+from JobRunner import JobScheduler, EncodeJob, OutputSink, LogStream, fingerprint, timing_stats
+from JobRunner.LogStream import COMPRESSED_END
+from JobRunner.Engine import WALL, UTIME, STIME, MAXRSS
+from JobRunner.Stats import MEDIAN, CI
+from .ResultStore import open_store, TOTAL_LAYER
 
 class TestInstance(abc.ABC):
     """Abstract base class that defines the interface for test instances"""
 
+    __CHECKPOINT_END = r".part"
+    __FINGERPRINT_END = r".bin"
+
+    _USAGE = r"usage" #Resource usage of the encoder process
+    _DEC_USAGE = r"decoder usage" #Resource usage of the validating decoder process
+    _TIMING = r"timing" #Statistics of repeated encoding time measurements
+    _BS_HASH = r"bitstream sha256" #Hash of the encoder output if cfg.job_hash_bitstreams is set
+    _RES = r"output" #Full encoder log. Only found in results of older runs
+    _FS = r"file size"
+    _METRICS = r"metrics" #Values parsed from the encoder log
+    _PARSER = r"parser" #Stamp of the parser in metrics. Metrics of results that contain the encoder log are parsed again if the stamp changes
+    _PARSER_VERSION = 1 #Increase when the parsing of encoder logs changes
+    _frame_regex = r"^\s*POC\s" #Per frame lines of the encoder log that are not needed for the results
+    __TIMING_END = r".timing"
+
     """
     Create a test instance object
     @param inputs: Specify input files for each input. Can be a list of input sets for several sequences. Same parameter will be used for each input set.
@@ -25,6 +47,7 @@ class TestInstance(abc.ABC):
     @abc.abstractmethod
     def __init__(self, test_name, inputs, input_sizes=[()], input_names=[()], layer_args=(), layer_sizes=[()], input_layer_scales=(), qps=(22, 27, 32, 37), out_name=r"out\\out", bin_name="", version=0, **misc):
         self._results = {}
+        self._job_statuses = {} #Job status from EncodeJob for each (seq, qp) of the results. Not known for results of older runs
         self._test_name = test_name
         pass
 
@@ -44,42 +67,417 @@ class TestInstance(abc.ABC):
         pass
     
     """
-    Save results to file
+    Save results to the result database or to a file if cfg.result_db is not set
     """
     def _save_results(self):
-        fpath = Path(cfg.results + self._get_res_folder() + self._get_fname_hash())
+        store = open_store()
+        if store:
+            jobs = {(job.seq, job.qp): job for job in self._get_jobs()}
+            for (key, job) in jobs.items():
+                job.status = self._job_statuses.get(key)
+            with store:
+                store.save(self._get_res_folder(), self._get_fname_hash(), self._results, name = self._test_name, version = getattr(self, "_version", None),
+                           fingerprints = self._get_bin_fingerprints(), jobs = jobs, metrics_func = self._metrics_for_store)
+        else:
+            fpath = Path(cfg.results + self._get_res_folder() + self._get_fname_hash())
+            if not fpath.parent.exists():
+                fpath.parent.mkdir()
+            file = fpath.open(mode='w')
+            json.dump(self._results,file,indent=2)
+            file.close()
+            with fpath.with_name(fpath.name + self.__FINGERPRINT_END).open(mode='w') as file:
+                json.dump(self._get_bin_fingerprints(), file, indent=2)
+        #Results of single jobs are not needed after all results are saved
+        if self._checkpoint_path().exists():
+            self._checkpoint_path().unlink()
+
+    """
+    Return the binaries that affect the results of the test
+    """
+    def _get_binaries(self):
+        return [self._bin_name]
+
+    """
+    Return content fingerprints of the binaries used by the test
+    """
+    def _get_bin_fingerprints(self):
+        return {str(binary): fingerprint(binary) for binary in self._get_binaries()}
+
+    """
+    File for storing results of finished jobs while the test is still running
+    @param res_path: Results folder. Defaults to cfg.results
+    """
+    def _checkpoint_path(self, res_path = None):
+        return Path((res_path if res_path else cfg.results) + self._get_res_folder() + self._get_fname_hash() + self.__CHECKPOINT_END)
+
+    """
+    Append the result of a finished job to the checkpoint file so it is not lost if the run is interrupted
+    @param status: Job status from EncodeJob. Failed jobs are recorded with a None result and run again on resume
+    """
+    def _save_job_result(self, job, result, status = EncodeJob.DONE):
+        fpath = self._checkpoint_path()
         if not fpath.parent.exists():
             fpath.parent.mkdir()
-        file = fpath.open(mode='w')
-        json.dump(self._results,file,indent=2)
-        file.close()
+        with fpath.open(mode='a') as file:
+            file.write(json.dumps({"seq": job.seq, "qp": job.qp, "status": status, "result": result}) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
 
     """
-    Load results from file
+    Load results of jobs finished by an earlier interrupted run
+    @param res_path: Results folder. Defaults to cfg.results
+    @return a dict with (seq, qp) keys and job results as values
+    """
+    def _load_job_results(self, res_path = None):
+        job_results = {}
+        fpath = self._checkpoint_path(res_path)
+        if fpath.is_file():
+            with fpath.open(mode='r') as file:
+                for line in file:
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        continue #Partially written line from an interrupted run
+                    if item.get("status", EncodeJob.DONE) != EncodeJob.DONE:
+                        continue #Failed jobs are run again
+                    job_results[(item["seq"], item["qp"])] = item["result"]
+        return job_results
+
+    """
+    Load job results of a shard run from its results folder. The saved results are used if the shard had complete results for the test
+    @return a dict with (seq, qp) keys and job results as values
+    """
+    def _load_shard_results(self, res_path):
+        job_results = self._load_job_results(res_path)
+        results = self._read_results(self._get_fname_hash(), res_path)
+        for (seq, qps) in (results if results else {}).items():
+            for (qp, res) in qps.items():
+                job_results[(seq, qp)] = res
+        return job_results
+
+    """
+    Read saved results from the result database or from the result file of older runs
+    @param hash: Hash of the test
+    @param res_path: Results folder. Defaults to cfg.results
+    @return the results or None if there are no results for the hash
+    """
+    def _read_results(self, hash, res_path = None):
+        res_path = res_path if res_path else cfg.results
+        store = open_store(res_path, create = False)
+        if store:
+            with store:
+                results = store.load(self._get_res_folder(), hash)
+            if results is not None:
+                return results
+        fpath = Path(res_path + self._get_res_folder() + hash)
+        if not fpath.is_file():
+            return None
+        with fpath.open(mode='r') as file:
+            return json.load(file)
+
+    """
+    Read the job statuses saved with the results in the result database
+    @return a dict with (seq, qp) keys and EncodeJob statuses as values. Empty if the results are not in the database
+    """
+    def _read_statuses(self, hash):
+        store = open_store(create = False)
+        if not store:
+            return {}
+        with store:
+            return store.statuses(self._get_res_folder(), hash)
+
+    """
+    Load saved results. Metrics are parsed for results that don't have them, but nothing is written
+    @return True if metrics were added to the results and they should be saved again
     """
     def _load_results(self,input_res=False):
-        if input_res:
-            hash = input("Hash for {}: ".format(self._test_name))
-            file = open(cfg.results + self._get_res_folder() + hash, mode = 'r')
-        else:
-            file = open(cfg.results + self._get_res_folder() + self._get_fname_hash(),mode = 'r')
-        self._results = json.load(file)
-        file.close()
+        hash = input("Hash for {}: ".format(self._test_name)) if input_res else self._get_fname_hash()
+        results = self._read_results(hash)
+        if results is None:
+            raise FileNotFoundError("No results saved for test {} with hash {}".format(self._test_name, hash))
+        self._results = results
+        self._job_statuses = self._read_statuses(hash)
+        return self._update_metrics()
 
     """
-    Check if the result file for the current test exist
+    Return the binary fingerprints saved with the results of the test, an empty dict if they were not saved or None if there are no results
     """
-    def _results_exist(self):
+    def _saved_fingerprints(self):
+        store = open_store(create = False)
+        if store:
+            with store:
+                saved = store.fingerprints(self._get_res_folder(), self._get_fname_hash())
+            if saved is not None:
+                return saved
         res_file = Path(cfg.results + self._get_res_folder() + self._get_fname_hash())
-        return res_file.is_file()
+        if not res_file.is_file():
+            return None
+        print_file = res_file.with_name(res_file.name + self.__FINGERPRINT_END)
+        if not print_file.is_file():
+            return {}
+        with print_file.open(mode='r') as file:
+            return json.load(file)
 
     """
-    Function that executes the actual tests
+    Check if up to date results for the current test exist
+    """
+    def _results_exist(self):
+        saved = self._saved_fingerprints()
+        if saved is None:
+            return False
+        #Results are out of date if a binary has been rebuilt with different contents. Binaries that can't be found are not checked
+        if saved:
+            for (binary, digest) in self._get_bin_fingerprints().items():
+                if digest and saved.get(binary) and saved[binary] != digest:
+                    print("Binary {} has changed. Running test {} again.".format(binary, self._test_name))
+                    return False
+        return True
+
+    """
+    Build the encode jobs needed for running the tests
+    @return a list of EncodeJob objects in the order the results should be stored in
     """
     @abc.abstractmethod
-    def _run_tests(self):
+    def _get_jobs(self):
         pass
 
+    """
+    Coroutine that runs a single encode job. Several jobs may be running at the same time
+    @param engine: ProcessEngine used for running the encoder and decoder processes
+    @return the result dict stored for the sequence and qp of the job
+    """
+    @abc.abstractmethod
+    async def _run_job(self, job, engine):
+        pass
+
+    """
+    Return true if job outputs should be validated with _validate_job
+    """
+    def _validates(self):
+        return False
+
+    """
+    Coroutine that checks the output of a finished encode job
+    @param engine: ProcessEngine used for running the decoder
+    @param result: Result of the job. Resource usage of the decoder is added to it
+    @return true if the output is valid
+    """
+    async def _validate_job(self, job, engine, result):
+        return True
+
+    """
+    Return the number of times a job is encoded again if its output fails validation
+    """
+    def _get_retries(self):
+        return 0
+
+    """
+    Return the number of times the encoding time of each job is measured
+    """
+    def _get_time_runs(self):
+        return 1
+
+    """
+    Return an OutputSink for the bitstream of the job. The bitstream is only written to disk if job.keep_output is set
+    """
+    def _output_sink(self, job):
+        return OutputSink(job.outfile, stream = not job.keep_output, hash = cfg.job_hash_bitstreams)
+
+    """
+    Return a LogStream for the encoder log of the job. A compressed copy of the log is written if cfg.job_compress_logs is set
+    """
+    def _log_stream(self, job):
+        return LogStream(self._frame_regex, gz_path = job.outlog + COMPRESSED_END if cfg.job_compress_logs else None, on_frame = job.on_frame)
+
+    """
+    Parse a single sequence and qp result
+    @param result: Result dict containing the encoder log in _RES and the file size in _FS
+    @return (kbs,kb,time,psnr,layers) where the first four are dicts with layer id keys and layers are the layer ids ending with l_tot
+    """
+    @abc.abstractmethod
+    def _parse_result(self, result, l_tot):
+        pass
+
+    """
+    Parse the metrics of a finished encode from its log so the log does not need to be stored
+    @param log: LogStream of the encoder output
+    @return metrics in the form stored in results under _METRICS
+    @raise ValueError if the log can't be parsed
+    """
+    def _stream_metrics(self, log, file_size):
+        try:
+            metrics = self._pack_metrics(*self._parse_result({self._RES: log.text(), self._FS: file_size}, None))
+        except (AttributeError, TypeError, ValueError) as err:
+            raise ValueError("Can't parse the encoder log ({}). Last lines of the log:\n{}".format(err, log.tail())) from None
+        metrics[self._PARSER] = self._parser_stamp()
+        return metrics
+
+    """
+    Return the stamp identifying the parser of the test. Subclasses include anything else the parsed values depend on
+    """
+    def _parser_stamp(self):
+        return str(self._PARSER_VERSION)
+
+    """
+    Check if the metrics of a result need to be parsed from the encoder log in the result
+    """
+    def _metrics_stale(self, result):
+        return self._RES in result and (result.get(self._METRICS) or {}).get(self._PARSER) != self._parser_stamp()
+
+    """
+    Parse the encoder log of a result and store the metrics in the result
+    @return the metrics
+    """
+    def _cache_metrics(self, result):
+        metrics = self._pack_metrics(*self._parse_result(result, TOTAL_LAYER))
+        metrics[self._PARSER] = self._parser_stamp()
+        result[self._METRICS] = metrics
+        return metrics
+
+    """
+    Parse the metrics of loaded results that contain the encoder log and have no metrics or metrics from an older parser.
+    Results that can't be parsed are left for getResults to report
+    @return True if any metrics were updated
+    """
+    def _update_metrics(self):
+        updated = False
+        for qps in self._results.values():
+            for res in qps.values():
+                if not self._metrics_stale(res):
+                    continue
+                try:
+                    self._cache_metrics(res)
+                    updated = True
+                except (AttributeError, TypeError, ValueError, KeyError):
+                    pass
+        return updated
+
+    """
+    Return parsed values in the form stored in results under _METRICS
+    @param layers: Layer ids of the values ending with the summary layer
+    """
+    @staticmethod
+    def _pack_metrics(kbs, kb, time, psnr, layers):
+        return {"kbs": [kbs[lid] for lid in layers],
+                "kb": [kb[lid] for lid in layers],
+                "time": [time[lid] for lid in layers],
+                "psnr": [list(psnr[lid]) for lid in layers]}
+
+    """
+    Return the metrics of a result for the metrics table of the result database or None if the result can't be parsed
+    """
+    def _metrics_for_store(self, result):
+        try:
+            return self._pack_metrics(*self._getMetrics(result, TOTAL_LAYER))
+        except (AttributeError, TypeError, ValueError, KeyError):
+            return None
+
+    """
+    Return the metrics of a result without a test instance, used when importing result files of older runs.
+    Subclasses parse the encoder log of results that don't have metrics
+    @return metrics in the form stored under _METRICS or None if they can't be determined
+    """
+    @classmethod
+    def _result_metrics(cls, result):
+        return result.get(cls._METRICS)
+
+    """
+    Return the parsed values of a single sequence and qp result. Older results that contain the whole encoder log are parsed from the log once and the metrics are kept in the result
+    @return (kbs,kb,time,psnr,layers) as returned by _parse_result
+    """
+    def _getMetrics(self, result, l_tot):
+        metrics = self._cache_metrics(result) if self._metrics_stale(result) else result.get(self._METRICS)
+        layers = tuple(range(len(metrics["kbs"]) - 1)) + (l_tot,)
+        (kbs, kb, time, psnr) = (dict(zip(layers, metrics[key])) for key in ("kbs", "kb", "time", "psnr"))
+        return (kbs, kb, time, {lid: tuple(val) for (lid, val) in psnr.items()}, layers)
+
+    """
+    Add the bitstream hash from the sink to a job result
+    """
+    def _add_sink_vals(self, result, sink):
+        if sink.digest is not None:
+            result[self._BS_HASH] = sink.digest
+        return result
+
+    """
+    Coroutine that runs the encode of a finished job again to measure its encoding time job.time_runs times in total.
+    The bitstream and metrics of the first run are kept. Timing statistics are stored in the result
+    @param timeout: Wall clock time limit in seconds for each run or None
+    """
+    async def _run_timing(self, job, engine, result, timeout = None):
+        outfile = job.outfile + self.__TIMING_END
+        cmd = [outfile if arg == job.outfile else arg for arg in job.cmd]
+        timing_job = EncodeJob(self, job.seq, job.qp, cmd, outfile, job.outlog + self.__TIMING_END, job.threads, job.inputs, job.configs)
+        timing_job.cpus = job.cpus
+        timing_job.keep_output = job.keep_output
+        timing_job.on_frame = job.on_frame
+        # Use the time reported by the encoder if it can be parsed and the measured wall time otherwise
+        def get_time(res):
+            enc_time = self._get_result_time(res)
+            return enc_time if enc_time is not None else (res.get(self._USAGE) or {}).get(WALL)
+        times = [get_time(result)]
+        try:
+            for _ in range(job.time_runs - 1):
+                times.append(get_time(await asyncio.wait_for(self._run_job(timing_job, engine), timeout)))
+        finally:
+            for fname in (timing_job.outfile, timing_job.outlog, timing_job.outlog + COMPRESSED_END):
+                if os.path.exists(fname):
+                    os.remove(fname)
+        result[self._TIMING] = timing_stats(times, cfg.timing_confidence)
+
+    """
+    Return the total encoding time parsed from the result of a single job or None if it can't be parsed
+    """
+    @abc.abstractmethod
+    def _get_result_time(self, result):
+        pass
+
+    """
+    Return resource usage metrics of a single sequence and qp result as keyword arguments for resBuildFunc.
+    Values are None for results that were run without resource accounting
+    """
+    @classmethod
+    def _getUsageVals(cls, result):
+        usage = result.get(cls._USAGE) or {}
+        rss = usage.get(MAXRSS)
+        return {"wall": usage.get(WALL),
+                "utime": usage.get(UTIME),
+                "stime": usage.get(STIME),
+                "rss": rss / 1024 if rss is not None else None}
+
+    """
+    Return the encoding time and its confidence interval for resBuildFunc. The median of repeated timing runs replaces the time parsed from a single run
+    @param time: Time parsed from the result
+    """
+    @classmethod
+    def _getTimingVals(cls, result, time):
+        timing = result.get(cls._TIMING)
+        if not timing:
+            return {"time": time, "time_ci": (time, time)}
+        return {"time": timing[MEDIAN], "time_ci": tuple(timing[CI])}
+
+    """
+    Set results from finished jobs. Results are stored in job order so the result file does not depend on the order jobs finish in
+    @param job_results: list of (job, result) pairs
+    """
+    def _set_job_results(self, job_results):
+        order = {(job.seq, job.qp): i for (i, job) in enumerate(self._get_jobs())}
+        self._results = {}
+        self._job_statuses = {}
+        for (job, res) in sorted(job_results, key = lambda jr: order[(jr[0].seq, jr[0].qp)]):
+            self._results.setdefault(job.seq, {})[job.qp] = res
+            self._job_statuses[(job.seq, job.qp)] = job.status
+
+    """
+    Function that executes the actual tests
+    """
+    def _run_tests(self):
+        print("Running test {} with {} workers".format(self._test_name, self._workers if self._workers else cfg.job_workers))
+        scheduler = JobScheduler(self._workers).add_test(self)
+        failed = scheduler.run(lambda test, job_results: test._set_job_results(job_results))
+        if failed:
+            raise RuntimeError("Test {} has failing jobs: {}".format(self._test_name, ", ".join("{} qp {} ({})".format(job.seq, job.qp, job.status) for job in scheduler.failed_jobs)))
+
     """
     Execute the tests.
     @param print_out: A string that is printed if the tests are run again
@@ -87,7 +485,9 @@ class TestInstance(abc.ABC):
     def run(self, print_out = "", input_res = False):
         #Check if there exists results for current parameters already
         if self._results_exist() or input_res:
-            self._load_results(input_res)
+            #Keep metrics parsed from older results so reports don't parse the logs again
+            if self._load_results(input_res) and not input_res:
+                self._save_results()
         else:
             #Need to run tests again
             print(print_out, end='')
@@ -104,7 +504,7 @@ class TestInstance(abc.ABC):
 
     """
     Return results of tests
-    @param resBuildFunc: function that builds the result dict when given values (kbs,kb,time,psnr,seq,lid,scale)
+    @param resBuildFunc: function that builds the result dict when given values (kbs,kb,time,psnr,seq,lid,scale) and optionally the time interval (time_ci) and resource usage (wall,utime,stime,rss)
     @param l_tot: identifier used for summary layer
     @return a dict with parsed results
     """
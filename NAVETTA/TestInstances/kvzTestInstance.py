@@ -19,10 +19,10 @@ class kvzTestInstance(skvzTestInstance):
     @classmethod
     def _parseVals(cls,results,l_tot,ver):
         trgt = {}
-        res = results[cls._RES]
+        res = str(results[cls._RES])
         fs = results[cls._FS]
-        res_ex = re.search(cls._res_regex, str(res))
-        time_ex = re.search(cls._time_regex, str(res))
+        res_ex = re.search(cls._res_regex, res)
+        time_ex = re.search(cls._time_regex, res)
         lres_ex = {}
         num_layers = 1
         layers = tuple(range(num_layers))
@@ -1,23 +1,10 @@
 from .TestInstance import TestInstance
+from JobRunner import EncodeJob
 import subprocess as sp
-from multiprocessing.pool import Pool
 import itertools as it
 import re
 import cfg
 import hashlib
-import os
-
-def _worker(seq,qp,cmd,outfile,outlog):
-    with open(outlog, 'w+') as lf:
-        #p = sp.Popen(cmd,stdout=sp.PIPE,stderr=sp.PIPE)
-        p = sp.Popen(cmd, stdout=lf, stderr=sp.PIPE)
-        res = p.communicate()
-        stats = os.stat(outfile)
-        #if res[1] is not None and res[0] is None:
-        #    raise ValueError(seq,qp,res[1].decode())
-        lf.seek(0) #Need to move to start of file to read output
-        return (seq,qp,lf.read(),stats.st_size,res[1].decode() if res[1] is not None else "")
-        #return (seq,qp,res[0].decode(),stats.st_size,res[1].decode() if res[1] is not None else "")
 
 class shmTestInstance(TestInstance):
     """Test instance class for shm"""
@@ -36,8 +23,8 @@ class shmTestInstance(TestInstance):
     __tot_stat_regex = r"Bytes written to file:\s+(\d+)\s+\((\d+\.\d+)\s+kbps\)\s+Total Time:\s+(\d+.\d+)\s+sec\."
     __num_layers_regex = r"Total number of layers\s+:\s+(\d+)"
 
-    __RES = r"output"
-    __FS = r"file size"
+    __RES = TestInstance._RES
+    __FS = TestInstance._FS
     __ERR = r"errors"
     
     def __init__(self, test_name, configs, inputs = None, input_sizes = [None], input_names = [None], layer_args = (), layer_sizes = [None], input_layer_scales = (), qps = (22, 27, 32, 37), out_name = r'', bin_name = cfg.shm_bin, version=0, **misc):
@@ -50,7 +37,19 @@ class shmTestInstance(TestInstance):
         self._bin_name = bin_name
         self._version = version
 
+        self._workers = None
+        self._threads = 1 # The encoder is single threaded
+        self._time_runs = 1
+
+        if "workers" in misc:
+            self._workers = misc["workers"] # Number of encodes run in parallel by run(). None uses cfg.job_workers
+        if "threads" in misc:
+            self._threads = misc["threads"] # Override the number of threads used by one encode
+        if "time_runs" in misc:
+            self._time_runs = misc["time_runs"] # Encodes are repeated this many times for robust time statistics
+
         self._results = {}
+        self._job_statuses = {}
         self._test_name = test_name
 
         self._input_layer_scales = input_layer_scales #tuple([1 for i in range(len(configs[0])-1)])
@@ -116,14 +115,15 @@ class shmTestInstance(TestInstance):
         hasher.update(str(self._layer_args).encode())
         hasher.update(str(self._input_layer_scales).encode())
         hasher.update(str(self._input_sizes).encode())
+        if self._time_runs > 1:
+            hasher.update("time_runs={}".format(self._time_runs).encode())
         return hasher.hexdigest()
 
 
-    def _run_tests(self):
-        runs = {}
+    def _get_jobs(self):
+        jobs = []
         # Build commands
         for (name,(confs,seq,sizes)) in self._input_names.items():
-            runs[name] = {}
             for lqp in self._qps:
                 if not hasattr(lqp,"__iter__"):
                     lqp = (lqp,)
@@ -146,44 +146,14 @@ class shmTestInstance(TestInstance):
                             cmd.extend([self.__QP.format(lid=lid),str(lqp[0])])
 
                 cmd.extend(self._layer_args)
-                runs[name][str(lqp)] = (cmd, outfile, outlog)
-
-        seq_hash_tests_done = {} #Hold the number of test done for each sequence
-        print_hash_format = "\t"
-        hash_format = lambda seq: "seq{}".format(hash(seq))
-
-        #Callback function for workers
-        def cb( res ):
-            nonlocal seq_hash_tests_done, self
-            (seq,qp,val,fs,err) = res
-            # Update printout
-            seq_hash_tests_done[hash_format(seq)] += 1
-            print(print_hash_format.format(**seq_hash_tests_done),end='\r')
-            # Save reuslts
-            self._results[seq][qp] = {self.__RES: val, self.__FS: fs, self.__ERR: err}
-
-        def cb_err( *args, **kwargs ):
-            print("Error in worker: ", args, *args, **kwargs) 
-            
-        pool = Pool(processes = 8)
-        print("Start running {name} tests for sequences:".format(name=self._test_name))
-        # Add test to pool and run in parallel
-        line_sep = "\t|"
-        for (seq,qps) in runs.items():
-            seq_hash_tests_done[hash_format(seq)] = 0
-            print_hash_format += "{" + hash_format(seq) + "}" + " of {}\t".format(len(qps.keys()))
-            print(line_sep+seq)
-            line_sep += "\t|"
-            self._results[seq] = {}
-            for (qp,(cmd,outfile,outlog)) in qps.items():
-                pool.apply_async(_worker,(seq,qp,cmd,outfile,outlog),callback=cb,error_callback=cb_err)
-        print(print_hash_format.format(**seq_hash_tests_done),end='\r')
-        # Close pool and wait untill everythin is finnished
-        pool.close()
-        pool.join()
-        print()
-        print("Tests done.")
+                jobs.append(EncodeJob(self, name, str(lqp), cmd, outfile, outlog, self._threads, seq if seq is not None else (), confs))
+        return jobs
 
+    async def _run_job(self, job, engine):
+        with self._log_stream(job) as log:
+            async with self._output_sink(job) as sink:
+                (_, _, err, usage) = await engine.run(sink.command(job.cmd), stdout=log, stderr=sp.PIPE, cpus=job.cpus)
+        return self._add_sink_vals({self._METRICS: self._stream_metrics(log, sink.size), self.__FS: sink.size, self.__ERR: err.decode() if err is not None else "", self._USAGE: usage}, sink)
 
     """
     Parse kb/s from test results 
@@ -276,16 +246,16 @@ class shmTestInstance(TestInstance):
     @classmethod
     def __parseVals(cls,results,l_tot):
         trgt = {}
-        res = results[cls.__RES]
+        res = str(results[cls.__RES])
         fs = results[cls.__FS]
-        sum_ex = re.search(cls.__sum_regex, str(res))
-        i_ex = re.search(cls.__i_slice_regex, str(res))
-        tot_ex = re.search(cls.__tot_stat_regex, str(res))
+        sum_ex = re.search(cls.__sum_regex, res)
+        i_ex = re.search(cls.__i_slice_regex, res)
+        tot_ex = re.search(cls.__tot_stat_regex, res)
         lres_ex = {}
-        num_layers = int(re.search(cls.__num_layers_regex,str(res)).group(1))
+        num_layers = int(re.search(cls.__num_layers_regex,res).group(1))
         layers = tuple(range(num_layers))
         for lid in layers:
-            lres_ex[lid] = re.search(cls.__layer_regex_format.format(lid=lid), str(res))
+            lres_ex[lid] = re.search(cls.__layer_regex_format.format(lid=lid), res)
         layers = layers + (l_tot,)
         #kbs = cls.__parseKBS(tot_ex,lres_ex,num_layers,l_tot)
         #kb = cls.__parseKB(tot_ex,kbs,num_layers,l_tot)
@@ -295,6 +265,34 @@ class shmTestInstance(TestInstance):
         psnr = cls.__parsePSNR(lres_ex,num_layers,l_tot)
         return (kbs,kb,time,psnr,layers)
     
+    def _parse_result(self, result, l_tot):
+        return type(self).__parseVals(result, l_tot)
+
+    """
+    Return the metrics of a result without a test instance
+    """
+    @classmethod
+    def _result_metrics(cls, result):
+        metrics = super()._result_metrics(result)
+        if metrics is None:
+            try:
+                metrics = cls._pack_metrics(*cls.__parseVals(result, -1))
+            except (AttributeError, TypeError, ValueError, KeyError):
+                pass
+        return metrics
+
+    """
+    Return the total encoding time of a single sequence and qp result or None if it can't be parsed
+    """
+    def _get_result_time(self, result):
+        try:
+            return self._getMetrics(result, -1)[2][-1]
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    def _get_time_runs(self):
+        return self._time_runs
+
     def getInputNames(self):
         return self._input_names_order if self._input_names_order else list(self._input_names.keys())
 
@@ -302,7 +300,8 @@ class shmTestInstance(TestInstance):
         results = {}
         for (seq,qps) in self._results.items():
             for (qp,res) in qps.items():
-                (kbs,kb,time,psnr,lids) = type(self).__parseVals(res,l_tot)
+                (kbs,kb,time,psnr,lids) = self._getMetrics(res,l_tot)
+                usage = self._getUsageVals(res)
                 for lid in lids:
-                    resBuildFunc(results,seq=seq,qp=qp,lid=lid,kbs=kbs[lid],kb=kb[lid],time=time[lid],psnr=psnr[lid])
+                    resBuildFunc(results,seq=seq,qp=qp,lid=lid,kbs=kbs[lid],kb=kb[lid],psnr=psnr[lid],**self._getTimingVals(res,time[lid]),**usage)
         return results
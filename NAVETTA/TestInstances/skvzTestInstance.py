@@ -1,10 +1,10 @@
 from .TestInstance import TestInstance
+from JobRunner import EncodeJob
 import subprocess as sp
 import itertools as it
 import re
 import cfg
 import hashlib
-import os
 
 class skvzTestInstance(TestInstance):
     """Implements the scalable kvazaar test instance class"""
@@ -16,9 +16,7 @@ class skvzTestInstance(TestInstance):
     __INPUT_RES = "--input-res"
     __OUTPUT = "--output"
     __DEBUG = "--debug"
-
-    _RES = r"output"
-    _FS = r"file size"
+    __THREADS = "--threads"
 
     """
     Create a test instance object
@@ -30,6 +28,7 @@ class skvzTestInstance(TestInstance):
     @param qps: Qp values for which the test is run. Either a single value used for all layers or a seperate value for each layer
     @param test_name: A name for the test instance
     @param out_name: Name for the output files
+    @param misc: validate: decode outputs to check them, retries: times a failing encode is re-run, workers: number of parallel encodes when run() is called directly, threads: number of threads used by one encode, time_runs: number of times the encoding time is measured
     @return self object
     """
     def __init__(self, test_name, inputs, input_sizes=[None], input_names=[None], layer_args=(), layer_sizes=[None], input_layer_scales=(), qps=(22, 27, 32, 37), out_name=r"", bin_name=cfg.skvz_bin, version=0, **misc):
@@ -48,11 +47,20 @@ class skvzTestInstance(TestInstance):
 
         self._validate = True
         self._retries = 1
+        self._workers = 1
+        self._threads = None
+        self._time_runs = 1
 
         if "validate" in misc:
             self._validate = misc["validate"]
         if "retries" in misc:
             self._retries = misc["retries"]
+        if "workers" in misc:
+            self._workers = misc["workers"] # Number of encodes run in parallel by run(). None uses cfg.job_workers
+        if "threads" in misc:
+            self._threads = misc["threads"] # Override the thread count parsed from the encoder parameters
+        if "time_runs" in misc:
+            self._time_runs = misc["time_runs"] # Encodes are repeated this many times for robust time statistics
 
         # Check that qps is valid
         if len(qps) != 4:
@@ -100,6 +108,7 @@ class skvzTestInstance(TestInstance):
 
         #Will contain the execution results
         self._results = {}
+        self._job_statuses = {}
 
         # If no outname given use hash as outname so parallel workers don't use the same file
         self._out_name = out_name if out_name else r'out\\' + self._get_fname_hash()
@@ -124,14 +133,35 @@ class skvzTestInstance(TestInstance):
         hasher.update(str(self._qps).encode())
         hasher.update(str(self._layer_args).encode())
         hasher.update(str(self._input_sizes).encode())
+        if self._time_runs > 1:
+            hasher.update("time_runs={}".format(self._time_runs).encode())
         hasher.update(str(self._input_layer_scales).encode())
         
         return hasher.hexdigest()
 
-    def _run_tests(self):
-        runs = {}
+    def _get_binaries(self):
+        return [self._bin_name, cfg.decoder_bin] if self._validate else [self._bin_name]
+
+    """
+    Get the number of threads the encoder uses with the given command. Kvazaar uses all cores if --threads is not given or is auto
+    """
+    def _get_threads(self, cmd):
+        if self._threads:
+            return self._threads
+        threads = None
+        for (arg, val) in zip(cmd, cmd[1:] + [""]):
+            if arg.startswith(self.__THREADS + "="):
+                val = arg.split("=", 1)[1]
+            elif arg != self.__THREADS:
+                continue
+            if not val.isdigit():
+                return cfg.core_budget #auto
+            threads = max(threads if threads else 0, int(val))
+        return max(1, threads) if threads is not None else cfg.core_budget
+
+    def _get_jobs(self):
+        jobs = []
         for (name,(seqs,sizes)) in self._input_names.items():
-            seq_runs = {}
             for lqp in self._qps:
                 if not hasattr(lqp,"__iter__"):
                     lqp = (lqp,)
@@ -153,53 +183,29 @@ class skvzTestInstance(TestInstance):
 
                 outfile = cfg.results + self._out_name + "_{qp}_{seq}.hevc".format(qp=lqp,seq=name)
                 outlog = outfile + r".log"
-                cmd.extend([self.__OUTPUT, outfile])    
-                seq_runs[str(lqp)] = (cmd,outfile,outlog)
-            runs[name] = seq_runs
-   
-        print("Running test {}".format(self._test_name))
-        for (seq,qps) in runs.items():
-            print("  Sequence: {}".format(seq))
-            self._results[seq] = {}
-            i = 0
-            print("    {} of {} runs complete.\r".format(i,len(qps.keys())),end='')
-            for (qp,(cmd,outfile,outlog)) in qps.items():
-                with open(outlog,'w+',) as lf:
-                    #print(cmd)
-                    p = sp.Popen(cmd,stdout=sp.DEVNULL,stderr=lf)#sp.PIPE)
-                    out = p.communicate()
-
-                    #Validate output
-                    is_valid = True
-                    if self._validate:
-                        retries = self._retries
-                        while True:
-                            v = sp.Popen([cfg.decoder_bin, "-b", outfile, "-lid", "-1"], stdout=sp.DEVNULL, stderr=sp.DEVNULL) #Attempt to decode
-                            if v.wait():
-                                is_valid = False
-                                #Decoding failed try again or fail
-                                if retries <= 0:
-                                    break
-                                lf.seek(0)
-                                p = sp.Popen(cmd, stdout=sp.DEVNULL, stderr=lf)
-                                p.communicate()
-                                retries -= 1
-                            else:
-                                is_valid = True
-                                break
-
-                    if not is_valid:
-                        print("Test {} failed to decode in sequence {} with qp {}.".format(self._out_name, seq, qp))
-                        #continue
-                    #print("_________________________out_____________________")
-                    #print(out)
-                    stats = os.stat(outfile)
-                    #self._results[seq][qp] = {self.__RES: out[1].decode(), self.__FS: stats.st_size}
-                    lf.seek(0) #Need to move to start of file to read output
-                    self._results[seq][qp] = {self._RES: lf.read(), self._FS: stats.st_size}
-                    i = i + 1
-                    print("    {} of {} runs complete.\r".format(i,len(qps.keys())),end='')
-            #print("")
+                cmd.extend([self.__OUTPUT, outfile])
+                jobs.append(EncodeJob(self, name, str(lqp), cmd, outfile, outlog, self._get_threads(cmd), seqs))
+        return jobs
+
+    async def _run_job(self, job, engine):
+        with self._log_stream(job) as log:
+            async with self._output_sink(job) as sink:
+                (_, _, _, usage) = await engine.run(sink.command(job.cmd), stdout=sp.DEVNULL, stderr=log, cpus=job.cpus)
+        return self._add_sink_vals({self._METRICS: self._stream_metrics(log, sink.size), self._FS: sink.size, self._USAGE: usage}, sink)
+
+    def _validates(self):
+        return self._validate
+
+    async def _validate_job(self, job, engine, result):
+        (v_ret, _, _, usage) = await engine.run([cfg.decoder_bin, "-b", job.outfile, "-lid", "-1"], stdout=sp.DEVNULL, stderr=sp.DEVNULL) #Attempt to decode
+        result[self._DEC_USAGE] = usage
+        return v_ret == 0
+
+    def _get_retries(self):
+        return self._retries
+
+    def _get_time_runs(self):
+        return self._time_runs
 
     _res_regex = r"\sProcessed\s(\d+)\sframes\sover\s(\d+)\slayer\(s\),\s*(\d+)\sbits\sAVG\sPSNR:\s(\d+[.,]\d+)\s(\d+[.,]\d+)\s(\d+[.,]\d+)"
     _lres_regex_format = r"\s\sLayer\s{lid}:\s*(\d+)\sbits,\sAVG\sPSNR:\s(\d+[.,]\d+)\s(\d+[.,]\d+)\s(\d+[.,]\d+)"
@@ -311,21 +317,21 @@ class skvzTestInstance(TestInstance):
     @classmethod
     def _parseVals(cls,results,l_tot,ver):
         trgt = {}
-        res = results[cls._RES]
+        res = str(results[cls._RES])
         fs = results[cls._FS]
         if ver <= 4:
-            res_ex = re.search(cls._res_regex, str(res))
+            res_ex = re.search(cls._res_regex, res)
         else:
-            res_ex = re.search(cls._res_regex_v5, str(res))
-        time_ex = re.search(cls._time_regex, str(res))
+            res_ex = re.search(cls._res_regex_v5, res)
+        time_ex = re.search(cls._time_regex, res)
         lres_ex = {}
         num_layers = int(res_ex.group(2))
         layers = tuple(range(num_layers))
         for lid in layers:
             if ver <= 4:
-                lres_ex[lid] = re.search(cls._lres_regex_format.format(lid=lid), str(res))
+                lres_ex[lid] = re.search(cls._lres_regex_format.format(lid=lid), res)
             else:
-                lres_ex[lid] = re.search(cls._lres_regex_v5_format.format(lid=lid), str(res))
+                lres_ex[lid] = re.search(cls._lres_regex_v5_format.format(lid=lid), res)
         layers = layers + (l_tot,)
         #kbs = cls._parseKBS(res_ex,lres_ex,num_layers,l_tot)
         #kb = cls._parseKB(res_ex,lres_ex,num_layers,l_tot)
@@ -336,6 +342,39 @@ class skvzTestInstance(TestInstance):
         return (kbs,kb,time,psnr,layers)
 
 
+    def _parse_result(self, result, l_tot):
+        return self._parseVals(result, l_tot, self._version)
+
+    """
+    The log format depends on the encoder version
+    """
+    def _parser_stamp(self):
+        return "{}-v{}".format(super()._parser_stamp(), self._version)
+
+    """
+    Return the metrics of a result without a test instance. The encoder version of imported results is not known, so the log formats of all versions are tried
+    """
+    @classmethod
+    def _result_metrics(cls, result):
+        metrics = super()._result_metrics(result)
+        for ver in (5, 4):
+            if metrics is not None:
+                break
+            try:
+                metrics = cls._pack_metrics(*cls._parseVals(result, -1, ver))
+            except (AttributeError, TypeError, ValueError, KeyError):
+                pass
+        return metrics
+
+    """
+    Return the total encoding time of a single sequence and qp result or None if it can't be parsed
+    """
+    def _get_result_time(self, result):
+        try:
+            return self._getMetrics(result, -1)[2][-1]
+        except (AttributeError, TypeError, ValueError):
+            return None
+
     def getInputNames(self):
         return self._input_names_order if self._input_names_order else list(self._input_names.keys())
 
@@ -346,7 +385,8 @@ class skvzTestInstance(TestInstance):
         results = {}
         for (seq,qps) in self._results.items():
             for (qp,res) in qps.items():
-                (kbs,kb,time,psnr,lids) = self._parseVals(res,l_tot,self._version)
+                (kbs,kb,time,psnr,lids) = self._getMetrics(res,l_tot)
+                usage = self._getUsageVals(res)
                 for lid in lids:
-                    resBuildFunc(results,seq=seq,qp=qp,lid=lid,kbs=kbs[lid],kb=kb[lid],time=time[lid],psnr=psnr[lid])
+                    resBuildFunc(results,seq=seq,qp=qp,lid=lid,kbs=kbs[lid],kb=kb[lid],psnr=psnr[lid],**self._getTimingVals(res,time[lid]),**usage)
         return results
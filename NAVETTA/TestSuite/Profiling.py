@@ -0,0 +1,163 @@
+"""
+Time the phases of a test run and optionally capture cProfile statistics and memory allocations
+"""
+
+import contextlib
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+
+_current = None # PhaseProfiler of the running runTests call
+
+"""
+Context manager that times a phase of the current run. Does nothing outside of runTests
+@param name: Name of the phase. Phases started inside the phase are its sub-phases
+"""
+def phase(name):
+    if _current is None:
+        return contextlib.nullcontext()
+    return _current.phase(name)
+
+class PhaseProfiler:
+    """Measure wall clock and CPU time of nested phases. Phases with the same name under the same parent are added together"""
+
+    __MIN_SHARE = 0.01 # Phases taking less of the total time are left out of the report
+    __MAX_CHILDREN = 10 # Number of sub-phases shown for each phase
+    __TOP_STATS = 20 # Number of functions and allocation sites shown for cProfile and tracemalloc
+
+    """
+    @param profile_path: Write cProfile statistics of the run to this file. None to disable
+    @param trace_memory: Trace memory allocations with tracemalloc. Allocations and peak memory are reported for each phase
+    """
+    def __init__(self, profile_path = None, trace_memory = False):
+        self._profile_path = profile_path
+        self._trace_memory = trace_memory
+        self._profiler = None
+        self._started_tracing = False
+        self._snapshot = None
+        self._root = _Phase("total")
+        self._stack = [self._root]
+
+    """
+    Start profiling and make this the profiler used by phase()
+    @return self
+    """
+    def start(self):
+        global _current
+        _current = self
+        if self._trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if self._profile_path:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._root.begin(self._trace_memory)
+        return self
+
+    """
+    Stop profiling
+    """
+    def stop(self):
+        global _current
+        self._root.end(self._trace_memory)
+        if self._trace_memory:
+            self._snapshot = tracemalloc.take_snapshot()
+            if self._started_tracing:
+                tracemalloc.stop()
+        if self._profiler:
+            self._profiler.disable()
+            self._profiler.dump_stats(self._profile_path)
+        if _current is self:
+            _current = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        parent = self._stack[-1]
+        node = parent.children.get(name)
+        if node is None:
+            node = parent.children[name] = _Phase(name)
+        if self._trace_memory:
+            self._fold_peak() #The peak is reset for the new phase
+        self._stack.append(node)
+        node.begin(self._trace_memory)
+        try:
+            yield node
+        finally:
+            node.end(self._trace_memory)
+            self._stack.pop()
+            if self._trace_memory:
+                # Peaks of the parents include the peaks of their sub-phases
+                for outer in self._stack:
+                    outer.peak = max(outer.peak, node.peak)
+
+    """
+    Add the traced memory peak since the last reset to the running phases
+    """
+    def _fold_peak(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        for node in self._stack:
+            node.peak = max(node.peak, peak)
+
+    """
+    Return the report as text
+    """
+    def report(self):
+        lines = ["Time spent in each phase (wall s, CPU s, share of total{}):".format(", allocated MB, peak MB" if self._trace_memory else "")]
+        self._report_phase(self._root, 0, lines)
+        if self._profiler:
+            out = io.StringIO()
+            pstats.Stats(self._profile_path, stream = out).sort_stats("cumulative").print_stats(self.__TOP_STATS)
+            lines.append("cProfile statistics written to {}. Most time consuming functions:".format(self._profile_path))
+            lines.extend(line for line in out.getvalue().splitlines() if line.strip())
+        if self._trace_memory:
+            lines.append("Largest allocations still held at the end of the run:")
+            for stat in self._snapshot.statistics("lineno")[:self.__TOP_STATS]:
+                lines.append("    {}".format(stat))
+        return "\n".join(lines)
+
+    def _report_phase(self, node, depth, lines):
+        total = self._root.wall
+        line = "{}{:<{}} {:>9.3f} {:>9.3f} {:>6.1%}".format("  " * (depth + 1), node.label(), 48 - 2 * depth, node.wall, node.cpu, node.wall / total if total else 1.0)
+        if self._trace_memory:
+            line += " {:>9.1f} {:>9.1f}".format(node.allocated / 2**20, node.peak / 2**20)
+        lines.append(line)
+        children = sorted(node.children.values(), key = lambda child: -child.wall)
+        shown = [child for child in children[:self.__MAX_CHILDREN] if not total or child.wall / total >= self.__MIN_SHARE]
+        for child in shown:
+            self._report_phase(child, depth + 1, lines)
+        hidden = children[len(shown):]
+        if hidden:
+            lines.append("{}{} other phases {:.3f} s".format("  " * (depth + 2), len(hidden), sum(child.wall for child in hidden)))
+
+class _Phase:
+    """Accumulated measurements of a phase"""
+
+    def __init__(self, name):
+        self.name = name
+        self.children = {}
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.allocated = 0 # Bytes still allocated at the end of the phase that were not at the start
+        self.peak = 0 # Peak traced memory during the phase in bytes
+        self._start = None
+
+    def label(self):
+        return self.name if self.calls <= 1 else "{} ({} times)".format(self.name, self.calls)
+
+    def begin(self, trace_memory):
+        if trace_memory:
+            self._mem = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self._start = (time.perf_counter(), time.process_time())
+
+    def end(self, trace_memory):
+        self.calls += 1
+        self.wall += time.perf_counter() - self._start[0]
+        self.cpu += time.process_time() - self._start[1]
+        if trace_memory:
+            (current, peak) = tracemalloc.get_traced_memory()
+            self.allocated += current - self._mem
+            self.peak = max(self.peak, peak)
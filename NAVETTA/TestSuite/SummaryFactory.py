@@ -9,6 +9,7 @@ from openpyxl.worksheet.worksheet import Worksheet
 from openpyxl.chart import ScatterChart, Reference, Series
 from enum import Enum, auto
 from typing import Dict, Tuple, Union, List, Callable, Iterable
+from .Profiling import phase
 
 #Define summary types used as keys in definitions
 class SummaryType(Enum):
@@ -50,18 +51,20 @@ __WRITE_BITS = "write_bits"
 __WRITE_BDBR = "write_bdbr"
 __WRITE_PSNR = "write_psnr"
 __WRITE_TIME = "write_time"
-dt_BDBRM = {__LAYERS:{}, __WRITE_BDBR: True, __WRITE_BITS: True, __WRITE_PSNR: True, __WRITE_TIME: True}
+__WRITE_TIME_CI = "write_time_ci"
+dt_BDBRM = {__LAYERS:{}, __WRITE_BDBR: True, __WRITE_BITS: True, __WRITE_PSNR: True, __WRITE_TIME: True, __WRITE_TIME_CI: False}
 
 """
-for creating the BDBRMatrix definition
+for creating the BDBRMatrix definition. write_time_ci adds a matrix with the confidence interval of the time comparisons
 """
-def create_BDBRMatrix_definition(layers: Dict[str, Tuple[int]], write_bdbr: bool, write_bits: bool, write_psnr: bool, write_time: bool, name: str = "") -> dict:
+def create_BDBRMatrix_definition(layers: Dict[str, Tuple[int]], write_bdbr: bool, write_bits: bool, write_psnr: bool, write_time: bool, name: str = "", write_time_ci: bool = False) -> dict:
     definition = dt_BDBRM.copy()
     definition[__LAYERS] = layers
     definition[__WRITE_BDBR] = write_bdbr
     definition[__WRITE_BITS] = write_bits
     definition[__WRITE_PSNR] = write_psnr
     definition[__WRITE_TIME] = write_time
+    definition[__WRITE_TIME_CI] = write_time_ci
     return create_summary_definition(SummaryType.BDBRM, definition, name)
 
 """
@@ -71,7 +74,11 @@ __BDBR = "bdbr"
 __BITS = "bits"
 __PSNR = "psnr"
 __TIME = "time"
-dt_ANCHOR = {__BDBR:{}, __BITS:{}, __PSNR:{}, __TIME:{}}
+__WALL = "wall"
+__CPU = "cpu"
+__RSS = "rss"
+__TIME_CI = "time_ci"
+dt_ANCHOR = {__BDBR:{}, __BITS:{}, __PSNR:{}, __TIME:{}, __WALL:None, __CPU:None, __RSS:None, __TIME_CI:None}
 """
 dt_ANCHOR_SUB = {<test_name>:(<anchor_test_name>|None,...)}
 """
@@ -79,14 +86,20 @@ dt_ANCHOR_SUB = {<test_name>:(<anchor_test_name>|None,...)}
 AnchorSubType = Dict[str, Tuple[Union[str,None],...]]
 
 """
-Create anchor list definition. Pass in sub definitions for each data type that should be included
+Create anchor list definition. Pass in sub definitions for each data type that should be included.
+wall_def, cpu_def and rss_def compare the measured wall clock time, CPU time (user + sys) and peak memory of the encoder processes.
+time_ci_def shows the confidence interval of the time comparisons
 """
-def create_AnchorList_definition(bdbr_def: AnchorSubType, bits_def: AnchorSubType, psnr_def: AnchorSubType, time_def: AnchorSubType, name: str = "") -> dict:
+def create_AnchorList_definition(bdbr_def: AnchorSubType, bits_def: AnchorSubType, psnr_def: AnchorSubType, time_def: AnchorSubType, name: str = "", wall_def: AnchorSubType = None, cpu_def: AnchorSubType = None, rss_def: AnchorSubType = None, time_ci_def: AnchorSubType = None) -> dict:
     definition = dt_ANCHOR.copy()
     definition[__BDBR] = create_AnchorSub_definition(bdbr_def)
     definition[__BITS] = create_AnchorSub_definition(bits_def)
     definition[__PSNR] = create_AnchorSub_definition(psnr_def)
     definition[__TIME] = create_AnchorSub_definition(time_def)
+    definition[__WALL] = create_AnchorSub_definition(wall_def)
+    definition[__CPU] = create_AnchorSub_definition(cpu_def)
+    definition[__RSS] = create_AnchorSub_definition(rss_def)
+    definition[__TIME_CI] = create_AnchorSub_definition(time_ci_def)
     return create_summary_definition(SummaryType.ANCHOR, definition, name)
 
 """
@@ -154,14 +167,15 @@ Function for creating summary sheets to the given workbook for the given data
 """
 def makeSummaries(wb: xl.Workbook, data_refs: DataRefType, *definitions: List[dict], order: List[str] = None) -> None:
     for definition in definitions:
-        if SummaryType.BDBRM == definition[__TYPE]:
-            makeBDBRMatrix(wb, data_refs, order, definition)
-        elif SummaryType.ANCHOR == definition[__TYPE]:
-            makeAnchorList(wb, data_refs, order, definition)
-        elif SummaryType.CURVE == definition[__TYPE]:
-            makeCurveChart(wb, data_refs, order, definition)
-        else:
-            print("Not a valid summary type.")
+        with phase("{} {}".format(__TYPE_NAMES.get(definition[__TYPE], "summary"), definition.get(__NAME, ""))):
+            if SummaryType.BDBRM == definition[__TYPE]:
+                makeBDBRMatrix(wb, data_refs, order, definition)
+            elif SummaryType.ANCHOR == definition[__TYPE]:
+                makeAnchorList(wb, data_refs, order, definition)
+            elif SummaryType.CURVE == definition[__TYPE]:
+                makeCurveChart(wb, data_refs, order, definition)
+            else:
+                print("Not a valid summary type.")
 
 
 """
@@ -252,6 +266,14 @@ __S_BIT_ABS_FORMAT = "=AVERAGE({},{},{},{})"
 __S_TIME_ABS_FORMAT = "=AVERAGE({},{},{},{})"
 __S_PSNR_ABS_FORMAT = "=AVERAGE({},{},{},{})"
 
+__S_USAGE_FORMAT = "=(1/AVERAGE({},{},{},{}))*AVERAGE({},{},{},{})"
+__S_USAGE_ABS_FORMAT = "=AVERAGE({},{},{},{})"
+__S_CPU_FORMAT = "=(1/AVERAGE({}+{},{}+{},{}+{},{}+{}))*AVERAGE({}+{},{}+{},{}+{},{}+{})"
+__S_CPU_ABS_FORMAT = "=AVERAGE({}+{},{}+{},{}+{},{}+{})"
+# Interval of the time ratio from the interval bounds (lo1..lo4, hi1..hi4) of the anchor and the test
+__S_TIME_CI_FORMAT = '=TEXT(AVERAGE({8},{9},{10},{11})/AVERAGE({4},{5},{6},{7}),"0.000")&" - "&TEXT(AVERAGE({12},{13},{14},{15})/AVERAGE({0},{1},{2},{3}),"0.000")'
+__S_TIME_CI_ABS_FORMAT = '=TEXT(AVERAGE({0},{1},{2},{3}),"0.000")&" - "&TEXT(AVERAGE({4},{5},{6},{7}),"0.000")'
+
 #######################################
 # AnchorList summary type definitions #
 #######################################
@@ -261,6 +283,10 @@ __AL_BD_HEADER = r"BDBR results"
 __AL_B_HEADER = r"Bit results"
 __AL_PSNR_HEADER = r"PSNR results"
 __AL_TIME_HEADER = r"Time results"
+__AL_WALL_HEADER = r"Wall time results"
+__AL_CPU_HEADER = r"CPU time results"
+__AL_RSS_HEADER = r"Peak memory results"
+__AL_TIME_CI_HEADER = r"Time interval results"
 __AL_TEST = r"Test:"
 __AL_ANCHOR = r"Sequences \ Anchor:"
 #__AL_SEQ = r"Sequences"
@@ -269,11 +295,19 @@ __AL_ANCHOR = r"Sequences \ Anchor:"
 Handle writing the anchor list structure
 """
 
-def __writeAnchorList(sheet: Worksheet, data_refs: SummaryRefType, order: List[str] = None, *, bdbr: AnchorSubType, bits: AnchorSubType, psnr: AnchorSubType, time: AnchorSubType, **other: dict) -> None:
-    from .TestSuite import _PSNR, _KBS, _KB, _TIME
+def __writeAnchorList(sheet: Worksheet, data_refs: SummaryRefType, order: List[str] = None, *, bdbr: AnchorSubType, bits: AnchorSubType, psnr: AnchorSubType, time: AnchorSubType, wall: AnchorSubType = None, cpu: AnchorSubType = None, rss: AnchorSubType = None, time_ci: AnchorSubType = None, **other: dict) -> None:
+    from .TestSuite import _PSNR, _KBS, _KB, _TIME, _TIME_LO, _TIME_HI, _WALL, _UTIME, _STIME, _RSS
     seq_ref = __flip_dict(data_refs) # transform data_refs to seq_ref[<seq>][<test_name>] order
     order = order if order else list(seq_ref.keys())
 
+    # Time interval and resource usage categories as (sub definition, header, data_func, data_format, abs_format)
+    usage_defs = [(time_ci, __AL_TIME_CI_HEADER, lambda data, test: data[test][_TIME_LO] + data[test][_TIME_HI], __S_TIME_CI_FORMAT, __S_TIME_CI_ABS_FORMAT),
+                  (wall, __AL_WALL_HEADER, lambda data, test: data[test][_WALL], __S_USAGE_FORMAT, __S_USAGE_ABS_FORMAT),
+                  (cpu, __AL_CPU_HEADER, lambda data, test: [cl for cls in zip(data[test][_UTIME], data[test][_STIME]) for cl in cls], __S_CPU_FORMAT, __S_CPU_ABS_FORMAT),
+                  (rss, __AL_RSS_HEADER, lambda data, test: data[test][_RSS], __S_USAGE_FORMAT, __S_USAGE_ABS_FORMAT)]
+    usage_defs = [item for item in usage_defs if item[0]]
+    ucols = {} # Start and end column for each category in usage_defs
+
     # Each sequence is one line so generate one columns for each test in each gategory based on the given definitions
     sheet.cell(row = 1, column = 1).value = __AL_HEADER 
     static_row = 1
@@ -361,6 +395,24 @@ def __writeAnchorList(sheet: Worksheet, data_refs: SummaryRefType, order: List[s
             # Write sequence
             sheet.cell(row = row + header_offset, column = tcol - 1).value = __AL_SEQ_FORMAT.format(seq)
 
+        # write time interval and resource usage matrices
+        for (sub_def, header, data_func, data_format, abs_format) in usage_defs:
+            if header not in ucols:
+                ucol = sheet.max_column + 3
+                sheet.cell(row = static_row, column = ucol - 1).value = header
+                sheet.cell(row = static_row + 1, column = ucol - 1).value = __AL_TEST
+                sheet.cell(row = static_row + 2, column = ucol - 1).value = __AL_ANCHOR
+                ucols[header] = (ucol, __writeAnchorListHeader(sheet, sub_def, static_row + 1, ucol))
+                header_offset = static_row + 1
+
+            __writeAnchorListData(sheet, seq_ref[seq], sub_def, row + header_offset, ucols[header][0],
+                                     data_func = data_func,
+                                     data_format = data_format,
+                                     abs_format = abs_format)
+
+            # Write sequence
+            sheet.cell(row = row + header_offset, column = ucols[header][0] - 1).value = __AL_SEQ_FORMAT.format(seq)
+
 
     # Make columns wider
     for column in range(sheet.max_column):
@@ -391,6 +443,12 @@ def __writeAnchorList(sheet: Worksheet, data_refs: SummaryRefType, order: List[s
                                           mid_type='num', mid_value=1, mid_color='FFFFFF',
                                           start_type='percentile', end_value=80, end_color='00BBEF'))
 
+    for (ucol, ucol_end) in ucols.values():
+        form_ranges.append("{}:{}".format(get_column_letter(ucol)+str(first_row),get_column_letter(ucol_end)+str(row)))
+        color_rules.append(ColorScaleRule(end_type='min', start_color='9BDE55',
+                                          mid_type='num', mid_value=1, mid_color='FFFFFF',
+                                          start_type='percentile', end_value=80, end_color='00BBEF'))
+
     for (f_range, c_rule) in zip(form_ranges, color_rules):
         sheet.conditional_formatting.add(f_range, c_rule)
 
@@ -447,14 +505,15 @@ __S_SEQ_HEADER = "Sequence {} results"
 __S_BIT_HEADER = r"Bit comparisons"
 __S_PSNR_HEADER = r"PSNR comparisons (dB)"
 __S_TIME_HEADER = r"Encoding time comparisons"
+__S_TIME_CI_HEADER = r"Encoding time comparison intervals"
 __S_HEADER = "Result summary matrix (bdrate, bit, PSNR, Time comparisons)"
 
 
 """
 Handle writing the BDBRMatrix summary sheet
 """
-def __writeBDBRMatrix(sheet: Worksheet, data_refs: SummaryRefType, order: List[str] = None, *, write_bdbr: bool, write_bits:bool, write_psnr: bool, write_time: bool, **other: dict):
-    from .TestSuite import _PSNR, _KBS, _KB, _TIME
+def __writeBDBRMatrix(sheet: Worksheet, data_refs: SummaryRefType, order: List[str] = None, *, write_bdbr: bool, write_bits:bool, write_psnr: bool, write_time: bool, write_time_ci: bool = False, **other: dict):
+    from .TestSuite import _PSNR, _KBS, _KB, _TIME, _TIME_LO, _TIME_HI
     
     seq_ref = __flip_dict(data_refs) # transform data_refs to seq_ref[<seq>][<test_name>] order
     order = order if order else list(seq_ref.keys())
@@ -471,6 +530,7 @@ def __writeBDBRMatrix(sheet: Worksheet, data_refs: SummaryRefType, order: List[s
         brow = row
         prow = row
         trow = row
+        cirow = row
         col = 1 #sheet.max_column + 1
 
         sheet.cell(row = row, column = col).value = __S_SEQ_HEADER.format(seq) #Write sequence header
@@ -496,7 +556,7 @@ def __writeBDBRMatrix(sheet: Worksheet, data_refs: SummaryRefType, order: List[s
             sheet.cell(row = brow, column = bcol).value = __S_BIT_HEADER
             sheet.merge_cells(start_column=bcol,start_row=brow,end_column=bcol+len(tests),end_row=brow)
             (brow, col) = __writeSummaryMatrixHeader(sheet, tests, brow+1, bcol)
-            __writeSummaryDataMatrix(sheet, ref, brow, colb,
+            __writeSummaryDataMatrix(sheet, ref, brow, col,
                                      data_func = lambda data, test: data[test][_KB],
                                      data_format = __S_BIT_FORMAT,
                                      color_scale_rule = ColorScaleRule(start_type='min', start_color='4F81BD',
@@ -510,7 +570,7 @@ def __writeBDBRMatrix(sheet: Worksheet, data_refs: SummaryRefType, order: List[s
             sheet.cell(row = prow, column = pcol).value = __S_PSNR_HEADER
             sheet.merge_cells(start_column=pcol,start_row=prow,end_column=pcol+len(tests),end_row=prow)
             (prow, col) = __writeSummaryMatrixHeader(sheet, tests, prow+1, pcol)
-            __writeSummaryDataMatrix(sheet, ref, prow, colb,
+            __writeSummaryDataMatrix(sheet, ref, prow, col,
                                      data_func = lambda data, test: data[test][_PSNR],
                                      data_format = __S_PSNR_FORMAT,
                                      number_style = 'Comma',
@@ -533,6 +593,21 @@ def __writeBDBRMatrix(sheet: Worksheet, data_refs: SummaryRefType, order: List[s
                                                                        mid_type='num', mid_value=1, mid_color='FFFFFF',
                                                                        end_type='percentile', end_value=80, end_color='00BBEF'))
 
+        # write time interval matrix
+        if write_time_ci:
+            if 'cicol' not in locals():
+                cicol = sheet.max_column + 2
+            sheet.cell(row = cirow, column = cicol).value = __S_TIME_CI_HEADER
+            sheet.merge_cells(start_column=cicol,start_row=cirow,end_column=cicol+len(tests),end_row=cirow)
+            (cirow, col) = __writeSummaryMatrixHeader(sheet, tests, cirow+1, cicol)
+            __writeSummaryDataMatrix(sheet, ref, cirow, col,
+                                     data_func = lambda data, test: data[test][_TIME_LO] + data[test][_TIME_HI],
+                                     data_format = __S_TIME_CI_FORMAT,
+                                     number_style = 'Normal',
+                                     color_scale_rule = ColorScaleRule(start_type='min', start_color='9BDE55',
+                                                                       mid_type='num', mid_value=1, mid_color='FFFFFF',
+                                                                       end_type='percentile', end_value=80, end_color='00BBEF'))
+
     # Make columns wider
     for col in range(sheet.max_column):
         sheet.column_dimensions[get_column_letter(col+1)].width = getMaxLength(list(data_refs.keys()))
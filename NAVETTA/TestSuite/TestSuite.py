@@ -7,13 +7,24 @@ from openpyxl.utils import get_column_letter
 import ast
 
 import cfg
+import os
+from JobRunner import JobScheduler, parse_shard, shard_key, shard_jobs, plan_tests
 from .SummaryFactory import makeSummaries
+from .Profiling import PhaseProfiler, phase
 
 __FILE_END = r".xlsm"
 _KBS = r"kbs"
 _KB = r"kb"
 _TIME = r"time"
 _PSNR = r"psnr"
+_WALL = r"wall"
+_UTIME = r"utime"
+_STIME = r"stime"
+_RSS = r"rss"
+_TIME_LO = r"time_lo"
+_TIME_HI = r"time_hi"
+_USAGE_KEYS = (_WALL, _UTIME, _STIME, _RSS)
+_EXTRA_KEYS = (_TIME_LO, _TIME_HI) + _USAGE_KEYS #Values written after the time column
 _SCALE = r"scale"
 _RES = r"results"
 _QPS = r"qps"
@@ -21,7 +32,7 @@ _INAMES = r"inames"
 
 __R_HEADER = ["Sequence","Layer"]
 __R_HEADER_QP = "QP {}"
-__R_KBS = ["Kb","Kb/s","Time (s)"]
+__R_KBS = ["Kb","Kb/s","Time (s)","Time CI low (s)","Time CI high (s)","Wall (s)","User CPU (s)","Sys CPU (s)","Max RSS (MB)"]
 __R_PSNR = "PSNR"
 __R_PSNR_SUB = ["Y","U","V","AVG"]
 
@@ -29,6 +40,7 @@ __SEQ_FORMAT = "{} @ scale {}"
 __PSNR_AVG = "=(6*{y}+{u}+{v})/8"
 
 __C_AVG = r"=AVERAGE({})"
+__C_AVG_OPT = r'=IFERROR(AVERAGE({}),"")' #Average of values that may be missing
 __SEQ_AVERAGE = r"Average"
 
 _LID_TOT = -1
@@ -65,9 +77,9 @@ def makeLayerCombiName(combi):
 
 
 """
-Build test result dict
+Build test result dict. time_ci is the (low, high) confidence interval of the time. Resource usage values are None if the test was run without resource accounting
 """
-def __resBuildFunc(results,seq,qp,lid,kbs,kb,time,psnr):
+def __resBuildFunc(results,seq,qp,lid,kbs,kb,time,psnr,time_ci=None,wall=None,utime=None,stime=None,rss=None):
     
     if not seq in results:
         results[seq] = {}
@@ -80,6 +92,20 @@ def __resBuildFunc(results,seq,qp,lid,kbs,kb,time,psnr):
     results[seq][qp][lid][_KB] = kb
     results[seq][qp][lid][_TIME] = time
     results[seq][qp][lid][_PSNR] = psnr
+    (results[seq][qp][lid][_TIME_LO], results[seq][qp][lid][_TIME_HI]) = time_ci if time_ci else (time, time)
+    results[seq][qp][lid][_WALL] = wall
+    results[seq][qp][lid][_UTIME] = utime
+    results[seq][qp][lid][_STIME] = stime
+    results[seq][qp][lid][_RSS] = rss
+
+"""
+Combine values of tests that may be missing. Times are added and the peak memory is the largest of the values
+@return None if either value is missing
+"""
+def __combiOptional(key,val1,val2):
+    if val1 is None or val2 is None:
+        return None
+    return max(val1,val2) if key == _RSS else val1 + val2
 
 """
 Sort results qps and put them to ascending order by replacing them with order numbers
@@ -101,13 +127,14 @@ def __sortQps(res):
 
 """
 Parse test results
-@return a dict with parsed results in the form of result[<test_name>] = {__RES: {<seq>: {<qp>: <lid>:{__KBS,__KB,__TIME,__PSNR}}}, __SCALE, __QPS, __INAMES }
+@return a dict with parsed results in the form of result[<test_name>] = {__RES: {<seq>: {<qp>: <lid>:{__KBS,__KB,__TIME,__PSNR,__TIME_LO,__TIME_HI,__WALL,__UTIME,__STIME,__RSS}}}, __SCALE, __QPS, __INAMES }
 """
 def __parseTestResults(tests):
     results = {}
     for test in tests:
-        main_res = test.getResults(__resBuildFunc,l_tot=_LID_TOT)
-        (main_res,qp_names) = __sortQps(main_res)
+        with phase("test " + test._test_name):
+            main_res = test.getResults(__resBuildFunc,l_tot=_LID_TOT)
+            (main_res,qp_names) = __sortQps(main_res)
         results[test._test_name] = {_RES: main_res, _SCALE: str(test._input_layer_scales), _QPS: qp_names, _INAMES: [__SEQ_AVERAGE,] + test.getInputNames()}
     return results
 
@@ -130,6 +157,8 @@ def __combiValues(vals):
                 res[_RES][seq][qp][lid][_KB] = 0
                 res[_RES][seq][qp][lid][_TIME] = 0
                 res[_RES][seq][qp][lid][_PSNR] = (0,0,0)
+                for key in _EXTRA_KEYS:
+                    res[_RES][seq][qp][lid][key] = 0
 
     numv = len(vals)
 
@@ -143,6 +172,8 @@ def __combiValues(vals):
                     res[_RES][seq][qp][lid][_KB] += val[_KB]
                     res[_RES][seq][qp][lid][_TIME] += val[_TIME]
                     res[_RES][seq][qp][lid][_PSNR] = tuple(map(lambda x,y: float(y) + float(x)/float(numv), val[_PSNR], res[_RES][seq][qp][lid][_PSNR]))
+                    for key in _EXTRA_KEYS:
+                        res[_RES][seq][qp][lid][key] = __combiOptional(key, res[_RES][seq][qp][lid][key], val.get(key))
                 res[_QPS][seq][qp] = makeCombiName([res[_QPS][seq][qp],item[_QPS][seq][qp]]) if len(res[_QPS][seq][qp]) > 0 else item[_QPS][seq][qp]
     res[_SCALE] = makeCombiName(scales)
         
@@ -167,11 +198,15 @@ def __layerCombiValues(vals):
                 res[_RES][seq][qp][lid][_KB] = 0
                 res[_RES][seq][qp][lid][_TIME] = 0
                 res[_RES][seq][qp][lid][_PSNR] = (0,0,0)
+                for key in _EXTRA_KEYS:
+                    res[_RES][seq][qp][lid][key] = 0
             res[_RES][seq][qp][_LID_TOT] = {}
             res[_RES][seq][qp][_LID_TOT][_KBS] = 0
             res[_RES][seq][qp][_LID_TOT][_KB] = 0
             res[_RES][seq][qp][_LID_TOT][_TIME] = 0
             res[_RES][seq][qp][_LID_TOT][_PSNR] = (0,0,0)
+            for key in _EXTRA_KEYS:
+                res[_RES][seq][qp][_LID_TOT][key] = 0
 
     numv = len(vals)
 
@@ -190,6 +225,9 @@ def __layerCombiValues(vals):
                 lids[_LID_TOT][_KB] += val[_RES][seq][qp][_LID_TOT][_KB]
                 lids[_LID_TOT][_TIME] += val[_RES][seq][qp][_LID_TOT][_TIME]
                 lids[_LID_TOT][_PSNR] = tuple(map(lambda x,y: float(y) + float(x)/float(numv), val[_RES][seq][qp][_LID_TOT][_PSNR], lids[_LID_TOT][_PSNR]))
+                for key in _EXTRA_KEYS:
+                    lids[lid][key] = val[_RES][seq][qp][_LID_TOT].get(key)
+                    lids[_LID_TOT][key] = __combiOptional(key, lids[_LID_TOT][key], lids[lid][key])
 
                 res[_QPS][seq][qp] = str( ast.literal_eval(res[_QPS][seq][qp]) + ast.literal_eval(val[_QPS][seq][qp]) )
 
@@ -210,21 +248,23 @@ def __combiTestResults(results, combi, layer_combi):
         for item in set:
             vals.append(results[item])
         cname = makeCombiName(set)
-        res[cname] = __combiValues(vals)
+        with phase("combi " + cname):
+            res[cname] = __combiValues(vals)
 
     for set in layer_combi:
         vals = []
         for item in set:
             vals.append(results[item])
         cname = makeLayerCombiName(set)
-        res[cname] = __layerCombiValues(vals)
+        with phase("layer combi " + cname):
+            res[cname] = __layerCombiValues(vals)
 
     return res
     
 
 """
 Write results for a single test/sheet
-@return positions of relevant cells as res_ref[<seq>][<lid>] = {__KB, __KBS,__PSNR, __TIME}
+@return positions of relevant cells as res_ref[<seq>][<lid>] = {__KB, __KBS,__PSNR, __TIME, __TIME_LO, __TIME_HI, __WALL, __UTIME, __STIME, __RSS}
 """
 def __writeSheet(sheet,data,scale,qp_names,order=None):
     # Write header
@@ -270,10 +310,10 @@ def __writeSheet(sheet,data,scale,qp_names,order=None):
             
         #Set Layers
         sheet.cell(row=seq_rows[seq],column=2).value = _LID_TOT
-        res_ref[seq][_LID_TOT] = {_KB:[], _KBS:[],_PSNR:[],_TIME:[]}
+        res_ref[seq][_LID_TOT] = {_KB:[], _KBS:[],_PSNR:[],_TIME:[],**{key:[] for key in _EXTRA_KEYS}}
         for lid in layer_r:
             sheet.cell(row=seq_rows[seq]+lid+1,column=2).value = lid
-            res_ref[seq][lid] = {_KB:[], _KBS:[],_PSNR:[],_TIME:[]}
+            res_ref[seq][lid] = {_KB:[], _KBS:[],_PSNR:[],_TIME:[],**{key:[] for key in _EXTRA_KEYS}}
     
     # Set actual data
     #for (seq,qps) in data.items():
@@ -288,11 +328,14 @@ def __writeSheet(sheet,data,scale,qp_names,order=None):
                     c_kb = qp_cols[qp]
                     c_kbs = c_kb + 1
                     c_time = c_kbs + 1
-                    c_psnr = c_time + len(__R_PSNR_SUB)
+                    c_psnr = c_time + len(_EXTRA_KEYS) + len(__R_PSNR_SUB)
 
                     sheet.cell(row=r,column=c_kb).value = val[_KB]
                     sheet.cell(row=r,column=c_kbs).value = val[_KBS]
                     sheet.cell(row=r,column=c_time).value = val[_TIME]
+                    for (i,key) in enumerate(_EXTRA_KEYS):
+                        sheet.cell(row=r,column=c_time+i+1).value = val.get(key)
+                        res_ref[seq][lid][key].append(get_column_letter(c_time+i+1) + str(r))
 
                     for i in range(len(__R_PSNR_SUB)-1):
                         sheet.cell(row=r,column=c_psnr-i-1).value = float(val[_PSNR][-i-1])
@@ -313,7 +356,7 @@ def __writeSheet(sheet,data,scale,qp_names,order=None):
                         r = seq_rows[__SEQ_AVERAGE]
                     c_kbs = c_kb + 1
                     c_time = c_kbs + 1
-                    c_psnr = c_time + len(__R_PSNR_SUB)
+                    c_psnr = c_time + len(_EXTRA_KEYS) + len(__R_PSNR_SUB)
 
                     kb_rows = []
                     kbs_rows = []
@@ -327,6 +370,10 @@ def __writeSheet(sheet,data,scale,qp_names,order=None):
                     sheet.cell(row=r,column=c_kb).value = __C_AVG.format(','.join(kb_rows))
                     sheet.cell(row=r,column=c_kbs).value = __C_AVG.format(','.join(kbs_rows))
                     sheet.cell(row=r,column=c_time).value = __C_AVG.format(','.join(time_rows))
+                    for (i,key) in enumerate(_EXTRA_KEYS):
+                        usage_rows = [get_column_letter(c_time+i+1)+str(row+lid+1) for (seq,row) in seq_rows.items() if seq != __SEQ_AVERAGE]
+                        sheet.cell(row=r,column=c_time+i+1).value = __C_AVG_OPT.format(','.join(usage_rows))
+                        res_ref[__SEQ_AVERAGE][lid][key].append(get_column_letter(c_time+i+1) + str(r))
 
                     for i in range(len(__R_PSNR_SUB)-1):
                         psnr_rows = []
@@ -358,13 +405,75 @@ def __writeResults(wb,results,summary_defs):
     res_pos = {}
     
     # Write test results
-    for (test,res) in sorted(results.items()):
-        n_sheet = wb.create_sheet(title=test,index=0)
-        res_pos[test] = __writeSheet(n_sheet,res[_RES],res[_SCALE],res[_QPS],res[_INAMES])
+    with phase("result sheets"):
+        for (test,res) in sorted(results.items()):
+            with phase("sheet " + test):
+                n_sheet = wb.create_sheet(title=test,index=0)
+                res_pos[test] = __writeSheet(n_sheet,res[_RES],res[_SCALE],res[_QPS],res[_INAMES])
 
     #write summary sheets
-    makeSummaries(wb, res_pos, *summary_defs,
-                  order = res[_INAMES])
+    with phase("summaries"):
+        makeSummaries(wb, res_pos, *summary_defs,
+                      order = res[_INAMES])
+
+"""
+Combine job results of shard runs into the result files of the tests
+@param res_paths: Results folders of the shard runs
+"""
+def mergeShards( tests, res_paths ):
+    res_paths = [os.path.join(res_path, "") for res_path in res_paths]
+    print("Merging results from {} shards...".format(len(res_paths)))
+    for test in tests:
+        if test._results_exist():
+            continue
+        job_results = {}
+        for res_path in res_paths:
+            job_results.update(test._load_shard_results(res_path))
+        jobs = test._get_jobs()
+        missing = [job for job in jobs if (job.seq, job.qp) not in job_results]
+        if missing:
+            raise RuntimeError("Shard results of test {} are missing jobs: {}".format(test._test_name, ", ".join("{} qp {}".format(job.seq, job.qp) for job in missing)))
+        test._set_job_results([(job, job_results[(job.seq, job.qp)]) for job in jobs])
+        test._save_results()
+    print("Shards merged.")
+
+"""
+Run the jobs of the given tests that belong to the shard. Results are left in the checkpoint files of the tests to be combined with mergeShards
+"""
+def __runShard( tests, shard ):
+    (index, count) = parse_shard(shard)
+    selected = shard_jobs(tests, (index, count))
+    print("Running shard {}/{}...".format(index, count))
+    scheduler = JobScheduler()
+    for test in tests:
+        if not test._results_exist():
+            scheduler.add_test(test, lambda job: shard_key(job) in selected)
+    print("Running {} jobs...".format(scheduler.num_jobs()))
+    failed = scheduler.run()
+    if failed:
+        raise RuntimeError("Jobs failed for tests: {}".format(", ".join(test._test_name for test in failed)))
+    print("Shard {}/{} complete. Results are in {}".format(index, count, cfg.results))
+
+"""
+Print the jobs of the given tests with their state and the estimated run time and disk usage without running anything
+@param shard: Only plan jobs of shard "i/N" or None for all jobs
+@return the plan returned by JobRunner.plan_tests
+"""
+def planTests( tests, shard = None ):
+    selected = shard_jobs(tests, shard) if shard else None
+    plan = plan_tests(tests, (lambda job: shard_key(job) in selected) if shard else None)
+    print("Planned jobs:")
+    for (job, state, seconds, size) in plan["jobs"]:
+        print("    {} {} qp {}: {}{}".format(job.test._test_name, job.seq, job.qp, state,
+                                         " ({} s)".format(round(seconds, 1)) if seconds is not None else ""))
+    num_run = sum(1 for job in plan["jobs"] if job[1] == "run")
+    print("{} of {} jobs need to be run.".format(num_run, len(plan["jobs"])))
+    print("Estimated CPU time: {:.2f} core hours".format(plan["cpu_hours"]))
+    print("Estimated wall clock time with {} workers and {} cores: {:.2f} hours".format(cfg.job_workers, cfg.core_budget, plan["wall_hours"]))
+    print("Estimated disk space for bitstreams and logs: {:.2f} GB".format(plan["disk_bytes"] / 1024**3))
+    if plan["unknown"]:
+        print("{} jobs have no timing history and are not included in the time estimates.".format(plan["unknown"]))
+    return plan
 
 """
 Run given tests and write results to a exel file
@@ -372,23 +481,72 @@ Run given tests and write results to a exel file
 @param layer_combi: Given tests are combined as like they were layers
 @param layers: A dict with test names as keys containing a list of layers to include in summary
 @param s2_base: Test name of the s2 summary that should be the base of the comparison
+@param interleave: Give a list of test names that are compared against each other. Their jobs with the same sequence and qp are run back to back in alternating order so that timing differences are not caused by changes in the host load
+@param shard: Only run shard "i/N" of the jobs split by estimated cost and skip writing results. Defaults to cfg.shard
+@param merge: Results folders of shard runs that are combined into the result files before running. Defaults to cfg.shard_merge
+@param dry_run: Only list the jobs with estimates of the run time and disk usage. See planTests
 """
-def runTests( tests, outname, *summary_defs, combi = [], layer_combi = [], input_res = False):
+def runTests( tests, outname, *summary_defs, combi = [], layer_combi = [], input_res = False, interleave = [], shard = None, merge = [], dry_run = False):
+    profiler = PhaseProfiler(cfg.profile_output, cfg.profile_memory).start()
+    try:
+        return __runTests(tests, outname, *summary_defs, combi = combi, layer_combi = layer_combi, input_res = input_res, interleave = interleave, shard = shard, merge = merge, dry_run = dry_run)
+    finally:
+        profiler.stop()
+        if cfg.profile_phases or cfg.profile_output or cfg.profile_memory:
+            print(profiler.report())
+
+def __runTests( tests, outname, *summary_defs, combi, layer_combi, input_res, interleave, shard, merge, dry_run):
+    shard = shard if shard else cfg.shard
+    merge = merge if merge else cfg.shard_merge
+    if dry_run:
+        with phase("plan"):
+            return planTests(tests, shard)
+    if merge:
+        with phase("merge shards"):
+            mergeShards(tests, merge)
+    if shard:
+        with phase("run shard"):
+            __runShard(tests, shard)
+        return
     print('Start running tests...')
+    scheduler = JobScheduler()
     nt = 1
-    for test in tests:
-        #print("Running test {}...".format(test._test_name))
-        print_out = "[{}/{}] ".format(nt,len(tests))
-        print(print_out, end='\r')
-        test.run(print_out, input_res)
-        nt += 1
+    with phase("load results"):
+        for test in tests:
+            #Load existing results and queue jobs for the rest
+            with phase("test " + test._test_name):
+                if test._results_exist() or input_res:
+                    test.run("[{}/{}] ".format(nt,len(tests)), input_res)
+                    scheduler.add_history(test)
+                else:
+                    scheduler.add_test(test)
+            nt += 1
+    for group in interleave:
+        scheduler.add_group([test for test in tests if test._test_name in group])
+    if scheduler.num_tests() > 0:
+        print("Running {} jobs...".format(scheduler.num_jobs()))
+        def save_test(test, job_results):
+            test._set_job_results(job_results)
+            test._save_results()
+        with phase("run jobs"):
+            failed = scheduler.run(save_test)
+        if failed:
+            print("Failed jobs:")
+            for job in scheduler.failed_jobs:
+                print("    {} {} qp {}: {}".format(job.test._test_name, job.seq, job.qp, job.status))
+            raise RuntimeError("Jobs failed for tests: {}".format(", ".join(test._test_name for test in failed)))
     print('Tests complete.')
     print('Writing results to file {}...'.format(cfg.results + outname + __FILE_END))
-    res = __parseTestResults(tests)
-    res = __combiTestResults(res,combi,layer_combi)
-
-    wb = xl.load_workbook(cfg.exel_template,keep_vba=True)
-    wb.remove(wb.active) #Remove un-used sheet
-    __writeResults(wb,res,summary_defs)
-    wb.save(cfg.results + outname + __FILE_END)
+    with phase("parse results"):
+        res = __parseTestResults(tests)
+    with phase("combine results"):
+        res = __combiTestResults(res,combi,layer_combi)
+
+    with phase("load template"):
+        wb = xl.load_workbook(cfg.exel_template,keep_vba=True)
+        wb.remove(wb.active) #Remove un-used sheet
+    with phase("write results"):
+        __writeResults(wb,res,summary_defs)
+    with phase("save workbook"):
+        wb.save(cfg.results + outname + __FILE_END)
     print('Done.')
@@ -142,13 +142,13 @@ make BDBRMatrix definition ()
 @param test_names names for tests that are used in the definition
 @param layering_func function that takes in test names and outputs layers to be included
 @param filter_func optional function for selecting tests from test_names
-@param write_* used for selecting what types of results to include
+@param write_* used for selecting what types of results to include. write_time_ci adds the confidence intervals of the time comparisons
 @param name name used for the summary definition
 @return a BDBRMatrix definition
 """
-def make_BDBRMatrix_definition(test_names: Iterable[str], layering_func: Callable[[str],Sequence[int]] = lambda _: (-1,), filter_func: Callable[[str],bool] = lambda _: True, write_bdbr: bool = True, write_bits: bool = True, write_psnr: bool = True, write_time: bool = True, name: str = "") -> dict:
+def make_BDBRMatrix_definition(test_names: Iterable[str], layering_func: Callable[[str],Sequence[int]] = lambda _: (-1,), filter_func: Callable[[str],bool] = lambda _: True, write_bdbr: bool = True, write_bits: bool = True, write_psnr: bool = True, write_time: bool = True, name: str = "", write_time_ci: bool = False) -> dict:
     layers = {name : layering_func(name) if filter_func(name) else tuple() for name in test_names}
-    return create_BDBRMatrix_definition(layers, write_bdbr, write_bits, write_psnr, write_time, name)
+    return create_BDBRMatrix_definition(layers, write_bdbr, write_bits, write_psnr, write_time, name, write_time_ci)
 
 T = TypeVar('T')
 Layer_func_t = Callable[[T], Iterable[Union[Tuple[str, int], T]]]
@@ -174,11 +174,13 @@ def layerFuncFactory(layers: Iterable[Iterable[Union[int, None]]], conds: Iterab
 make AnchorList definition using a single anchor for all tests
 @param global_anchor/*_anchor name of anchor used for all tests across all the types of tests or the specified types of tests (can override global). None can be specified to get absolute values (not applicable to bdbr). Anchors may be of form (<test_name>,<target_layer>)
 @param global_tests/*_tests names of tests to include in all or the specidied types of tests (can override global)
+@param usage_anchor/usage_tests anchor and tests for measured wall time, CPU time and peak memory comparisons. Not included by the global values
+@param time_ci also show the confidence intervals of the time comparisons
 @param test_filter filter anchor-test pairs 
 @param layer_func return either input test name or a tuple of (<test_name>,<target_layer>) for tests
 @param name name used for the summary definition
 """
-def make_AnchorList_singleAnchor_definition(global_anchor: str = None, global_tests: Iterable[str] = None, *, bdbr_anchor: Union[str, Tuple[str, int]] = None, bdbr_tests: Iterable[str] = None, bits_anchor: Union[str, Tuple[str, int]] = None, bits_tests: Iterable[str] = None, psnr_anchor: Union[str, Tuple[str, int]] = None, psnr_tests: Iterable[str] = None, time_anchor: Union[str, Tuple[str, int]] = None, time_tests: Iterable[str] = None, test_filter: Callable[[str, str], bool] = lambda *_: True, layer_func: Layer_func_t = lambda t: (t,), name: str = "") -> dict:
+def make_AnchorList_singleAnchor_definition(global_anchor: str = None, global_tests: Iterable[str] = None, *, bdbr_anchor: Union[str, Tuple[str, int]] = None, bdbr_tests: Iterable[str] = None, bits_anchor: Union[str, Tuple[str, int]] = None, bits_tests: Iterable[str] = None, psnr_anchor: Union[str, Tuple[str, int]] = None, psnr_tests: Iterable[str] = None, time_anchor: Union[str, Tuple[str, int]] = None, time_tests: Iterable[str] = None, usage_anchor: Union[str, Tuple[str, int]] = None, usage_tests: Iterable[str] = None, time_ci: bool = False, test_filter: Callable[[str, str], bool] = lambda *_: True, layer_func: Layer_func_t = lambda t: (t,), name: str = "") -> dict:
     #Set global values
     layered_bdbr = layered_bits = layered_psnr = layered_time = None
     if global_anchor:
@@ -195,12 +197,19 @@ def make_AnchorList_singleAnchor_definition(global_anchor: str = None, global_te
         layered_psnr = [(test_l, (psnr_anchor,)) for test in psnr_tests if test_filter(psnr_anchor,test) for test_l in layer_func(test)]
     if time_tests:
         layered_time = [(test_l, (time_anchor,)) for test in time_tests if test_filter(time_anchor,test) for test_l in layer_func(test)]
+    layered_usage = None
+    if usage_tests:
+        layered_usage = [(test_l, (usage_anchor,)) for test in usage_tests if test_filter(usage_anchor,test) for test_l in layer_func(test)]
 
     return create_AnchorList_definition(bdbr_def = layered_bdbr,
                                         bits_def = layered_bits,
                                         psnr_def = layered_psnr,
                                         time_def = layered_time,
-                                        name = name)
+                                        name = name,
+                                        wall_def = layered_usage,
+                                        cpu_def = layered_usage,
+                                        rss_def = layered_usage,
+                                        time_ci_def = layered_time if time_ci else None)
 
 """
 Make AnchorList definition with per test anchors
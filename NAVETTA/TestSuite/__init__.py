@@ -1,6 +1,6 @@
-from .TestSuite import runTests
+from .TestSuite import runTests, mergeShards, planTests
 import TestSuite.TestUtils as TestUtils
 from .TestUtils import TestParameterGroup
 from .SummaryFactory import SummaryType
 
-__all__ = ["runTests", "SummaryType", "TestParameterGroup", "TestUtils"]
\ No newline at end of file
+__all__ = ["runTests", "mergeShards", "planTests", "SummaryType", "TestParameterGroup", "TestUtils"]
\ No newline at end of file
@@ -1,3 +1,4 @@
+from JobRunner import *
 from TestInstances import *
 from TestSuite import *
 from tests import *
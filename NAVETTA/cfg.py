@@ -3,6 +3,7 @@ Configure parameters
 """
 
 from os.path import abspath
+from os import cpu_count
 
 sequence_path = r"D:\seqs\\"
 bin_path = r"D:\bins\\"
@@ -15,6 +16,31 @@ results = r"F:\r\NAVETTA\\"#r"D:\r\notvenctester\\"#r"F:\r\NAVETTA\\"
 decoder_bin = f"{bin_path}TAppDecoder.exe" #Used for verifying encodings
 
 exel_template = abspath(r"..\BD-rate-template.xlsm")
+result_db = r"results.sqlite" #SQLite database in the results folder where test results are stored. Import result files of older runs with python -m TestInstances.ResultStore. None stores results as JSON files
+
+#Job runner settings
+job_workers = cpu_count() #Max number of encode jobs run in parallel by runTests
+core_budget = cpu_count() #Max number of encoder threads running at the same time
+job_cache = True #Reuse results of identical encodes from any test
+job_timeout = None #Wall clock time limit in seconds for a single encode job. None for no limit
+job_timeout_retries = 1 #Number of times a timed out job is started again before it is marked as failed
+job_memory_limit = None #Address space limit in MB for each encoder and decoder process (Unix only). None for no limit
+job_affinity = False #Pin each encode job to its own NUMA local set of cores matching its thread count (Linux only)
+job_coordinator = None #Address "host:port" or Unix socket path where worker agents (python -m JobRunner.Agent <address>) connect to run the jobs. None runs jobs locally
+job_agent_retries = 2 #Number of times a job is started again after its worker agent is lost before it is marked as failed
+job_daemon = None #Unix socket path of the job daemon (python -m JobRunner.Daemon <path>) shared by all test scripts on the host. None uses the local core budget
+job_keep_bitstreams = True #Write encoded bitstreams to disk. If False, bitstreams of tests that are not validated are streamed through a pipe and only their size is kept (Unix only)
+job_hash_bitstreams = False #Store the SHA-256 of each bitstream in the results
+job_compress_logs = False #Keep a gzip compressed copy of each encoder log next to the bitstream. Results only store the metrics parsed from the log
+job_event_log = r"job_events.jsonl" #File in the results folder where job lifecycle events are appended. Build a timeline report with python -m JobRunner.EventReport. None to disable
+job_progress_interval = 60 #Seconds between progress lines when the output is redirected to a file. On a terminal progress is updated live
+validation_workers = 2 #Max number of decoders validating encoder outputs at the same time
+shard = None #Run only shard i of N of the jobs given as "i/N". Set with --shard i/N when running tests from the tests package
+shard_merge = [] #Result folders of shard runs merged into the result files before running tests. Set with --merge dir1,dir2
+timing_confidence = 0.95 #Confidence level of the encoding time interval for tests with repeated timing runs
+profile_phases = True #Print the time spent in each phase of runTests (loading, running, parsing, writing sheets and summaries, saving) at the end of the run
+profile_output = None #File where cProfile statistics of runTests are written (view with python -m pstats <file>). None to disable
+profile_memory = False #Trace memory allocations of runTests with tracemalloc and report allocations and peak memory of each phase. Slows down the run
 
 #Sequence list. Use Class slices to get specific groups. Sequence_names has simplified names for each sequence
 hevc_A = slice(0,2)
@@ -6,6 +6,7 @@ import pkgutil as pkgu
 import sys
 import os
 import runpy
+import cfg
 
 test_scripts = {} #Dict of all test scripts in the tests package and the respective entry points 
 
@@ -18,10 +19,29 @@ for loader, module_name, is_pkg in pkgu.walk_packages(__path, ""):
         test_scripts[module_name] = getattr(module, "main", lambda: runpy.run_module(module))
         
 
+"""
+Remove shard options from the argument list and store them in cfg
+--shard i/N runs only shard i of N of the jobs
+--merge dir1,dir2 merges results of shard runs before running tests
+@return the remaining arguments
+"""
+def parse_shard_args(args):
+    rest = []
+    args = iter(args)
+    for arg in args:
+        if arg == "--shard":
+            cfg.shard = next(args, None)
+        elif arg == "--merge":
+            cfg.shard_merge = [path for path in next(args, "").split(",") if path]
+        else:
+            rest.append(arg)
+    return rest
+
 def main():
+    args = parse_shard_args(sys.argv[1:])
     # Get (a list of) test scripts to run
-    if len(sys.argv) > 1:
-        scripts = sys.argv[1:]
+    if len(args) > 0:
+        scripts = args
     else:
         scripts = map(str.strip, input("Give test scripts to run as a comma separated list: ").split(sep = ','))
 